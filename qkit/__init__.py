@@ -66,6 +66,9 @@ print ("QKIT configuration initialized -> available as qkit.cfg[...]")
 """
 startup functions
 """
+# timing of the init stages after qkit.start(), see qkit.core.startup
+startup_report = None
+
 # start initialization (qkit/core/init)
 def start():
     print("Starting QKIT framework ... -> qkit.core.startup")
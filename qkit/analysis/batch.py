@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Batch analysis of many h5 files with a process pool.
+
+An analysis is a plain (picklable) function analysis(path, **kwargs), which
+works on one h5 file, e.g. stores fits or derived datasets in analysis0,
+and returns a dict of scalar results. The results are written back to the
+file with Data.add_fid_param(), so they show up as columns in qkit.fid.
+
+The results are cached in qkit.cfg['logdir']/batch_cache.db together with
+the mtime and size of the file after the analysis. Files which did not
+change since the last run with the same analysis and arguments are skipped.
+
+usage:
+    from qkit.analysis.batch import BatchAnalysis, fit_resonator
+    ba = BatchAnalysis(fit_resonator, fit='lorentzian', fit_all=True)
+    results = ba.run(qkit.fid.query(run='cooldown7', name_like='resonator'))
+"""
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import numpy as np
+
+import qkit
+from qkit.storage import store
+
+# fit name: (Resonator method, result datasets in analysis0)
+resonator_fits = {
+    'lorentzian': ('fit_lorentzian', ['lrnz_f0', 'lrnz_ql', 'lrnz_chi2']),
+    'skewed_lorentzian': ('fit_skewed_lorentzian', ['sklr_f0', 'sklr_qr', 'sklr_qi', 'sklr_chi2']),
+    'fano': ('fit_fano', ['fano_fr', 'fano_Ql', 'fano_Q0', 'fano_chi2']),
+    'circle': ('fit_circle', ['circ_fr', 'circ_Ql', 'circ_Qi_dia_corr', 'circ_absQc', 'circ_Qi', 'circ_Qc',
+                              'circ_chi_square']),
+}
+
+
+def fit_resonator(path, fit='lorentzian', **kwargs):
+    """
+    Fits the resonator data of a file with qkit.analysis.resonator.Resonator.
+
+    Args:
+        path: h5 file with frequency, amplitude and phase datasets.
+        fit: 'lorentzian', 'skewed_lorentzian', 'fano' or 'circle'.
+        **kwargs: arguments of the fit function, e.g. fit_all, f_min, f_max.
+
+    Returns:
+        dict with the fit results of the last trace.
+    """
+    from qkit.analysis.resonator import Resonator
+    if fit not in resonator_fits:
+        logging.error("Batch analysis: Unknown resonator fit '%s'." % fit)
+        raise ValueError
+    method, result_names = resonator_fits[fit]
+    res = Resonator(path)
+    try:
+        getattr(res, method)(**kwargs)
+        results = {}
+        for name in result_names:
+            try:
+                value = np.atleast_1d(res._hf['/entry/analysis0/' + name])
+            except KeyError:
+                continue
+            if len(value):
+                results[name] = float(value[-1])
+    finally:
+        res.close()
+    return results
+
+
+def _run_analysis(args):
+    """Runs one analysis in a worker process, returns (path, results, error, mtime, size)."""
+    analysis, path, kwargs = args
+    try:
+        results = analysis(path, **kwargs)
+        if results:
+            d = store.Data(path)
+            try:
+                for param, value in results.items():
+                    d.add_fid_param(param, value)
+            finally:
+                d.close_file()
+    except Exception as e:
+        return path, None, "%s: %s" % (type(e).__name__, e), None, None
+    st = os.stat(path)
+    return path, results, None, st.st_mtime, st.st_size
+
+
+class BatchAnalysis(object):
+    """
+    Runs an analysis on many h5 files in a process pool.
+
+    Args:
+        analysis: function analysis(path, **kwargs) returning a dict of scalar
+            results. It has to be defined on module level to be sent to the
+            worker processes. Default: fit_resonator.
+        workers: number of worker processes, default: number of cpus.
+        use_cache: skip files which did not change since the last run.
+        **kwargs: arguments for the analysis function.
+    """
+    _cache_path = os.path.join(qkit.cfg['logdir'], "batch_cache.db")
+
+    def __init__(self, analysis=fit_resonator, workers=None, use_cache=True, **kwargs):
+        self.analysis = analysis
+        self.kwargs = kwargs
+        self.workers = workers or multiprocessing.cpu_count()
+        self.use_cache = use_cache
+        self.errors = {}
+        self._key = "%s.%s%s" % (analysis.__module__, analysis.__name__, repr(sorted(kwargs.items())))
+
+    def _connect_cache(self):
+        db = sqlite3.connect(self._cache_path, timeout=30)
+        db.execute("CREATE TABLE IF NOT EXISTS results (path TEXT, analysis TEXT, mtime REAL, size INTEGER,"
+                   " results BLOB, PRIMARY KEY (path, analysis))")
+        return db
+
+    def _get_paths(self, files):
+        """
+        files can be a list of UUIDs and/or paths or a dict with the
+        arguments of qkit.fid.query().
+        """
+        if isinstance(files, dict):
+            files = qkit.fid.query(**files)
+        paths = []
+        for f in files:
+            if os.path.isfile(f):
+                paths.append(os.path.abspath(f))
+            elif hasattr(qkit, 'fid') and qkit.fid.get(f):
+                paths.append(qkit.fid.get(f))
+            else:
+                logging.error("Batch analysis: Can not find '%s'." % f)
+        return paths
+
+    def run(self, files):
+        """
+        Analyses the files and writes the results back.
+
+        Args:
+            files: list of UUIDs or paths, or a dict with the arguments of
+                qkit.fid.query().
+
+        Returns:
+            dict path: results. Failed files are listed in self.errors.
+        """
+        start_time = time.time()
+        paths = self._get_paths(files)
+        results = {}
+        self.errors = {}
+        db = self._connect_cache()
+        try:
+            jobs = []
+            for path in paths:
+                row = db.execute("SELECT mtime, size, results FROM results WHERE path=? AND analysis=?",
+                                 (path, self._key)).fetchone()
+                if self.use_cache and row is not None:
+                    st = os.stat(path)
+                    if (row[0], row[1]) == (st.st_mtime, st.st_size):
+                        results[path] = pickle.loads(bytes(row[2]))
+                        continue
+                jobs.append((self.analysis, path, self.kwargs))
+            n_cached = len(results)
+
+            if self.workers > 1 and len(jobs) > 1:
+                pool = multiprocessing.Pool(min(self.workers, len(jobs)))
+                try:
+                    done = pool.imap_unordered(_run_analysis, jobs)
+                    self._collect(db, done, results)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                self._collect(db, map(_run_analysis, jobs), results)
+        finally:
+            db.close()
+        print("Batch analysis of %i files (%i cached, %i failed) in %.1f seconds." % (
+            len(paths), n_cached, len(self.errors), time.time() - start_time))
+        return results
+
+    def _collect(self, db, done, results):
+        for path, res, error, mtime, size in done:
+            if error is not None:
+                logging.error("Batch analysis of '%s' failed: %s" % (path, error))
+                self.errors[path] = error
+                continue
+            results[path] = res
+            db.execute("INSERT OR REPLACE INTO results VALUES (?,?,?,?,?)",
+                       (path, self._key, mtime, size, sqlite3.Binary(pickle.dumps(res, protocol=2))))
+            db.commit()
+            if hasattr(qkit, 'fid'):
+                # update the file info database with the new attributes
+                try:
+                    qkit.fid._add(path)
+                except Exception as e:
+                    logging.debug("Batch analysis: Could not update qkit.fid for '%s': %s" % (path, e))
@@ -3,6 +3,7 @@
 #import h5py
 import numpy as np
 import logging
+import multiprocessing
 
 import qkit
 from qkit.storage import store
@@ -12,6 +13,52 @@ from scipy.optimize import leastsq
 from scipy.ndimage import gaussian_filter1d
 from scipy.ndimage.filters import median_filter
 
+def _lorentzian_residuals(p,x,y):
+    f0,k,a,offs=p
+    err = y-(a/(1+4*((x-f0)/k)**2)+offs)
+    return err
+
+def _skewed_residuals_start(p,x,y,A1a,A3a,fra):
+    A2, A4, Qr = p
+    err = y -(A1a+A2*(x-fra)+(A3a+A4*(x-fra))/(1.+4.*Qr**2*((x-fra)/fra)**2))
+    return err
+
+def _skewed_residuals(p,x,y):
+    A1, A2, A3, A4, fr, Qr = p
+    err = y -(A1+A2*(x-fr)+(A3+A4*(x-fr))/(1.+4.*Qr**2*((x-fr)/fr)**2))
+    return err
+
+def _leastsq_lorentzian(x,y,p0):
+    return leastsq(_lorentzian_residuals,p0,args=(x,y))[0]
+
+def _leastsq_skewed_lorentzian(x,y,p0):
+    A1a, A3a, fra = p0
+    A2a, A4a, Qra = leastsq(_skewed_residuals_start,[0., 0., 1e3],args=(x,y,A1a,A3a,fra))[0]
+    return leastsq(_skewed_residuals,[A1a, A2a, A3a, A4a, fra, Qra],args=(x,y))[0]
+
+def _leastsq_circle(x,z,reflection):
+    if reflection:
+        port = circuit.reflection_port(f_data = x)
+    else:
+        port = circuit.notch_port(f_data = x)
+    port.z_data_raw = z
+    port.autofit()
+    return port.z_data_sim, dict(port.fitresults)
+
+def _fit_rows(args):
+    '''
+    fits the traces of a block one after the other, failed fits return None.
+    module level function to be used in a process pool.
+    '''
+    fit, x, rows, p0s = args
+    results = []
+    for y, p0 in zip(rows, p0s):
+        try:
+            results.append(fit(x,y,p0))
+        except:
+            results.append(None)
+    return results
+
 class Resonator(object):
     '''
     Resonator class for fitting (live or after measurement) amplitude and phase data at multiple functions. The data is stored in .h5-files, having a NeXus compatible organization.
@@ -29,6 +76,16 @@ class Resonator(object):
         res.fit_lorentzian(fit_all=True,f_min=5.667e9,f_max=5.668e9)
         res.fit_fano(fit_all=True)
         res.fit_circle(fit_all=True,f_max=5.668e9)
+
+    With fit_all=True the initial guesses for all traces are estimated at once
+    and the fit results are written to the file in one pass. The nonlinear fits
+    of the traces can be distributed to a process pool:
+        res.workers = 4
+
+    For live fitting (fit_all=False) only the last trace is read from the file.
+    The trace can also be handed over directly, e.g. right after it was appended
+    in a measurement, so the file is not read at all:
+        res.fit_lorentzian(trace=(data_amp, data_pha))
     '''
 
     def __init__(self, hf_path):
@@ -42,6 +99,10 @@ class Resonator(object):
         self._do_prefilter_data = False
         self.pre_filter_params = []
         self._debug = False
+        self.workers = 1
+        self._f_range = None # (f_min, f_max, number of frequency points) of the cached mask
+        self._batch_hf = None # file switched into the buffered mode by _start_batch_write()
+        self._was_buffered = False
 
         # these ds_url should always be present in a resonator measurement
         self.ds_url_amp = "/entry/data0/amplitude"
@@ -72,10 +133,12 @@ class Resonator(object):
         input:
         hf (HDF5-file)
         '''
+        self._stop_batch_write()
         self._hf=hf
         self._prepare()
 
     def close(self):
+        self._stop_batch_write()
         self._hf.close()
 
     def set_x_coord(self,x_co):
@@ -135,13 +198,7 @@ class Resonator(object):
         the fit functions are fitted only in this area
         the data in the .h5-file is NOT changed
         '''
-        if data.ndim == 1:
-            return data[(self._frequency >= self._f_min) & (self._frequency <= self._f_max)]
-        if data.ndim == 2:
-            ret_array=np.empty(shape=(data.shape[0],self._fit_frequency.shape[0]),dtype=np.float64)
-            for i,a in enumerate(data):
-                ret_array[i]=data[i][(self._frequency >= self._f_min) & (self._frequency <= self._f_max)]
-            return ret_array
+        return data[..., self._f_mask]
 
     def _get_datasets(self):
         '''
@@ -155,8 +212,7 @@ class Resonator(object):
         self._ds_pha = self._hf.get_dataset(self.ds_url_pha)
         self._ds_type = self._ds_amp.ds_type
 
-        self._amplitude = np.array(self._hf[self.ds_url_amp],dtype=np.float64)
-        self._phase = np.array(self._hf[self.ds_url_pha],dtype=np.float64)
+        # amplitude and phase are read by _update_data() before each fit
         self._frequency = np.array(self._hf[self.ds_url_freq],dtype=np.float64)
 
         try:
@@ -179,43 +235,119 @@ class Resonator(object):
         prepares the data to be fitted:
         f_min (float): lower boundary
         f_max (float): upper boundary
+
+        the frequency mask and the analysis frequency coordinate are only
+        computed once for a frequency range, live fits reuse them.
         '''
+        f_range = (f_min, f_max, len(self._frequency))
+        if f_range != self._f_range:
+            self._f_min = np.min(self._frequency)
+            self._f_max = np.max(self._frequency)
 
-        self._f_min = np.min(self._frequency)
-        self._f_max = np.max(self._frequency)
+            '''
+            f_min f_max do not have to be exactly an entry in the freq-array
+            '''
+            if f_min:
+                above = self._frequency > f_min
+                if np.any(above):
+                    self._f_min = self._frequency[np.argmax(above)]
+            if f_max:
+                above = self._frequency > f_max
+                if np.any(above):
+                    self._f_max = self._frequency[np.argmax(above)]
 
-        '''
-        f_min f_max do not have to be exactly an entry in the freq-array
-        '''
-        if f_min:
-            for freq in self._frequency:
-                if freq > f_min:
-                    self._f_min = freq
-                    break
-        if f_max:
-            for freq in self._frequency:
-                if freq > f_max:
-                    self._f_max = freq
-                    break
+            self._f_mask = (self._frequency >= self._f_min) & (self._frequency <= self._f_max)
+            self._fit_frequency = np.array(self._set_data_range(self._frequency))
+
+            self._frequency_co = self._hf.add_coordinate('frequency',folder='analysis', unit = 'Hz')
+            self._frequency_co.add(self._fit_frequency)
+            self._f_range = f_range
 
         '''
         cut the data-arrays with f_min/f_max and fit_all information
         '''
-        self._fit_frequency = np.array(self._set_data_range(self._frequency))
         self._fit_amplitude = np.array(self._set_data_range(self._amplitude))
         self._fit_phase = np.array(self._set_data_range(self._phase))
 
-        self._frequency_co = self._hf.add_coordinate('frequency',folder='analysis', unit = 'Hz')
-        self._frequency_co.add(self._fit_frequency)
-
-    def _update_data(self):
-        self._amplitude = np.array(self._hf[self.ds_url_amp],dtype=np.float64)
-        self._phase = np.array(self._hf[self.ds_url_pha],dtype=np.float64)
+    def _update_data(self, trace=None):
+        '''
+        reads the data to be fitted:
+        trace (tuple): (amplitude, phase) of the last trace, no data is read from the file (optional)
+        with fit_all all written traces are read, otherwise only the last written trace of a value matrix.
+        rows of a preallocated matrix without data are skipped (see hdf_file.filled_rows()).
+        '''
+        if trace is not None:
+            self._amplitude = np.array(trace[0],dtype=np.float64)
+            self._phase = np.array(trace[1],dtype=np.float64)
+            return
+        ds_amp = self._hf[self.ds_url_amp]
+        ds_pha = self._hf[self.ds_url_pha]
+        rows = self._hf.hf.filled_rows(ds_amp)
+        if not self._fit_all and ds_amp.ndim == 2:
+            self._amplitude = np.array(ds_amp[max(rows, 1)-1],dtype=np.float64)
+            self._phase = np.array(ds_pha[max(rows, 1)-1],dtype=np.float64)
+        else:
+            self._amplitude = np.array(ds_amp[:rows],dtype=np.float64)
+            self._phase = np.array(ds_pha[:rows],dtype=np.float64)
 
     def _get_starting_values(self):
         pass
+
+    def _fit_all_rows(self, fit, rows, p0s):
+        '''
+        runs the nonlinear fit for all traces (rows), in a pool of self.workers
+        processes if there is more than one trace.
+        returns a list with the results, None for failed fits
+        '''
+        workers = min(self.workers, len(rows))
+        if workers <= 1:
+            return _fit_rows((fit, self._fit_frequency, rows, p0s))
+        blocks = [b for b in np.array_split(np.arange(len(rows)), 4*workers) if len(b)]
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_fit_rows, [(fit, self._fit_frequency, [rows[i] for i in b], [p0s[i] for i in b]) for b in blocks])
+        finally:
+            pool.close()
+            pool.join()
+        return [r for block in results for r in block]
+
+    def _fit_params(self, results, n_params):
+        '''
+        stacks the fit results to an array (traces, n_params), failed fits are NaN
+        '''
+        params = np.full((len(results), n_params), np.nan)
+        for i, p in enumerate(results):
+            if p is not None:
+                params[i] = p
+        return params
+
+    def _start_batch_write(self):
+        '''
+        collects the appended fit results in memory, they are written in
+        blocks by _end_batch_write() instead of trace by trace.
+        the buffered mode of the file is switched on only once, on live fits
+        it stays on until set_file() or close() (see _stop_batch_write())
+        '''
+        if self._batch_hf is self._hf:
+            return
+        self._stop_batch_write()
+        self._batch_hf = self._hf
+        self._was_buffered = self._hf.hf.buffered
+        if not self._was_buffered:
+            self._hf.set_buffering(True)
+
+    def _end_batch_write(self):
+        self._hf.flush()
+
+    def _stop_batch_write(self):
+        '''
+        restores the write mode of the file, unless it was closed before
+        '''
+        if self._batch_hf is not None and not self._was_buffered and self._batch_hf.hf.hf:
+            self._batch_hf.set_buffering(False)
+        self._batch_hf = None
     
-    def fit_circle(self,reflection = False, notch = False, fit_all = False, f_min = None, f_max=None):
+    def fit_circle(self,reflection = False, notch = False, fit_all = False, f_min = None, f_max=None, trace=None):
         self._fit_all = fit_all
         self._circle_reflection = reflection
         self._circle_notch = notch
@@ -225,7 +357,7 @@ class Resonator(object):
         if not self._datasets_loaded:
             self._get_datasets()
 
-        self._update_data()
+        self._update_data(trace)
         self._prepare_f_range(f_min, f_max)
         
         if self._first_circle:
@@ -249,37 +381,44 @@ class Resonator(object):
         fit_all (bool): True or False, default: False. Whole data (True) or only last "slice" (False) is fitted (optional)
         '''
 
+        self._start_batch_write()
         self._get_data_circle()
-        trace = 0
-        self.debug("circle fit:")
         for z_data_raw in self._z_data_raw:
-            
             z_data_raw.real = self._pre_filter_data(z_data_raw.real)
             z_data_raw.imag = self._pre_filter_data(z_data_raw.imag)
-            self.debug("fitting trace: "+str(trace))
-            self._circle_port.z_data_raw = z_data_raw
-            
-            try:
-                self._circle_port.autofit()
-            except:
-                err=np.array([np.nan for f in self._fit_frequency])
-                self._circ_amp_gen.append(err)
-                self._circ_pha_gen.append(err)
-                self._circ_real_gen.append(err)
-                self._circ_imag_gen.append(err)
-
-                for key in self._results.iterkeys():
-                    self._results[str(key)].append(np.nan)
 
+        self.debug("circle fit: %i traces" % len(self._z_data_raw))
+        if min(self.workers, len(self._z_data_raw)) > 1:
+            fits = self._fit_all_rows(_leastsq_circle, self._z_data_raw, [self._circle_reflection]*len(self._z_data_raw))
+        else:
+            fits = []
+            for z_data_raw in self._z_data_raw:
+                self._circle_port.z_data_raw = z_data_raw
+                try:
+                    self._circle_port.autofit()
+                except:
+                    fits.append(None)
+                else:
+                    fits.append((self._circle_port.z_data_sim, self._circle_port.fitresults))
+
+        err = np.full(self._fit_frequency.shape, np.nan)
+        results = {key: [] for key in self._results.keys()}
+        for fit in fits:
+            if fit is None:
+                z_data_sim = err
+                for key in results.keys():
+                    results[key].append(np.nan)
             else:
-                self._circ_amp_gen.append(np.absolute(self._circle_port.z_data_sim))
-                self._circ_pha_gen.append(np.angle(self._circle_port.z_data_sim))
-                self._circ_real_gen.append(np.real(self._circle_port.z_data_sim))
-                self._circ_imag_gen.append(np.imag(self._circle_port.z_data_sim))
-
-                for key in self._results.iterkeys():
-                    self._results[str(key)].append(float(self._circle_port.fitresults[str(key)]))
-            trace+=1
+                z_data_sim, fitresults = fit
+                for key in results.keys():
+                    results[key].append(float(fitresults[str(key)]))
+            self._circ_amp_gen.append(np.absolute(z_data_sim))
+            self._circ_pha_gen.append(np.angle(z_data_sim))
+            self._circ_real_gen.append(np.real(z_data_sim))
+            self._circ_imag_gen.append(np.imag(z_data_sim))
+        for key in results.keys():
+            self._results[str(key)].append(np.array(results[key]))
+        self._end_batch_write()
 
     def _prepare_circle(self):
         '''
@@ -359,11 +498,10 @@ class Resonator(object):
             self._data_imag_gen.append(self._z_data_raw[0].imag)
 
         if self._fit_all:
-            self._z_data_raw = np.empty((self._fit_amplitude.shape), dtype=np.complex64)
-            for i,a in enumerate(self._fit_amplitude):
-                self._z_data_raw[i] = self._fit_amplitude[i]*np.exp(1j*self._fit_phase[i])
-                self._data_real_gen.append(self._z_data_raw[i].real)
-                self._data_imag_gen.append(self._z_data_raw[i].imag)
+            self._z_data_raw = np.atleast_2d(np.array(self._fit_amplitude*np.exp(1j*self._fit_phase),dtype=np.complex64))
+            for z_data_raw in self._z_data_raw:
+                self._data_real_gen.append(z_data_raw.real)
+                self._data_imag_gen.append(z_data_raw.imag)
 
     def _get_last_amp_trace(self):
         tmp_amp = np.empty((1,self._fit_frequency.shape[0]))
@@ -374,7 +512,7 @@ class Resonator(object):
         self._fit_amplitude = np.empty((1,self._fit_frequency.shape[0]))
         self._fit_amplitude[0] = tmp_amp[0]
 
-    def fit_lorentzian(self,fit_all = False,f_min=None,f_max=None,pre_filter_data=None):
+    def fit_lorentzian(self,fit_all = False,f_min=None,f_max=None,pre_filter_data=None,trace=None):
         '''
         lorentzian fit for amp data in the f_min-f_max frequency range
         squared amps are fitted at lorentzian using scipy.leastsq
@@ -384,18 +522,14 @@ class Resonator(object):
         fit_all (bool): True or False, default: False. Whole data (True) or only last "slice" (False) is fitted (optional)
         f_min (float): lower boundary for data to be fitted (optional, default: None, results in min(frequency-array))
         f_max (float): upper boundary for data to be fitted (optional, default: None, results in max(frequency-array))
+        trace (tuple): (amplitude, phase) of the last trace, fitted instead of reading the file (optional)
         '''
-        def residuals(p,x,y):
-            f0,k,a,offs=p
-            err = y-(a/(1+4*((x-f0)/k)**2)+offs)
-            return err
-        
         self._fit_all = fit_all
 
         if not self._datasets_loaded:
             self._get_datasets()
 
-        self._update_data()
+        self._update_data(trace)
         self._prepare_f_range(f_min,f_max)
         if self._first_lorentzian:
             self._prepare_lorentzian()
@@ -409,53 +543,49 @@ class Resonator(object):
         if not self._fit_all:
             self._get_last_amp_trace()
 
-        for amplitudes in self._fit_amplitude:
-            amplitudes = np.absolute(amplitudes)
-            amplitudes_sq = amplitudes**2
-            '''extract starting parameter for lorentzian from data'''
-            s_offs = np.mean(np.array([amplitudes_sq[:int(np.size(amplitudes_sq)*.1)], amplitudes_sq[int(np.size(amplitudes_sq)-int(np.size(amplitudes_sq)*.1)):]]))
-            '''offset is calculated from the first and last 10% of the data to improve fitting on tight windows'''
-
-            if np.abs(np.max(amplitudes_sq)-np.mean(amplitudes_sq)) > np.abs(np.min(amplitudes_sq)-np.mean(amplitudes_sq)):
-                '''peak is expected'''
-                s_a = np.abs((np.max(amplitudes_sq)-np.mean(amplitudes_sq)))
-                s_f0 = self._fit_frequency[np.argmax(amplitudes_sq)]
-            else:
-                '''dip is expected'''
-                s_a = -np.abs((np.min(amplitudes_sq)-np.mean(amplitudes_sq)))
-                s_f0 = self._fit_frequency[np.argmin(amplitudes_sq)]
-
-            '''estimate peak/dip width'''
-            mid = s_offs + .5*s_a #estimated mid region between base line and peak/dip
-            m = [] #mid points
-            for i in range(len(amplitudes_sq)-1):
-                if np.sign(amplitudes_sq[i]-mid) != np.sign(amplitudes_sq[i+1]-mid):#mid level crossing
-                    m.append(i)
-            if len(m)>1:
-                s_k = self._fit_frequency[m[-1]]-self._fit_frequency[m[0]]
-            else:
-                s_k = .15*(self._fit_frequency[-1]-self._fit_frequency[0]) #try 15% of window
-            p0=[s_f0, s_k, s_a, s_offs]
-            try:
-                fit = leastsq(residuals,p0,args=(self._fit_frequency,amplitudes_sq))
-            except:
-                self._lrnz_amp_gen.append(np.array([np.nan for f in self._fit_frequency]))
-                self._lrnz_f0.append(np.nan)
-                self._lrnz_k.append(np.nan)
-                self._lrnz_a.append(np.nan)
-                self._lrnz_offs.append(np.nan)
-                self._lrnz_Ql.append(np.nan)
-                self._lrnz_chi2_fit.append(np.nan)
-            else:
-                popt=fit[0]
-                chi2 = self._lorentzian_fit_chi2(popt,amplitudes_sq)
-                self._lrnz_amp_gen.append(np.sqrt(np.array(self._lorentzian_from_fit(popt))))
-                self._lrnz_f0.append(float(popt[0]))
-                self._lrnz_k.append(float(np.fabs(float(popt[1]))))
-                self._lrnz_a.append(float(popt[2]))
-                self._lrnz_offs.append(float(popt[3]))
-                self._lrnz_Ql.append(float(float(popt[0])/np.fabs(float(popt[1]))))
-                self._lrnz_chi2_fit.append(float(chi2))
+        amplitudes_sq = np.atleast_2d(np.absolute(self._fit_amplitude)**2)
+        popt = self._fit_params(self._fit_all_rows(_leastsq_lorentzian, amplitudes_sq, self._lorentzian_guess(amplitudes_sq)), 4)
+        f0, k, a, offs = popt.T
+        amp_gen = a[:,None]/(1+4*((self._fit_frequency-f0[:,None])/k[:,None])**2)+offs[:,None]
+        chi2 = np.sum((amp_gen-amplitudes_sq)**2, axis=1) / (amplitudes_sq.shape[1]-4)
+
+        self._start_batch_write()
+        for amp in np.sqrt(amp_gen):
+            self._lrnz_amp_gen.append(amp)
+        self._lrnz_f0.append(f0)
+        self._lrnz_k.append(np.fabs(k))
+        self._lrnz_a.append(a)
+        self._lrnz_offs.append(offs)
+        self._lrnz_Ql.append(f0/np.fabs(k))
+        self._lrnz_chi2_fit.append(chi2)
+        self._end_batch_write()
+
+    def _lorentzian_guess(self, amplitudes_sq):
+        '''
+        starting parameters [f0, k, a, offs] for the lorentzian fit of all traces (rows) at once
+        '''
+        n = amplitudes_sq.shape[1]
+        n_edge = int(n*.1)
+        '''offset is calculated from the first and last 10% of the data to improve fitting on tight windows'''
+        s_offs = np.mean(np.concatenate([amplitudes_sq[:,:n_edge], amplitudes_sq[:,n-n_edge:]], axis=1), axis=1)
+
+        mean = np.mean(amplitudes_sq, axis=1)
+        d_max = np.abs(np.max(amplitudes_sq, axis=1)-mean)
+        d_min = np.abs(np.min(amplitudes_sq, axis=1)-mean)
+        peak = d_max > d_min # else a dip is expected
+        s_a = np.where(peak, d_max, -d_min)
+        s_f0 = self._fit_frequency[np.where(peak, np.argmax(amplitudes_sq, axis=1), np.argmin(amplitudes_sq, axis=1))]
+
+        '''estimate peak/dip width from the first and last crossing of the mid level between base line and peak/dip'''
+        mid = s_offs + .5*s_a
+        sign = np.sign(amplitudes_sq-mid[:,None])
+        crossing = sign[:,:-1] != sign[:,1:]
+        first = np.argmax(crossing, axis=1)
+        last = n-2-np.argmax(crossing[:,::-1], axis=1)
+        s_k = np.where(np.sum(crossing, axis=1) > 1,
+                       self._fit_frequency[last]-self._fit_frequency[first],
+                       .15*(self._fit_frequency[-1]-self._fit_frequency[0])) #try 15% of window
+        return np.array([s_f0, s_k, s_a, s_offs]).T
 
     def _prepare_lorentzian(self):
         '''
@@ -491,7 +621,7 @@ class Resonator(object):
         chi2 = np.sum((self._lorentzian_from_fit(fit)-amplitudes_sq)**2) / (len(amplitudes_sq)-len(fit))
         return chi2
 
-    def fit_skewed_lorentzian(self, fit_all = False, f_min=None, f_max=None,pre_filter_data=None):
+    def fit_skewed_lorentzian(self, fit_all = False, f_min=None, f_max=None,pre_filter_data=None,trace=None):
         '''
         skewed lorentzian fit for amp data in the f_min-f_max frequency range
         squared amps are fitted at skewed lorentzian using scipy.leastsq
@@ -501,21 +631,13 @@ class Resonator(object):
         fit_all (bool): True or False, default: False. Whole data (True) or only last "slice" (False) is fitted (optional)
         f_min (float): lower boundary for data to be fitted (optional, default: None, results in min(frequency-array))
         f_max (float): upper boundary for data to be fitted (optional, default: None, results in max(frequency-array))
+        trace (tuple): (amplitude, phase) of the last trace, fitted instead of reading the file (optional)
         '''
-        def residuals(p,x,y):
-            A2, A4, Qr = p
-            err = y -(A1a+A2*(x-fra)+(A3a+A4*(x-fra))/(1.+4.*Qr**2*((x-fra)/fra)**2))
-            return err
-        def residuals2(p,x,y):
-            A1, A2, A3, A4, fr, Qr = p
-            err = y -(A1+A2*(x-fr)+(A3+A4*(x-fr))/(1.+4.*Qr**2*((x-fr)/fr)**2))
-            return err
-
         self._fit_all = fit_all
 
         if not self._datasets_loaded:
             self._get_datasets()
-        self._update_data()
+        self._update_data(trace)
 
         self._prepare_f_range(f_min,f_max)
         if self._first_skewed_lorentzian:
@@ -530,50 +652,31 @@ class Resonator(object):
         if not self._fit_all:
             self._get_last_amp_trace()
 
-        for amplitudes in self._fit_amplitude:
-            "fits a skewed lorenzian to reflection amplitudes of a resonator"
-            # prefilter the data
-            amplitudes = self._pre_filter_data(amplitudes)
-
-            amplitudes = np.absolute(amplitudes)
-            amplitudes_sq = amplitudes**2
-
-            A1a = np.minimum(amplitudes_sq[0],amplitudes_sq[-1])
-            A3a = -np.max(amplitudes_sq)
-            fra = self._fit_frequency[np.argmin(amplitudes_sq)]
-
-            p0 = [0., 0., 1e3]
-
-            try:
-                p_final = leastsq(residuals,p0,args=(self._fit_frequency,amplitudes_sq))
-                A2a, A4a, Qra = p_final[0]
-
-                p0 = [A1a, A2a , A3a, A4a, fra, Qra]
-                p_final = leastsq(residuals2,p0,args=(self._fit_frequency,amplitudes_sq))
-                popt=p_final[0]
-            except:
-                self._skwd_amp_gen.append(np.array([np.nan for f in self._fit_frequency]))
-                self._skwd_f0.append(np.nan)
-                self._skwd_a1.append(np.nan)
-                self._skwd_a2.append(np.nan)
-                self._skwd_a3.append(np.nan)
-                self._skwd_a4.append(np.nan)
-                self._skwd_Qr.append(np.nan)
-                self._skwd_chi2_fit.append(np.nan)
-            else:
-                chi2 = self._skewed_fit_chi2(popt,amplitudes_sq)
-                amp_gen = np.sqrt(np.array(self._skewed_from_fit(popt)))
-
-                self._skwd_amp_gen.append(amp_gen)
-                self._skwd_f0.append(float(popt[4]))
-                self._skwd_a1.append(float(popt[0]))
-                self._skwd_a2.append(float(popt[1]))
-                self._skwd_a3.append(float(popt[2]))
-                self._skwd_a4.append(float(popt[3]))
-                self._skwd_Qr.append(float(popt[5]))
-                self._skwd_chi2_fit.append(float(chi2))
-
-            self._skwd_Qi.append(self._skewed_estimate_Qi(popt))
+        "fits a skewed lorenzian to reflection amplitudes of a resonator"
+        # prefilter the data
+        amplitudes_sq = np.atleast_2d(np.absolute([self._pre_filter_data(amplitudes) for amplitudes in np.atleast_2d(self._fit_amplitude)])**2)
+
+        A1a = np.minimum(amplitudes_sq[:,0],amplitudes_sq[:,-1])
+        A3a = -np.max(amplitudes_sq, axis=1)
+        fra = self._fit_frequency[np.argmin(amplitudes_sq, axis=1)]
+        popt = self._fit_params(self._fit_all_rows(_leastsq_skewed_lorentzian, amplitudes_sq, np.array([A1a, A3a, fra]).T), 6)
+
+        amp_gen = np.array([self._skewed_from_fit(p) for p in popt])
+        chi2 = np.sum((amp_gen-amplitudes_sq)**2, axis=1) / (amplitudes_sq.shape[1]-6)
+        Qi = [self._skewed_estimate_Qi(p) if np.all(np.isfinite(p)) else np.nan for p in popt]
+
+        self._start_batch_write()
+        for amp in np.sqrt(amp_gen):
+            self._skwd_amp_gen.append(amp)
+        self._skwd_f0.append(popt[:,4])
+        self._skwd_a1.append(popt[:,0])
+        self._skwd_a2.append(popt[:,1])
+        self._skwd_a3.append(popt[:,2])
+        self._skwd_a4.append(popt[:,3])
+        self._skwd_Qr.append(popt[:,5])
+        self._skwd_chi2_fit.append(chi2)
+        self._skwd_Qi.append(np.array(Qi))
+        self._end_batch_write()
 
     def _prepare_skewed_lorentzian(self):
         '''
@@ -626,16 +729,11 @@ class Resonator(object):
         fmax = fr+fr/Qr
         fs = np.linspace(fr,fmax,1000,dtype=np.float64)
         Amin = skewed_from_fit(p,fr)
-        #print("---")
-        #print("Amin, 2*Amin",Amin, 2*Amin)
-
-        for f in fs:
-            A = skewed_from_fit(p,f)
-            #print(A, f)
-            if A>2*Amin:
-                break
+
+        # first frequency above fr where the amplitude doubles (+3dB), else fmax
+        above = skewed_from_fit(p,fs) > 2*Amin
+        f = fs[np.argmax(above)] if np.any(above) else fs[-1]
         qi = fr/(2*(f-fr))
-        #print("f, A, fr/2*(f-fr)", f,A, qi)
 
         return float(qi)
 
@@ -666,7 +764,7 @@ class Resonator(object):
         fano_view = self._hf.add_view('fano_fit', x = self._y_co, y = self._ds_amp)
         fano_view.add(x=self._frequency_co, y=self._fano_amp_gen)
 
-    def fit_fano(self,fit_all = False, f_min=None, f_max=None,pre_filter_data=None):
+    def fit_fano(self,fit_all = False, f_min=None, f_max=None,pre_filter_data=None,trace=None):
         '''
         fano fit for amp data in the f_min-f_max frequency range
         squared amps are fitted at fano using scipy.leastsq
@@ -676,12 +774,13 @@ class Resonator(object):
         fit_all (bool): True or False, default: False. Whole data (True) or only last "slice" (False) is fitted (optional)
         f_min (float): lower boundary for data to be fitted (optional, default: None, results in min(frequency-array))
         f_max (float): upper boundary for data to be fitted (optional, default: None, results in max(frequency-array))
+        trace (tuple): (amplitude, phase) of the last trace, fitted instead of reading the file (optional)
         '''
 
         self._fit_all = fit_all
         if not self._datasets_loaded:
             self._get_datasets()
-        self._update_data()
+        self._update_data(trace)
         self._prepare_f_range(f_min,f_max)
         if self._first_fano:
             self._prepare_fano()
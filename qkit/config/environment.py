@@ -53,6 +53,50 @@ cfg['datafolder_structure'] = 1
 #fid_scan_hdf     = False
 ## should the viewer object be created on startup (slow, needs pandas) ?
 #fid_init_viewer  = True
+## the scan result is kept in a sqlite index, unchanged directories are not listed again
+#cfg['fid_index_path'] = os.path.join(cfg['logdir'],'fid_index.db')
+## h5 files modified within this time (s) are always checked for changes
+#cfg['fid_recheck_time'] = 24*3600
+## h5 files are inspected by a pool of workers (default: number of cpus),
+## 'process' or 'thread' pool, only used for at least fid_pool_min_files files
+#cfg['fid_scan_workers'] = None
+#cfg['fid_scan_pool'] = 'process'
+#cfg['fid_pool_min_files'] = 32
+## keep the database up to date with a watcher thread instead of rescans.
+## backend 'poll' (directory mtimes up to fid_watch_depth below the datadir and
+## recently modified ones) or 'watchdog' (needs the watchdog package, inotify on linux)
+#cfg['fid_watch'] = False
+#cfg['fid_watch_backend'] = 'poll'
+#cfg['fid_watch_interval'] = 1.
+#cfg['fid_watch_depth'] = 2
+## modified h5 files are inspected again after fid_watch_settle seconds without writes
+#cfg['fid_watch_settle'] = 2.
+
+##
+## Buffered writing of measurement data (qkit.storage.store.Data):
+## appended data is collected in memory and written in blocks, the file is
+## flushed after flush_rows traces (default: chunk size) or flush_interval seconds.
+#cfg['hdf_buffered'] = False
+#cfg['hdf_flush_rows'] = None
+#cfg['hdf_flush_interval'] = 1.
+## Chunking and compression of new datasets, see qkit.storage.hdf_file.storage_options()
+## access pattern: 'fixed' (5 traces per chunk), 'row-append' (whole traces
+## up to hdf_chunk_bytes per chunk) or 'column-read'
+#cfg['hdf_chunk_bytes'] = 256*1024
+#cfg['hdf_access_pattern'] = 'fixed'
+#cfg['hdf_compression'] = None  # None, 'gzip' or 'lzf'
+#cfg['hdf_compression_opts'] = None  # gzip level 0-9
+#cfg['hdf_shuffle'] = False
+## Downsampled overview levels (min/max/mean) of matrices and boxes, written
+## while appending and used by qviewkit and qkit.gui.plot for large datasets,
+## see qkit.storage.hdf_overview. Can be set per dataset with overview=True.
+#cfg['hdf_overview'] = False
+#cfg['hdf_overview_factor'] = 4
+#cfg['hdf_overview_min_size'] = 512
+## Write measurement files in the latest hdf5 format and switch to SWMR (single
+## writer multiple reader) mode during the measurement, so qviewkit can read
+## live data from an open file. Needs hdf5 >= 1.10 for writers and readers.
+#cfg['hdf_swmr'] = False
 
 ##
 ## Load (py) visa (Virtual Instrument Software Architecture) lib 
@@ -64,6 +108,13 @@ cfg['datafolder_structure'] = 1
 ## set and define the plot engine 
 ## in the moment only qviewkit is supported
 cfg['plot_engine'] = 'qkit.gui.qviewkit.main' # default: qviewkit
+## Number of processes rendering the plots saved at the end of a measurement,
+## see qkit.gui.plot.export. None: number of CPUs (at most 4), 0: render in a
+## thread of the measurement kernel.
+#cfg['plot_export_processes'] = None
+## Seconds a plot process may take for one dataset, before it is killed and
+## restarted.
+#cfg['plot_export_timeout'] = 600
 
 ##
 ## Load QKIT info service, 
@@ -79,6 +130,12 @@ cfg['plot_engine'] = 'qkit.gui.qviewkit.main' # default: qviewkit
 #cfg['ris_port']  = 5700  # this is the port rpc could use
 #cfg['ris_host']  = 'localhost' # as above
 
+##
+## qkit.start(): the info service, visa and the file info database (fid) are
+## started in background threads ('background'), on their first use ('lazy')
+## or one after the other ('sync'), see qkit.core.startup and qkit.startup_report
+#cfg['startup_service_modes'] = {'info': 'background', 'visa': 'background', 'fid': 'background'}
+
 ##
 ## File based QKIT logging for internal messages 
 ## the log file is located under cfg['logdir']
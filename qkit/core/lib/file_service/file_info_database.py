@@ -19,6 +19,20 @@ fid_scan_hdf     = False
     This will open every h5 file found and extract attributes.
 fid_init_viewer  = True
     Make a database out of the dictionary of h5 files.
+fid_index_path   = qkit.cfg['logdir']/fid_index.db
+    sqlite index of the scanned files. Only directories whose mtime changed
+    are listed again and only new or changed h5 files are opened.
+    Use qkit.fid.recreate_database() to rebuild it.
+fid_recheck_time = 24*3600
+    h5 files modified within this time (s) are checked for changes even
+    if their directory is unchanged.
+fid_scan_workers = None, fid_scan_pool = 'process'
+    Number of workers (default: number of cpus) and pool type ('process'
+    or 'thread') to inspect h5 files with fid_scan_hdf.
+fid_watch        = False
+    Keep the database up to date with a background watcher instead of
+    rescans (qkit.fid.start_watcher()). fid_watch_backend = 'poll' polls the
+    directory mtimes, 'watchdog' uses the watchdog package (inotify, ...).
 
 
 databases
@@ -68,6 +82,8 @@ after startup, the following main commands are available in a jupyter notebook:
 qkit.fid.show()
 qkit.fid.view(file_id)
 
+qkit.fid.query(run=None, user=None, name_like=None, time_range=None, **attrs)
+
 qkit.fid.get_uuid(time)
 qkit.fid.get_time(uuid)
 qkit.fid.get_date(uuid)
@@ -174,6 +190,7 @@ class fid(file_system_service):
             Deletes all cached database files and rescans the whole directory tree.
             Use this if your database looks strange.
         '''
+        self.stop_watcher()
         self._remove_cache_files()
         self.create_database()
 
@@ -182,6 +199,8 @@ class fid(file_system_service):
         """
         self.update_file_db()
         self.update_grid_db()
+        if qkit.cfg.get('fid_watch', False):
+            self.start_watcher()
 
     def update_grid_db(self):
         with self.lock:
@@ -197,20 +216,42 @@ class fid(file_system_service):
         data and allows to extract import values from h5-files
         """
         
-        if len(self.h5_info_db) is 0: # necessary if a data directory is chosen without any h5 file
-            self.df = pd.DataFrame(columns=['datetime', 'name', 'run', 'user'])
+        self.df = self._info_df(self.h5_info_db)
+
+    def _info_df(self, h5_info_db):
+        if len(h5_info_db) is 0: # necessary if a data directory is chosen without any h5 file
+            df = pd.DataFrame(columns=['datetime', 'name', 'run', 'user'])
         else:
-            self.df = pd.DataFrame(self.h5_info_db).T
+            df = pd.DataFrame(h5_info_db).T
             
         if qkit.cfg.get('fid_scan_hdf', False):
-            #self.df = self.df[['datetime', 'name', 'run', 'user', 'comment', 'fit_time', 'fit_freq', 'rating']]
+            #df = df[['datetime', 'name', 'run', 'user', 'comment', 'fit_time', 'fit_freq', 'rating']]
             for key in ['rating','fit_time','fit_freq']:
-                if key in self.df.keys():
-                    self.df[key] = pd.to_numeric(self.df[key], errors='coerce')
+                if key in df.keys():
+                    df[key] = pd.to_numeric(df[key], errors='coerce')
         else:
-            self.df = self.df[['datetime', 'name', 'run', 'user']]
-        self.df['datetime'] = pd.to_datetime(self.df['datetime'], errors='coerce')
-        self.df.fillna("", inplace=True) # Replace NAs with empty string to be able to detect changes
+            df = df[['datetime', 'name', 'run', 'user']]
+        df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
+        df.fillna("", inplace=True) # Replace NAs with empty string to be able to detect changes
+        return df
+
+    def _update_df(self, changed, removed):
+        """
+        Updates the rows of the given uuids in the data frame, used by the
+        watcher instead of rebuilding the whole data frame.
+        """
+        with self.lock:
+            if self.df is None or not qkit.cfg.get('fid_init_viewer', True):
+                return
+            removed = [uuid for uuid in removed if uuid in self.df.index and uuid not in self.h5_info_db]
+            if removed:
+                self.df.drop(index=removed, inplace=True)
+            new = self._info_df({uuid: self.h5_info_db[uuid] for uuid in changed if uuid in self.h5_info_db})
+            for key in new.keys():
+                if key not in self.df.keys():
+                    self.df[key] = ""
+            for uuid, row in new.iterrows():
+                self.df.loc[uuid] = row.reindex(self.df.keys(), fill_value="")
 
     def _get_setting_from_set_file(self, filename, instrument, value):
         try:
@@ -5,9 +5,20 @@ import threading
 import logging
 import time
 import json
+import sqlite3
+import bisect
+import fnmatch
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import h5py
 
+try:
+    from watchdog.observers import Observer
+    found_watchdog = True
+except ImportError:
+    found_watchdog = False
+
 try:
     import cPickle as pickle
 except:
@@ -60,180 +71,464 @@ class UUID_base(object):
         return time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(self.get_time(uuid)))
 
 
+
+
+def collect_h5_info(uuid, path, scan_hdf=False):
+    """
+    Returns the h5_info_db entry of a h5 file.
+
+    The name, run and user are taken from the file path, the hdf file itself
+    is only opened if scan_hdf is True. This is a plain function, so it can
+    be distributed to a process pool.
+    """
+    uuid_base = UUID_base()
+    tm = ""
+    dt = ""
+    j_split = (path.replace('/', '\\')).split('\\')
+    name = j_split[-1][7:-3]
+    if ord(uuid[0]) > ord('L'):
+        try:
+            tm = uuid_base.get_time(uuid)
+            dt = uuid_base.get_date(uuid)
+        except ValueError as e:
+            logging.info(e)
+        user = j_split[-3]
+        run = j_split[-4]
+    else:
+        tm = uuid
+        if j_split[-3][0:3] is not 201:  # not really a measurement file then
+            dt = None
+        else:
+            dt = '{}-{}-{} {}:{}:{}'.format(j_split[-3][:4], j_split[-3][4:6], j_split[-3][6:], tm[:2], tm[2:4], tm[4:])
+        user = None
+        run = None
+    h5_info_db = {'time': tm, 'datetime': dt, 'run': run, 'name': name, 'user': user}
+
+    if scan_hdf:
+        h5_info_db.update({'rating':10})
+        h5f = None
+        try:
+            h5f=h5py.File(path,'r')
+            if "comment" in  h5f['/entry/data0'].attrs:
+                h5_info_db.update({'comment': h5f['/entry/data0'].attrs['comment']})
+            if "dr_values" in h5f['/entry/analysis0']:
+                try:
+                    # this is legacy and should be removed at some point
+                    # please use the entry/analysis0 attributes instead.
+                    fit_comment = h5f['/entry/analysis0/dr_values'].attrs.get('comment',"").split(', ')
+                    comm_begin = [i[0] for i in fit_comment]
+                    try:
+                        h5_info_db.update({'fit_freq': float(h5f['/entry/analysis0/dr_values'][comm_begin.index('f')])})
+                    except (ValueError, IndexError):
+                        pass
+                    try:
+                        h5_info_db.update({'fit_time': float(h5f['/entry/analysis0/dr_values'][comm_begin.index('T')])})
+                    except (ValueError, IndexError):
+                        pass
+                except (KeyError, AttributeError):
+                    pass
+            try:
+                h5_info_db.update(dict(h5f['/entry/analysis0'].attrs))
+            except(AttributeError, KeyError):
+                pass
+            if "measurement" in h5f['/entry/data0']:
+                try:
+                    mmt = json.loads(h5f['/entry/data0/measurement'][0])
+                    h5_info_db.update(
+                            {arg: mmt[arg] for arg in ['run_id', 'user', 'rating', 'smt'] if arg in mmt}
+                    )
+                except(AttributeError, KeyError):
+                    pass
+        except KeyError as e:
+            logging.debug("fid could not index file {}, probably it is just new and empty. Original message: {}".format(path,e))
+        except IOError as e:
+            logging.error("fid {}:{}".format(path,e))
+        finally:
+            if h5f is not None:
+                h5f.close()
+    return h5_info_db
+
+
+def _collect_h5_info_job(args):
+    return collect_h5_info(*args)
+
+
+class info_index(object):
+    """
+    Secondary indexes of the h5_info_db for queries without a DataFrame.
+
+    Every hashable entry (run, user, rating, analysis0 attributes, ...) and
+    the date are indexed as value -> set of uuids. The UUIDs are a fixed
+    length base 36 encoding of the time, so their sorted list is also a time
+    index which is searched with bisect.
+    """
+    unindexed_keys = ('time', 'datetime', 'name', 'comment')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.by_key = {}
+        self.entries = {}
+        self.uuids = []
+
+    def add(self, uuid, info, sort=True):
+        self.remove(uuid)
+        entry = {}
+        for key, value in info.items():
+            if key in self.unindexed_keys:
+                continue
+            if isinstance(value, bytes):
+                value = value.decode('utf-8', 'replace')
+            try:
+                self.by_key.setdefault(key, {}).setdefault(value, set()).add(uuid)
+            except TypeError:  # e.g. arrays are not indexed
+                continue
+            entry[key] = value
+        if info.get('datetime'):
+            entry['date'] = info['datetime'][:10]
+            self.by_key.setdefault('date', {}).setdefault(entry['date'], set()).add(uuid)
+        self.entries[uuid] = entry
+        if ord(uuid[0]) > ord('L') and sort:  # older uuids do not encode the date
+            bisect.insort(self.uuids, uuid)
+
+    def rebuild(self, h5_info_db):
+        self.clear()
+        for uuid, info in h5_info_db.items():
+            self.add(uuid, info, sort=False)
+        self.uuids = sorted(uuid for uuid in self.entries if ord(uuid[0]) > ord('L'))
+
+    def remove(self, uuid):
+        entry = self.entries.pop(uuid, None)
+        if entry is None:
+            return
+        for key, value in entry.items():
+            uuids = self.by_key[key][value]
+            uuids.discard(uuid)
+            if not uuids:
+                del self.by_key[key][value]
+        i = bisect.bisect_left(self.uuids, uuid)
+        if i < len(self.uuids) and self.uuids[i] == uuid:
+            del self.uuids[i]
+
+    def lookup(self, key, value):
+        return self.by_key.get(key, {}).get(value, set())
+
+    def between(self, start=None, stop=None):
+        """ uuids in [start, stop) """
+        i = 0 if start is None else bisect.bisect_left(self.uuids, start)
+        j = len(self.uuids) if stop is None else bisect.bisect_left(self.uuids, stop)
+        return self.uuids[i:j]
+
+
+class _watchdog_handler(object):
+    """
+    watchdog event handler, collects the directories with changes.
+    They are compared with the index by the watcher thread of the fid.
+    """
+    def __init__(self, fss):
+        self.fss = fss
+
+    def dispatch(self, event):
+        with self.fss._dirty_lock:
+            for path in [event.src_path, getattr(event, 'dest_path', None)]:
+                if path:
+                    self.fss._dirty.add(os.path.dirname(path))
+                    if event.is_directory:
+                        self.fss._dirty.add(path)
+
+
 class file_system_service(UUID_base):
     h5_db = {}
     set_db = {}
     measure_db = {}
     h5_info_db = {}
 
-    _h5_n_mtime = {}
-    
+    _index_path = qkit.cfg.get('fid_index_path', os.path.join(qkit.cfg['logdir'],"fid_index.db"))
+    # pickled caches of older qkit versions
     _h5_mtime_db_path   = os.path.join(qkit.cfg['logdir'],"h5_mtime.db")
     _h5_info_cache_path = os.path.join(qkit.cfg['logdir'],"h5_info_cache.db")
 
+    # watcher, see start_watcher()
+    _watcher = None
+    _observer = None
+    _dirty = set()
+    _dirty_lock = threading.Lock()
+    _hot_dirs = {}
+    _hot_files = {}
+    _hot_until = 0
+
+    _index = info_index()
+
     lock = threading.Lock()
+    # held during a scan of the data directory, the databases are only
+    # locked (lock) while they are loaded from the index or replaced.
+    _scan_lock = threading.Lock()
     
     def _remove_cache_files(self):
         """
             remove cached files to recreate the database
         """
-        for f in [self._h5_mtime_db_path,self._h5_info_cache_path]:
+        for f in [self._index_path,self._h5_mtime_db_path,self._h5_info_cache_path]:
             if os.path.isfile(f):
                 os.remove(f)
 
-    def _load_cache_files(self):
-        """ to speed up things, try to load the h5 
-            information from previous runs. 
+    def _connect_index(self):
         """
-        self._new_cache = False
-        self._h5_mtime_db = {}
-        self._h5_info_cache_db = {}
-        self._n_mtime = {}
-        try:
-            with open(self._h5_mtime_db_path,'rb') as f:
-                self._h5_mtime_db = pickle.load(f)
-            with open(self._h5_info_cache_path,'rb') as f:
-                self._h5_info_cache_db = pickle.load(f)
-        except IOError as e:
-            logging.info("m_time_db not found. Not using cached files for now. %s"%e)
-            self._new_cache = True
+        Opens the sqlite index of the data directory.
+
+        The index holds the mtime of every directory and the path, uuid, mtime,
+        size and h5_info_db entry of every file. sqlite connections can not be
+        shared between threads, every caller opens (and closes) its own.
+        """
+        db = sqlite3.connect(self._index_path, timeout=30)
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime REAL);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, uuid TEXT, kind TEXT,
+                                              mtime REAL, size INTEGER, info BLOB);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE INDEX IF NOT EXISTS files_uuid ON files (uuid);
+        """)
+        return db
 
-    def _store_cache_files(self):
-        """ writes the cached files on disk, 
-        qkit.cfg['logdir'] is used by default.
+    @staticmethod
+    def _file_kind(fname):
+        if fname[-3:] == '.h5':
+            return 'h5'
+        elif fname[-3:] == 'set':
+            return 'set'
+        elif fname[-3:] == 'ent':
+            return 'measurement'
+        return None
 
-        exeptions are not handled ... if something fails here 
-        there is a severe general problem, e.g. the disk is full.
+    @staticmethod
+    def _dump_info(info):
+        return sqlite3.Binary(pickle.dumps(info, protocol=2)) # protocol 2 for Python 2 compatibility
+
+    @staticmethod
+    def _load_info(blob):
+        return pickle.loads(bytes(blob))
+
+    def _load_index(self, db):
         """
-        write_protocol = 2 # For Python 2 compatibility 0=text, 1...x binary, -1 highest binary. 
-        with open(self._h5_mtime_db_path,'wb+') as f:
-            pickle.dump(self._h5_n_mtime,f,protocol=write_protocol)
-        with open(self._h5_info_cache_path,'wb+') as f:
-            pickle.dump(self.h5_info_db,f,protocol=write_protocol)
+        Fills the databases with the content of the index, returns the number of files.
+        """
+        dbs = {'h5': {}, 'set': {}, 'measurement': {}}
+        infos = {}
+        for path, uuid, kind, info in db.execute("SELECT path, uuid, kind, info FROM files ORDER BY path"):
+            dbs[kind][uuid] = path
+            if info is not None:
+                infos[path] = self._load_info(info)
+        self._replace_dbs(dbs, infos)
+        return sum(len(d) for d in dbs.values())
 
-    def update_file_db(self):
-        with self.lock:
+    def _replace_dbs(self, dbs, infos):
+        """
+        Replaces the content of the databases. Note: All path entries with the
+        same uuid are overwritten with the last found uuid indexed file.
+        """
+        for target, kind in [(self.h5_db, 'h5'), (self.set_db, 'set'), (self.measure_db, 'measurement')]:
+            target.clear()
+            target.update(dbs[kind])
+        self.h5_info_db.clear()
+        self.h5_info_db.update({uuid: infos[path] for uuid, path in dbs['h5'].items() if path in infos})
+        self._index.rebuild(self.h5_info_db)
+
+    def update_file_db(self, full=False):
+        """
+        Scans the data directory and updates h5_db, set_db, measure_db and h5_info_db.
+
+        The result of the scan is kept in a sqlite index (fid_index_path, default:
+        qkit.cfg['logdir']/fid_index.db). The databases are filled from the index
+        first, so they are available while the data directory is scanned.
+        Directories with an unchanged mtime are not listed again, only h5 files
+        modified within the last fid_recheck_time seconds are checked there.
+        New or changed h5 files are inspected in a worker pool.
+
+        Args:
+            full: List every directory and check every file, regardless of the index.
+        """
+        with self._scan_lock:
             start_time = time.time()
-            self._load_cache_files()
             if qkit.cfg.get('fid_scan_datadir',True):
                 qkit.cfg['fid_scan_datadir'] = True
                 logging.debug("file info database: Start to update database.")
-                for root, _ , files in os.walk(qkit.cfg['datadir']): # root, dirs, files
-                    for f in files:
-                        self._inspect_and_add_Leaf(f,root)
+                try:
+                    self._update_from_index(full)
+                except sqlite3.DatabaseError as e:
+                    logging.error("file info database: Index {} is broken, rebuilding it. {}".format(self._index_path, e))
+                    self._remove_cache_files()
+                    self._update_from_index(True)
                 logging.debug("file info database: Updating database done.")
-            self._store_cache_files()
             print ("Initialized the file info database (qkit.fid) in %.3f seconds."%(time.time()-start_time))
 
-    def _inspect_and_add_Leaf(self,fname,root):
+    def _update_from_index(self, full):
+        db = self._connect_index()
+        self.lock.acquire()
+        locked = True
+        try:
+            if self._load_index(db):
+                # the cached databases can be used during the scan.
+                # without an index, lookups have to wait until the scan is done.
+                self.lock.release()
+                locked = False
+            dbs, infos = self._scan_datadir(db, full)
+            db.commit()
+            if not locked:
+                self.lock.acquire()
+                locked = True
+            self._replace_dbs(dbs, infos)
+            self._hot_until = 0
+        finally:
+            if locked:
+                self.lock.release()
+            db.close()
+
+    def _scan_datadir(self, db, full):
         """
-        inspect the filenames if .h5, .set or .measurement
+        Walks the data directory and brings the index up to date.
 
-        to speed up things, the files are only scanned 
-        if something has changed (os.stat.m_time) on disk. 
+        Returns:
+            dbs: dict {'h5', 'set', 'measurement'} of dicts uuid: path
+            infos: dict path: h5_info_db entry of all h5 files
         """
+        dir_mtimes = {}
+        children_of = {}
+        for path, parent, mtime in db.execute("SELECT path, parent, mtime FROM dirs"):
+            dir_mtimes[path] = mtime
+            children_of.setdefault(parent, []).append(path)
+        recheck_time = time.time() - qkit.cfg.get('fid_recheck_time', 24*3600)
 
-        # join to absolute path:
-        fqpath = os.path.join(root, fname)
+        dbs = {'h5': {}, 'set': {}, 'measurement': {}}
+        infos = {}
+        jobs = []
+        found_dirs = set()
+        stack = [(qkit.cfg['datadir'], None)]
+        while stack:
+            root, parent = stack.pop()
+            try:
+                mtime = os.stat(root).st_mtime
+            except OSError:
+                continue
+            found_dirs.add(root)
+            cached = {row[0]: row[1:] for row in
+                      db.execute("SELECT path, uuid, kind, mtime, size, info FROM files WHERE dir=?", (root,))}
+            unchanged = not full and dir_mtimes.get(root) == mtime
+            if unchanged:
+                children = sorted(children_of.get(root, []))
+                files = sorted(cached)
+            else:
+                try:
+                    names = sorted(os.listdir(root))
+                except OSError as e:
+                    logging.error("file info database: Can not list {}: {}".format(root, e))
+                    continue
+                children, files = [], []
+                for name in names:
+                    fqpath = os.path.join(root, name)
+                    if os.path.isdir(fqpath):
+                        children.append(fqpath)
+                    elif self._file_kind(name):
+                        files.append(fqpath)
+                db.executemany("DELETE FROM files WHERE path=?", [(p,) for p in set(cached) - set(files)])
+                db.execute("INSERT OR REPLACE INTO dirs VALUES (?,?,?)", (root, parent, mtime))
+            stack.extend((child, root) for child in reversed(children))
 
-        # take the prefix ...
-        uuid = fname[:6]
+            for fqpath in files:
+                fname = os.path.basename(fqpath)
+                uuid = fname[:6]
+                kind = self._file_kind(fname)
+                row = cached.get(fqpath)
+                if kind != 'h5':
+                    if row is None:
+                        db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)",
+                                   (fqpath, root, uuid, kind, 0, 0, None))
+                    dbs[kind][uuid] = fqpath
+                    continue
+                # we only care about the mtime of .h5 files
+                if unchanged and row[4] is not None and row[2] < recheck_time:
+                    infos[fqpath] = self._load_info(row[4])
+                else:
+                    try:
+                        st = os.stat(fqpath)
+                    except OSError:
+                        continue
+                    if row is not None and row[4] is not None and (row[2], row[3]) == (st.st_mtime, st.st_size):
+                        infos[fqpath] = self._load_info(row[4])
+                    else:
+                        jobs.append((uuid, fqpath, root, st.st_mtime, st.st_size))
+                dbs['h5'][uuid] = fqpath
 
-        # ... and check the suffix
-        if fqpath[-3:] == '.h5':
+        gone = [(d,) for d in dir_mtimes if d not in found_dirs]
+        db.executemany("DELETE FROM files WHERE dir=?", gone)
+        db.executemany("DELETE FROM dirs WHERE path=?", gone)
+        # do not block other writers of the index while the files are inspected
+        db.commit()
 
-            # save the path using uuids as an index
-            # Note: All path entries with the same uuid are 
-            # overwritten with the last found uuid indexed file
-            self.h5_db[uuid] = fqpath
+        for (uuid, fqpath, root, mtime, size), info in zip(jobs, self._collect_infos([job[:2] for job in jobs])):
+            infos[fqpath] = info
+            db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)",
+                       (fqpath, root, uuid, 'h5', mtime, size, self._dump_info(info)))
+        logging.debug("file info database: {} h5 files inspected.".format(len(jobs)))
+        return dbs, infos
 
-            # we only care about the mtime of .h5 files 
-            mtime = os.stat(fqpath).st_mtime
-
-            # store the file's modification time 
-            self._h5_n_mtime[uuid] = mtime
+    def _collect_infos(self, jobs):
+        """
+        Returns the h5_info_db entries for a list of (uuid, path) tuples.
 
-            if mtime == self._h5_mtime_db.get(uuid,0):
-                if self._h5_info_cache_db.get(uuid,0):
-                    self.h5_info_db[uuid] = self._h5_info_cache_db.get(uuid)
+        Opening the hdf files (fid_scan_hdf) is slow. If there are more than
+        fid_pool_min_files of them, they are inspected by a pool of fid_scan_workers
+        (default: number of cpus) workers. h5py serializes all calls within a
+        process, so this is a process pool unless fid_scan_pool is 'thread'.
+        """
+        scan_hdf = qkit.cfg.get('fid_scan_hdf', False)
+        jobs = [(uuid, path, scan_hdf) for uuid, path in jobs]
+        workers = qkit.cfg.get('fid_scan_workers', None) or multiprocessing.cpu_count()
+        if scan_hdf and workers > 1 and len(jobs) >= qkit.cfg.get('fid_pool_min_files', 32):
+            try:
+                if qkit.cfg.get('fid_scan_pool', 'process') == 'thread':
+                    pool = ThreadPool(workers)
                 else:
-                    self._collect_info(uuid, fqpath) # collect_info is expensive.
-            else:
-                self._collect_info(uuid, fqpath) # collect_info is expensive. 
-
-        elif fqpath[-3:] == 'set':
-            self.set_db[uuid] = fqpath
-        elif fqpath[-3:] == 'ent':
-            self.measure_db[uuid] = fqpath
-
-    def _collect_info(self,uuid,path):
-            tm = ""
-            dt = ""
-            j_split = (path.replace('/', '\\')).split('\\')
-            name = j_split[-1][7:-3]
-            if ord(uuid[0]) > ord('L'):
-                try:
-                    tm = self.get_time(uuid)
-                    dt = self.get_date(uuid)
-                except ValueError as e:
-                    logging.info(e)
-                user = j_split[-3]
-                run = j_split[-4]
+                    pool = multiprocessing.Pool(workers)
+            except (OSError, ValueError) as e:
+                logging.warning("file info database: Can not start worker pool, inspecting files one by one. {}".format(e))
             else:
-                tm = uuid
-                if j_split[-3][0:3] is not 201:  # not really a measurement file then
-                    dt = None
-                else:
-                    dt = '{}-{}-{} {}:{}:{}'.format(j_split[-3][:4], j_split[-3][4:6], j_split[-3][6:], tm[:2], tm[2:4], tm[4:])
-                user = None
-                run = None
-            h5_info_db = {'time': tm, 'datetime': dt, 'run': run, 'name': name, 'user': user}
-            
-            if qkit.cfg.get('fid_scan_hdf', False):
-                h5_info_db.update({'rating':10})
                 try:
-                    h5f=h5py.File(path,'r')
-                    if "comment" in  h5f['/entry/data0'].attrs:
-                        h5_info_db.update({'comment': h5f['/entry/data0'].attrs['comment']})
-                    if "dr_values" in h5f['/entry/analysis0']:
-                        try:
-                            # this is legacy and should be removed at some point
-                            # please use the entry/analysis0 attributes instead.
-                            fit_comment = h5f['/entry/analysis0/dr_values'].attrs.get('comment',"").split(', ')
-                            comm_begin = [i[0] for i in fit_comment]
-                            try:
-                                h5_info_db.update({'fit_freq': float(h5f['/entry/analysis0/dr_values'][comm_begin.index('f')])})
-                            except (ValueError, IndexError):
-                                pass
-                            try:
-                                h5_info_db.update({'fit_time': float(h5f['/entry/analysis0/dr_values'][comm_begin.index('T')])})
-                            except (ValueError, IndexError):
-                                pass
-                        except (KeyError, AttributeError):
-                            pass
-                    try:
-                        h5_info_db.update(dict(h5f['/entry/analysis0'].attrs))
-                    except(AttributeError, KeyError):
-                        pass
-                    if "measurement" in h5f['/entry/data0']:
-                        try:
-                            mmt = json.loads(h5f['/entry/data0/measurement'][0])
-                            h5_info_db.update(
-                                    {arg: mmt[arg] for arg in ['run_id', 'user', 'rating', 'smt'] if mmt.has_key(arg)}
-                            )
-                        except(AttributeError, KeyError):
-                            pass
-                except KeyError as e:
-                    logging.debug("fid could not index file {}, probably it is just new and empty. Original message: {}".format(path,e))
-                except IOError as e:
-                    logging.error("fid {}:{}".format(path,e))
+                    return pool.map(_collect_h5_info_job, jobs, chunksize=max(1, len(jobs) // (4*workers)))
                 finally:
-                    h5f.close()
+                    pool.close()
+                    pool.join()
+        return [_collect_h5_info_job(job) for job in jobs]
 
-            self.h5_info_db[uuid] = h5_info_db
+    def _inspect_and_add_Leaf(self,fname,root,db):
+        """
+        inspect the filenames if .h5, .set or .measurement,
+        add them to the databases and to the index db.
+        """
+        fqpath = os.path.join(root, fname)
+        uuid = fname[:6]
+        kind = self._file_kind(fname)
+        if kind == 'h5':
+            self.h5_db[uuid] = fqpath
+            st = os.stat(fqpath)
+            info = self._collect_info(uuid, fqpath) # collect_info is expensive.
+            db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)",
+                       (fqpath, root, uuid, kind, st.st_mtime, st.st_size, self._dump_info(info)))
+            self._hot_files[fqpath] = (st.st_mtime, st.st_size, root)
+        elif kind:
+            {'set': self.set_db, 'measurement': self.measure_db}[kind][uuid] = fqpath
+            db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)",
+                       (fqpath, root, uuid, kind, 0, 0, None))
+
+    def _collect_info(self,uuid,path):
+        self.h5_info_db[uuid] = collect_h5_info(uuid, path, qkit.cfg.get('fid_scan_hdf', False))
+        self._index.add(uuid, self.h5_info_db[uuid])
+        return self.h5_info_db[uuid]
     
     def add_h5_file(self, h5_filename):
-        if qkit.cfg['fid_scan_datadir']:
+        if qkit.cfg['fid_scan_datadir'] and self._watcher is None:
+            # with a running watcher, the file shows up by itself
             threading.Timer(20, function=self._add, kwargs={'h5_filename':h5_filename}).start()
         
     def _add(self, h5_filename):
@@ -246,21 +541,23 @@ class file_system_service(UUID_base):
         if h5_filename[-3:] != '.h5':
             logging.error("Tried to add '{:s}' to the qkit.fid database: Not a .h5 filename.".format(h5_filename))
         with self.lock:
-            if os.path.isfile(h5_filename):
-                self.h5_db[uuid] = h5_filename
-                logging.debug("Store_db: Adding manually h5: " + basename + 'h5')
-                self._inspect_and_add_Leaf(basename + 'h5', dirname)
-            else:
-                logging.error("Tried to add '{:s}' to the qkit.fid database: File does not exist.".format(h5_filename))
-            if os.path.isfile(h5_filename[:-2] + 'set'):
-                self.set_db[uuid] = h5_filename[:-2] + 'set'
-                logging.debug("Store_db: Adding manually set: " + basename + 'set')
-                self._inspect_and_add_Leaf(basename + 'set', dirname)
-            if os.path.isfile(h5_filename[:-2] + 'measurement'):
-                self.h5_db[uuid] = h5_filename[:-2] + 'measurement'
-                logging.debug("Store_db: Adding manually measurement: " + basename + 'measurement')
-                self._inspect_and_add_Leaf(basename + 'measurement', dirname)
-        self.update_grid_db()
+            db = self._connect_index()
+            try:
+                if os.path.isfile(h5_filename):
+                    logging.debug("Store_db: Adding manually h5: " + basename + 'h5')
+                    self._inspect_and_add_Leaf(basename + 'h5', dirname, db)
+                else:
+                    logging.error("Tried to add '{:s}' to the qkit.fid database: File does not exist.".format(h5_filename))
+                if os.path.isfile(h5_filename[:-2] + 'set'):
+                    logging.debug("Store_db: Adding manually set: " + basename + 'set')
+                    self._inspect_and_add_Leaf(basename + 'set', dirname, db)
+                if os.path.isfile(h5_filename[:-2] + 'measurement'):
+                    logging.debug("Store_db: Adding manually measurement: " + basename + 'measurement')
+                    self._inspect_and_add_Leaf(basename + 'measurement', dirname, db)
+                db.commit()
+            finally:
+                db.close()
+        self._update_df({uuid}, set())
 
 
     def _set_hdf_attribute(self,UUID,attribute,value):
@@ -285,10 +582,257 @@ class file_system_service(UUID_base):
         finally:
             h.file.close()
         self.h5_info_db[UUID].update({attribute:value})
+        self._index.add(UUID, self.h5_info_db[UUID])
+        # keep the index in sync, otherwise the file is inspected again at the next scan
+        st = os.stat(h5_filepath)
+        db = self._connect_index()
+        try:
+            db.execute("UPDATE files SET mtime=?, size=?, info=? WHERE path=?",
+                       (st.st_mtime, st.st_size, self._dump_info(self.h5_info_db[UUID]), h5_filepath))
+            db.commit()
+        finally:
+            db.close()
         
+    def _time_to_uuid(self, t):
+        if t is None:
+            return None
+        if isinstance(t, (int, float)):
+            return self.get_uuid(t)
+        if len(t) == 6:
+            return t.upper()
+        return self.get_uuid(time.mktime(time.strptime(t, "%Y-%m-%d %H:%M:%S" if len(t) > 10 else "%Y-%m-%d")))
+
+    def query(self, run=None, user=None, name_like=None, time_range=None, **attrs):
+        """
+        Search the h5_info_db using its secondary indexes.
+
+        Args:
+            run, user: run or user name, or a list of names.
+            name_like: part of the measurement name or a pattern with * and ?,
+                case insensitive.
+            time_range: tuple (start, stop) of the interval [start, stop), both
+                can be a time.time() value, a uuid, a date string 'YYYY-MM-DD'
+                or 'YYYY-MM-DD HH:MM:SS' or None.
+            **attrs: further entries of the h5_info_db, e.g. date='2019-05-03',
+                rating=10 or analysis0 attributes. A list matches any of its values.
+
+        Returns:
+            sorted (i.e. chronological) list of matching uuids.
+        """
+        if run is not None:
+            attrs['run'] = run
+        if user is not None:
+            attrs['user'] = user
+        with self.lock:
+            matches = []
+            if time_range is not None:
+                matches.append(self._index.between(*[self._time_to_uuid(t) for t in time_range]))
+            unindexed = {}
+            for key, value in attrs.items():
+                if key in self._index.unindexed_keys:
+                    unindexed[key] = value
+                elif isinstance(value, (list, tuple, set)):
+                    matches.append(set().union(*[self._index.lookup(key, v) for v in value]))
+                else:
+                    matches.append(self._index.lookup(key, value))
+            if matches:
+                # start with the smallest set, the index sets must not be modified
+                matches.sort(key=len)
+                uuids = set(matches[0])
+                for found in matches[1:]:
+                    uuids.intersection_update(found)
+            else:
+                uuids = self.h5_info_db.keys()
+            for key, value in unindexed.items():
+                values = value if isinstance(value, (list, tuple, set)) else [value]
+                uuids = [uuid for uuid in uuids if self.h5_info_db[uuid].get(key) in values]
+            if name_like is not None:
+                pattern = name_like.lower()
+                if '*' not in pattern and '?' not in pattern:
+                    pattern = '*' + pattern + '*'
+                uuids = [uuid for uuid in uuids if fnmatch.fnmatchcase(str(self.h5_info_db[uuid].get('name', '')).lower(), pattern)]
+            return sorted(uuids)
+
+    def _update_df(self, changed, removed):
+        """
+        Hook for changes of h5_info_db entries (uuids), implemented by the fid viewer.
+        """
+        pass
+
+    def start_watcher(self):
+        """
+        Keeps the databases up to date with the data directory.
+
+        A background thread applies new, changed and removed files every
+        fid_watch_interval seconds, no rescan of the data directory is needed.
+        With fid_watch_backend 'watchdog', changed directories are reported by
+        the watchdog package (inotify, ...), otherwise ('poll') the mtimes of
+        the directories up to fid_watch_depth below the datadir and of the
+        recently modified directories are polled.
+        Modified h5 files are inspected again when they were not written to
+        for fid_watch_settle seconds.
+        """
+        if self._watcher is not None:
+            return
+        self._watch_stop = threading.Event()
+        if qkit.cfg.get('fid_watch_backend', 'poll') == 'watchdog':
+            if found_watchdog:
+                try:
+                    self._observer = Observer()
+                    self._observer.schedule(_watchdog_handler(self), qkit.cfg['datadir'], recursive=True)
+                    self._observer.start()
+                except OSError as e:
+                    logging.warning("fid watcher: watchdog failed, polling the data directory instead. {}".format(e))
+                    self._observer = None
+            else:
+                logging.warning("fid watcher: Module watchdog is not installed, polling the data directory instead.")
+        self._watcher = threading.Thread(name='fid_watcher', target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop_watcher(self):
+        if self._watcher is None:
+            return
+        self._watch_stop.set()
+        self._watcher.join()
+        self._watcher = None
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def _watch(self):
+        db = self._connect_index()
+        try:
+            while not self._watch_stop.wait(qkit.cfg.get('fid_watch_interval', 1.)):
+                # a running scan replaces the databases anyway
+                if not self._scan_lock.acquire(False):
+                    continue
+                try:
+                    changed, removed = self._poll_changes(db)
+                    db.commit()
+                except (OSError, sqlite3.Error) as e:
+                    logging.error("fid watcher: {}".format(e))
+                    continue
+                finally:
+                    self._scan_lock.release()
+                if changed or removed:
+                    self._update_df(changed, removed)
+        finally:
+            db.close()
+
+    def _dir_depth(self, path):
+        rel = os.path.relpath(path, qkit.cfg['datadir'])
+        return 0 if rel == '.' else rel.count(os.sep) + 1
+
+    def _poll_changes(self, db):
+        """
+        Applies the changes in the data directory to the databases and the index.
+        Returns the sets of changed and removed h5 uuids.
+        """
+        changed, removed = set(), set()
+        now = time.time()
+        if now > self._hot_until:
+            # directories and files which are likely to change, refreshed once a minute
+            recent = now - qkit.cfg.get('fid_recheck_time', 24*3600)
+            depth = qkit.cfg.get('fid_watch_depth', 2)
+            self._hot_dirs = {path: mtime for path, mtime in db.execute("SELECT path, mtime FROM dirs")
+                              if mtime > recent or self._dir_depth(path) <= depth}
+            self._hot_files = {row[0]: row[1:] for row in
+                               db.execute("SELECT path, mtime, size, dir FROM files WHERE kind='h5' AND mtime>?", (recent,))}
+            self._hot_until = now + 60
+
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        if self._observer is None:
+            for path, mtime in list(self._hot_dirs.items()):
+                try:
+                    if os.stat(path).st_mtime != mtime:
+                        dirty.add(path)
+                except OSError:
+                    # the directory is removed by its parent
+                    self._hot_dirs.pop(path)
+        # parents first, new subdirectories are added recursively
+        for path in sorted(dirty):
+            self._refresh_dir(db, path, changed, removed)
+
+        settle = qkit.cfg.get('fid_watch_settle', 2.)
+        for path, (mtime, size, root) in list(self._hot_files.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (st.st_mtime, st.st_size) != (mtime, size) and now - st.st_mtime > settle:
+                with self.lock:
+                    self._inspect_and_add_Leaf(os.path.basename(path), root, db)
+                changed.add(os.path.basename(path)[:6])
+        return changed, removed
+
+    def _refresh_dir(self, db, root, changed, removed, parent=None):
+        """
+        Compares a directory with the index and applies the differences,
+        new subdirectories are added recursively.
+        """
+        try:
+            mtime = os.stat(root).st_mtime
+            names = os.listdir(root)
+        except OSError:
+            return
+        indexed_files = set(p for (p,) in db.execute("SELECT path FROM files WHERE dir=?", (root,)))
+        indexed_dirs = set(p for (p,) in db.execute("SELECT path FROM dirs WHERE parent=?", (root,)))
+        files, dirs = set(), set()
+        for name in names:
+            fqpath = os.path.join(root, name)
+            if os.path.isdir(fqpath):
+                dirs.add(fqpath)
+            elif self._file_kind(name):
+                files.add(fqpath)
+        for path in indexed_dirs - dirs:
+            self._remove_dir(db, path, removed)
+        for path in indexed_files - files:
+            self._remove_files(db, "path=?", (path,), removed)
+        for path in sorted(files - indexed_files):
+            fname = os.path.basename(path)
+            with self.lock:
+                try:
+                    self._inspect_and_add_Leaf(fname, root, db)
+                except OSError:
+                    continue
+            if self._file_kind(fname) == 'h5':
+                changed.add(fname[:6])
+        if parent is None:
+            db.execute("UPDATE dirs SET mtime=? WHERE path=?", (mtime, root))
+        else:
+            db.execute("INSERT OR REPLACE INTO dirs VALUES (?,?,?)", (root, parent, mtime))
+        self._hot_dirs[root] = mtime
+        for path in sorted(dirs - indexed_dirs):
+            self._refresh_dir(db, path, changed, removed, parent=root)
+
+    def _remove_dir(self, db, path, removed):
+        prefix = os.path.join(path, '')
+        self._remove_files(db, "dir=? OR substr(dir, 1, ?)=?", (path, len(prefix), prefix), removed)
+        db.execute("DELETE FROM dirs WHERE path=? OR substr(path, 1, ?)=?", (path, len(prefix), prefix))
+        for d in list(self._hot_dirs):
+            if d == path or d.startswith(prefix):
+                self._hot_dirs.pop(d)
+
+    def _remove_files(self, db, where, args, removed):
+        rows = db.execute("SELECT path, uuid, kind FROM files WHERE " + where, args).fetchall()
+        with self.lock:
+            for path, uuid, kind in rows:
+                target = {'h5': self.h5_db, 'set': self.set_db, 'measurement': self.measure_db}[kind]
+                if target.get(uuid) == path:
+                    target.pop(uuid)
+                    if kind == 'h5':
+                        self.h5_info_db.pop(uuid, None)
+                        self._index.remove(uuid)
+                        removed.add(uuid)
+                self._hot_files.pop(path, None)
+        db.execute("DELETE FROM files WHERE " + where, args)
+
     def wait(self):
+        with self._scan_lock:
+            pass
         with self.lock:
             pass
-        if self.lock.locked():
-            self.wait()
-        return True
\ No newline at end of file
+        return True
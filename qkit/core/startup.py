@@ -1,26 +1,170 @@
-# This file brings QKIT around: init 
+# This file brings QKIT around: init
 # YS@KIT/2017
 # HR@kit/2017
+"""
+The init stages are the modules qkit/core/s_init/S*.py, imported in the order
+of their names. The stages creating the services below do not depend on each
+other and start in background threads ('background'), only on the first use
+of the service ('lazy') or one after the other ('sync'):
+
+    qkit.info   S25_info_service        zmq info service (binding takes ~0.3 s)
+    qkit.visa   S70_load_visa           VISA ResourceManager
+    qkit.fid    S80_load_file_service   file info database
+
+Until its stage is done, the service is a ServiceProxy, which waits for the
+stage (or runs it for 'lazy') on the first attribute access and is then
+replaced by the service. Errors of a background stage are logged and raised
+on the first use of the service. The modes are set with e.g.
+    qkit.cfg['startup_service_modes'] = {'fid': 'lazy'}
+
+The timing of all stages is kept in qkit.startup_report.
+"""
 import qkit
 import os
 import importlib
 import logging
+import threading
 from time import time
 
+INIT_PACKAGE = 'qkit.core.s_init'
+
+# init stage: (service, default mode, qkit.cfg switch and its default)
+# switched off services are replaced by dummies in sync mode
+SERVICES = {'S25_info_service': ('info', 'background', 'load_info_service', True),
+            'S70_load_visa': ('visa', 'background', 'load_visa', False),
+            'S80_load_file_service': ('fid', 'background', 'fid_scan_datadir', True)}
+MODES = ('sync', 'background', 'lazy')
+
+
+class StartupReport(object):
+    """
+    Timing of the init stages of qkit.start(), print it for a summary.
+    """
+
+    def __init__(self):
+        self.stages = []  # [stage, mode, seconds or None while running, error]
+        self.total = None
+        self._lock = threading.Lock()
+
+    def add(self, stage, mode):
+        entry = [stage, mode, None, None]
+        with self._lock:
+            self.stages.append(entry)
+        return entry
+
+    def __repr__(self):
+        lines = ["qkit startup: %s" % ("running" if self.total is None else "%.3f s" % self.total)]
+        with self._lock:
+            for stage, mode, seconds, error in self.stages:
+                state = "not loaded" if seconds is None and mode == 'lazy' else (
+                    "running" if seconds is None else "%.3f s" % seconds)
+                lines.append("  %-28s %-11s %s%s" % (stage, mode, state, " (failed: %s)" % error if error else ""))
+        return "\n".join(lines)
+
+
+class ServiceProxy(object):
+    """
+    Placeholder for a qkit service (qkit.<name>), which is started by a
+    background or lazy init stage.
+    """
+
+    def __init__(self, name, stage, mode, entry):
+        d = self.__dict__
+        d['_name'] = name
+        d['_stage'] = stage
+        d['_mode'] = mode
+        d['_entry'] = entry
+        d['_lock'] = threading.Lock()
+        d['_thread'] = None
+        d['_error'] = None
+        if mode == 'background':
+            d['_thread'] = threading.Thread(target=self._run, name='qkit_start_' + name)
+            self._thread.daemon = True
+
+    def _run(self):
+        starttime = time()
+        try:
+            importlib.import_module("." + self._stage, package=INIT_PACKAGE)
+        except Exception as e:
+            logging.error("Loading module %s failed: %s" % (self._stage, e))
+            self.__dict__['_error'] = e
+            self._entry[3] = e
+        self._entry[2] = time() - starttime
+
+    def _load(self):
+        """Waits for the stage (or runs it) and returns the service."""
+        with self._lock:
+            if self._thread is not None:
+                self._thread.join()
+            elif self._entry[2] is None:
+                self._run()
+        if self._error is not None:
+            raise self._error
+        service = qkit.__dict__.get(self._name, self)
+        if service is self:
+            # the stage did not start the service (switched off in qkit.cfg)
+            qkit.__dict__.pop(self._name, None)
+            raise AttributeError("qkit.%s is not available, see module %s." % (self._name, self._stage))
+        return service
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        return "<qkit.%s, %s start by %s>" % (self._name, self._mode, self._stage)
+
+
 def start():
     #print('Starting the core of the Qkit framework...')
     initdir_name = 's_init'
     initdir = os.path.join(qkit.cfg.get('coredir'),initdir_name)
     filelist = os.listdir(initdir)
     filelist.sort()
-    
+
+    report = StartupReport()
+    qkit.startup_report = report
+    modes = dict((stage, s[1]) for stage, s in SERVICES.items())
+    names = dict((s[0], stage) for stage, s in SERVICES.items())
+    for name, mode in qkit.cfg.get('startup_service_modes', {}).items():
+        if name not in names or mode not in MODES:
+            msg = "startup_service_modes: unknown service '%s' or mode '%s' (%s)." % (name, mode, ', '.join(MODES))
+            logging.error(msg)
+            raise ValueError(msg)
+        modes[names[name]] = mode
+    for stage, (name, mode, key, default) in SERVICES.items():
+        if not qkit.cfg.get(key, default):
+            modes[stage] = 'sync'
+
+    begin = time()
     # load all modules starting with a 'S' character
     for module in filelist:
         starttime = time()
         if not module.startswith('S') or module[-3:] != '.py':
             continue
+        stage = module[:-3]
+        mode = modes.get(stage, 'sync')
+        entry = report.add(stage, mode)
+        if mode != 'sync':
+            name = SERVICES[stage][0]
+            proxy = ServiceProxy(name, stage, mode, entry)
+            setattr(qkit, name, proxy)
+            if mode == 'background':
+                print("Loading module ... " + module + " (background)")
+                proxy._thread.start()
+            continue
         print("Loading module ... "+module)
-        importlib.import_module("."+module[:-3],package='qkit.core.'+initdir_name)
-        logging.debug("Loading module "+str(module)+" took  {:.1f}s.".format(time()-starttime))
+        importlib.import_module("."+stage,package='qkit.core.'+initdir_name)
+        entry[2] = time()-starttime
+        logging.debug("Loading module "+str(module)+" took  {:.1f}s.".format(entry[2]))
+    report.total = time() - begin
+    logging.info("qkit started in {:.2f}s.".format(report.total))
     del module,starttime
-    
\ No newline at end of file
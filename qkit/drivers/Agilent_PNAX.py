@@ -306,7 +306,7 @@ class Agilent_PNAX(Instrument):
             datareal = numpy.mean(datareal)
             dataimag = numpy.mean(dataimag)
             dataamp = numpy.sqrt(datareal*datareal+dataimag*dataimag)
-            datapha = numpy.arctan(dataimag/datareal)
+            datapha = numpy.arctan2(dataimag, datareal)
             return dataamp, datapha
           else:
             dataamp = numpy.sqrt(datareal*datareal+dataimag*dataimag)
@@ -248,16 +248,7 @@ class Agilent_VNA_E5071C(Instrument):
             datareal = numpy.mean(datareal)
             dataimag = numpy.mean(dataimag)
             dataamp = numpy.sqrt(datareal*datareal+dataimag*dataimag)
-            for i in arange(len(datareal)):    #added MW July 2013
-                if datareal[i]>=0 and dataimag[i] >=0:   #1. quadrant
-                    datapha.append(arctan(dataimag[i]/datareal[i]))
-                elif  datareal[i] <0 and dataimag[i] >=0:  #2. quadrant
-                    data.pha.append(arctan(dataimag[i]/datareal[i])+ pi)
-                elif  datareal[i] <0 and dataimag[i] <0:  #3. quadrant
-                    datapha.append(arctan(dataimag[i]/datareal[i])- pi)
-                elif  datareal[i] >=0 and dataimag[i]<0:   #4. quadrant
-                    datapha.append(arctan(dataimag[i]/datareal[i]))   
-
+            datapha = numpy.arctan2(dataimag, datareal)
             return dataamp, datapha
           else:
             dataamp = numpy.sqrt(datareal*datareal+dataimag*dataimag)
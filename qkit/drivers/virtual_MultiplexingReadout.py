@@ -39,10 +39,120 @@ import logging
 import numpy as np
 import scipy.special
 from scipy import signal
-from time import sleep
+from time import sleep, time
+from multiprocessing.pool import ThreadPool
 from qkit.measure.timedomain.awg import load_awg as lawg
 
 
+def demodulation_kernel(freqs, n_samples, samplerate, phase=0.):
+    """
+    kernel matrix for the fourier analysis of n_samples long segments at the (IF) frequencies freqs
+    :return: array (len(freqs), n_samples) of exp(-2 pi i f t) * exp(i phase) / n_samples
+    """
+    freqs = np.atleast_1d(freqs)
+    return np.exp(-2 * np.pi * 1j * np.outer(freqs, np.arange(n_samples)) / samplerate) * np.exp(1j * phase) / n_samples
+
+
+def benchmark_demodulation(n_segments=1000, n_samples=1024, n_tones=8, samplerate=1e9, repeat=5):
+    """
+    compares the decoding of all segments with one matrix product (cached kernel)
+    with calling fourieranalysis for every segment
+    :return: (time per readout with fourieranalysis, time per readout with the kernel) in s
+    """
+    fourieranalysis = virtual_MultiplexingReadout.fourieranalysis
+    fourieranalysis = getattr(fourieranalysis, '__func__', fourieranalysis)  # unbound method in python 2
+    freqs = np.linspace(10e6, 90e6, n_tones)
+    sig_t = np.random.randn(n_segments, n_samples) + 1j * np.random.randn(n_segments, n_samples)
+
+    t = time()
+    for i in range(repeat):
+        old = np.array([fourieranalysis(None, s, freqs, samplerate) for s in sig_t])
+    t_old = (time() - t) / repeat
+
+    kernel = demodulation_kernel(freqs, n_samples, samplerate)
+    t = time()
+    for i in range(repeat):
+        f_signal = sig_t.dot(kernel.T)
+    t_new = (time() - t) / repeat
+
+    if not np.allclose(old[:, 0, :], np.abs(f_signal)):
+        logging.error('demodulation benchmark: results do not agree.')
+    print('%i segments, %i samples, %i tones: fourieranalysis %.2f ms, kernel %.2f ms (x%.0f)' % (
+        n_segments, n_samples, n_tones, 1e3 * t_old, 1e3 * t_new, t_old / t_new))
+    return t_old, t_new
+
+
+def ddc_filter(f, samplerate, order=20, cut_off_freq_ratio=0.8, sos=False):
+    """
+    butterworth lowpass used in the digital down conversion of the (IF) frequency f
+    :return: (b, a) or, if sos, an array of second-order sections
+    """
+    cut_off_freq = cut_off_freq_ratio * np.abs(f) / (samplerate / 2.)
+    if sos:
+        return signal.butter(order, cut_off_freq, 'low', output='sos')
+    return signal.butter(order, cut_off_freq, 'low')
+
+
+def _ddc(sig_t, mixer, filters, decimation=1):
+    """
+    mixes all segments sig_t (segments, samples) down with the tones in mixer (tones, samples)
+    and filters them along the sample axis, one call per distinct filter
+    :param filters: list of (tone indices, filter) as returned by ddc_filter
+    :return: array (segments, tones, samples/decimation)
+    """
+    n_out = len(range(0, sig_t.shape[-1], decimation))
+    signal_down_lp = np.empty((sig_t.shape[0], mixer.shape[0], n_out), dtype=complex)
+    for idx, flt in filters:
+        signal_down = sig_t[:, np.newaxis, :] * mixer[idx]
+        if isinstance(flt, tuple):
+            signal_down = signal.lfilter(flt[0], flt[1], signal_down, axis=-1)
+        else:
+            signal_down = signal.sosfilt(flt, signal_down, axis=-1)
+        signal_down_lp[:, idx] = signal_down[..., ::decimation]
+    return signal_down_lp
+
+
+def benchmark_ddc(n_segments=100, n_samples=1024, n_tones=4, samplerate=1e9, order=20, repeat=5, sos=True):
+    """
+    compares the digital down conversion of all segments and tones at once (cached filters)
+    with designing the filter and filtering every tone of every segment separately
+    :param sos: filter in second-order sections, the (b, a) form of a butterworth filter of order 20
+                is numerically unstable, its output diverges. Only finite results are compared.
+    :return: (time per readout segment by segment, time per readout at once) in s
+    """
+    freqs = np.linspace(10e6, 90e6, n_tones)
+    sig_t = np.random.randn(n_segments, n_samples) + 1j * np.random.randn(n_segments, n_samples)
+    t_vec = np.linspace(0, float(n_samples) / samplerate, n_samples)
+
+    t = time()
+    for i in range(repeat):
+        old = np.zeros((n_segments, n_tones, n_samples), dtype=complex)
+        for s in range(n_segments):
+            for j, f in enumerate(freqs):
+                flt = ddc_filter(f, samplerate, order, sos=sos)
+                if sos:
+                    old[s, j] = signal.sosfilt(flt, sig_t[s] * np.exp(1j * 2 * np.pi * f * t_vec))
+                else:
+                    old[s, j] = signal.lfilter(flt[0], flt[1], sig_t[s] * np.exp(1j * 2 * np.pi * f * t_vec))
+    t_old = (time() - t) / repeat
+
+    mixer = np.exp(1j * 2 * np.pi * np.outer(freqs, t_vec))
+    filters = [([j], ddc_filter(f, samplerate, order, sos=sos)) for j, f in enumerate(freqs)]
+    t = time()
+    for i in range(repeat):
+        new = _ddc(sig_t, mixer, filters)
+    t_new = (time() - t) / repeat
+
+    finite = np.isfinite(old) & np.isfinite(new)
+    if not np.all(finite):
+        logging.warning('ddc benchmark: %i of %i filtered samples diverged.' % (np.sum(~finite), finite.size))
+    if not np.allclose(old[finite], new[finite]):
+        logging.error('ddc benchmark: results do not agree.')
+    print('%i segments, %i samples, %i tones: per segment %.2f ms, at once %.2f ms (x%.1f)' % (
+        n_segments, n_samples, n_tones, 1e3 * t_old, 1e3 * t_new, t_old / t_new))
+    return t_old, t_new
+
+
 class virtual_MultiplexingReadout(Instrument):
 
     def __init__(self, name, sample):
@@ -122,12 +232,20 @@ class virtual_MultiplexingReadout(Instrument):
         self._adc_channel_I = 1
         self._adc_channel_Q = 0
         self._phase = 0
+        # demodulation kernels, see _get_kernel()
+        self._kernels = {}
         
         # used for DDC
         self.lowpass_order = 20
         self.cut_off_freq_ratio = 0.8  # ratio of the IQ frequency up to that is transmitted
         # lowpass_delay = (lowpass_order / 2) / freqs
         # a lowpass of order N delays the signal by N/2 samples
+        self.lowpass_sos = False  # filter in second-order sections, numerically more stable for high orders
+        self.ddc_decimation = 1  # keep only every n-th sample of the down converted time trace
+        self.ddc_workers = 1  # threads filtering the segments in parallel
+        # filters and mixing phasors, see _get_ddc()
+        self._ddc_cache = {}
+        self._ddc_pool = None
 
     def get_all(self):
         self.get_LO()
@@ -201,6 +319,8 @@ class virtual_MultiplexingReadout(Instrument):
         """
         self.sample.readout_mw_src.set_frequency(frequency)
         self._LO = frequency
+        self._kernels = {}
+        self._ddc_cache = {}
 
     def do_get_LO(self):
         return self._LO
@@ -213,6 +333,8 @@ class virtual_MultiplexingReadout(Instrument):
 
     def do_set_tone_freq(self, freqs):
         self._tone_freq = np.array(freqs)
+        self._kernels = {}
+        self._ddc_cache = {}
 
     def do_get_tone_freq(self):
         return self._tone_freq
@@ -231,6 +353,7 @@ class virtual_MultiplexingReadout(Instrument):
 
     def do_set_global_pha(self, phase):
         self._phase = float(phase)
+        self._kernels = {}
 
     def do_get_global_pha(self):
         return self._phase
@@ -273,22 +396,39 @@ class virtual_MultiplexingReadout(Instrument):
         :return:
         """
         Is, Qs = self._acquire_IQ()
+        return self.process(Is, Qs, timeTrace=timeTrace, ddc=ddc)
+
+    def acquire(self):
+        """
+        acquires the raw I and Q data without processing them, readout() is process(*acquire())
+        :return: I, Q
+        """
+        return self._acquire_IQ()
+
+    def process(self, Is, Qs, timeTrace=False, ddc=None, samplerate=None):
+        """
+        decodes the acquired I and Q data like readout(), can run in another thread than the acquisition
+        :param Is, Qs: raw data as returned by acquire()
+        :param timeTrace: also output raw trace for further processing
+        :param ddc: performs a digital down conversion
+        :param samplerate: adc clock, default: get_adc_clock(). Pass it when processing in another thread,
+                           so the digitizer is not queried there
+        :return:
+        """
+        if samplerate is None:
+            samplerate = self.get_adc_clock()
         if ddc is None:
             if len(Is.shape) == 2:
-                sig_amp = np.zeros((Is.shape[1], len(self._tone_freq)))
-                sig_pha = np.zeros((Is.shape[1], len(self._tone_freq)))
-                for idx in range(Is.shape[1]):
-                    sig_amp[idx, :], sig_pha[idx, :] = self.IQ_decode(Is[:, idx], Qs[:, idx])
+                # all segments at once, (segments, samples) x (samples, tones)
+                sig_amp, sig_pha = self.IQ_decode(Is.T, Qs.T, samplerate=samplerate)
             else:
-                sig_amp, sig_pha = self.IQ_decode(Is, Qs)
+                sig_amp, sig_pha = self.IQ_decode(Is, Qs, samplerate=samplerate)
         else:
             if len(Is.shape) == 2:
-                sig_amp = np.zeros((Is.shape[1],Is.shape[0], len(self._tone_freq)))
-                sig_pha = np.zeros((Is.shape[1],Is.shape[0], len(self._tone_freq)))
-                for idx in range(Is.shape[1]):
-                    sig_amp[idx,:, :], sig_pha[idx,:, :] = self.digital_down_conversion(Is[:, idx], Qs[:, idx])
+                # all segments at once, (segments, samples, tones)
+                sig_amp, sig_pha = self.digital_down_conversion(Is.T, Qs.T, samplerate=samplerate)
             else:
-                sig_amp, sig_pha = self.digital_down_conversion(Is, Qs)
+                sig_amp, sig_pha = self.digital_down_conversion(Is, Qs, samplerate=samplerate)
         if timeTrace:
             return sig_amp, sig_pha, Is, Qs
         else:
@@ -330,21 +470,37 @@ class virtual_MultiplexingReadout(Instrument):
             return amplitude and phase of requested frequency components
 
             Input:
-                I, Q       - signal acquired at rate samplerate
+                I, Q       - signal acquired at rate samplerate, a vector or
+                             an array (segments, samples) to decode many segments
                 freqs      - interesting frequency components
                 samplerate - rate at which I and Q were sampled
                 phase      - apply additional rotation to I+1j*Q
 
             Output:
-                two vectors: amplitude and phase of each fft point
+                two vectors (arrays (segments, freqs)): amplitude and phase of each fft point
         """
         if samplerate is None: samplerate = self.get_adc_clock()
         if freqs is None: freqs = self._tone_freq
         if phase is None: phase = self._phase
         freqs = np.array(freqs)-self._LO
 
-        sig_t = (np.array(I) + 1j*np.array(Q))*np.exp(1j*phase)
-        return self.fourieranalysis(sig_t, freqs, samplerate)
+        sig_t = np.array(I) + 1j*np.array(Q)
+        f_signal = sig_t.dot(self._get_kernel(freqs, sig_t.shape[-1], samplerate, phase).T)
+        return np.abs(f_signal), np.angle(f_signal)
+
+    def _get_kernel(self, freqs, n_samples, samplerate, phase):
+        """
+        returns the (cached) demodulation kernel, the cache is cleared when
+        the tone frequencies, the LO or the global phase are changed
+        """
+        key = (tuple(np.atleast_1d(freqs)), n_samples, samplerate, phase)
+        kernel = self._kernels.get(key)
+        if kernel is None:
+            if len(self._kernels) >= 8:
+                self._kernels = {}
+            kernel = demodulation_kernel(freqs, n_samples, samplerate, phase)
+            self._kernels[key] = kernel
+        return kernel
 
     def fourieranalysis(self, signal_t, freqs, samplerate):
         """
@@ -361,29 +517,68 @@ class virtual_MultiplexingReadout(Instrument):
         sig_pha = np.angle(f_signal)
         return sig_amp, sig_pha
 
-    def digital_down_conversion(self, I, Q, freqs=None):
+    def digital_down_conversion(self, I, Q, freqs=None, decimation=None, samplerate=None):
         """
         performs a digital down conversion to get rid of the carrier frequency.
         Useful for timetrace readout, when only envelope is needed.
-        :param I:
-        :param Q:
-        :param freqs:
-        :return:
+        All tones are mixed at once and all segments are filtered in one call along the sample axis,
+        with self.ddc_workers > 1 chunks of segments are filtered in a thread pool.
+        :param I: vector (samples) or array (segments, samples)
+        :param Q: same shape as I
+        :param freqs: IF frequencies, default: tone frequencies - LO
+        :param decimation: keep only every n-th sample, default: self.ddc_decimation
+        :param samplerate: rate at which I and Q were sampled, default: get_adc_clock()
+        :return: amplitude and phase, arrays (samples, tones) or (segments, samples, tones)
         """
         if freqs is None:
             freqs = np.array(self._tone_freq) - self._LO
-        samplerate = self.get_adc_clock()
-        sig_amp = np.zeros((len(freqs), len(I)))
-        sig_pha = np.zeros((len(freqs), len(I)))
-        t = np.linspace(0, float(len(I)) / samplerate, len(I))
-        for i, f in enumerate(freqs):
-            cut_off_freq = self.cut_off_freq_ratio * np.abs(f) / (samplerate / 2)
-            b, a = signal.butter(self.lowpass_order, cut_off_freq, 'low')  # design the filter
-            signal_down = (I+1j*Q)*np.exp(1j*2*np.pi*f*t)
-            signal_down_lp = scipy.signal.lfilter(b, a, signal_down)
-            sig_amp[i, :] = np.abs(signal_down_lp)
-            sig_pha[i, :] = np.angle(signal_down_lp)
-        return sig_amp.T, sig_pha.T  # transform because readout expects the data this way
+        if decimation is None:
+            decimation = self.ddc_decimation
+        if samplerate is None:
+            samplerate = self.get_adc_clock()
+        sig_t = np.atleast_2d(np.array(I) + 1j*np.array(Q))
+        mixer, filters = self._get_ddc(freqs, sig_t.shape[-1], samplerate, decimation)
+        workers = min(self.ddc_workers, len(sig_t))
+        if workers > 1:
+            if self._ddc_pool is None or self._ddc_pool._processes != workers:
+                if self._ddc_pool is not None:
+                    self._ddc_pool.close()
+                self._ddc_pool = ThreadPool(workers)
+            chunks = np.array_split(np.arange(len(sig_t)), workers)
+            signal_down_lp = np.concatenate(self._ddc_pool.map(
+                lambda idx: _ddc(sig_t[idx], mixer, filters, decimation), chunks))
+        else:
+            signal_down_lp = _ddc(sig_t, mixer, filters, decimation)
+        signal_down_lp = signal_down_lp.swapaxes(1, 2)  # transform because readout expects the data this way
+        if np.ndim(I) == 1:
+            signal_down_lp = signal_down_lp[0]
+        return np.abs(signal_down_lp), np.angle(signal_down_lp)
+
+    def _get_ddc(self, freqs, n_samples, samplerate, decimation=1):
+        """
+        returns the (cached) mixing phasors (tones, samples) and the list of (tone indices, filter),
+        tones with the same absolute IF frequency share one filter. The cache is cleared when
+        the tone frequencies or the LO are changed.
+        """
+        freqs = np.atleast_1d(freqs)
+        key = (tuple(freqs), n_samples, samplerate, self.lowpass_order, self.cut_off_freq_ratio,
+               bool(self.lowpass_sos), decimation)
+        ddc = self._ddc_cache.get(key)
+        if ddc is None:
+            if len(self._ddc_cache) >= 8:
+                self._ddc_cache = {}
+            if decimation > 1 and self.cut_off_freq_ratio * np.max(np.abs(freqs)) > samplerate / 2. / decimation:
+                logging.warning(__name__ + ': DDC decimation by %i aliases the passband of the lowpass.' % decimation)
+            t = np.linspace(0, float(n_samples) / samplerate, n_samples)
+            mixer = np.exp(1j * 2 * np.pi * np.outer(freqs, t))
+            tones = {}
+            for i, f in enumerate(np.abs(freqs)):
+                tones.setdefault(f, []).append(i)
+            filters = [(idx, ddc_filter(f, samplerate, self.lowpass_order, self.cut_off_freq_ratio, self.lowpass_sos))
+                       for f, idx in sorted(tones.items())]
+            ddc = mixer, filters
+            self._ddc_cache[key] = ddc
+        return ddc
 
     # +++++ DAC (AWG) settings ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
         
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Plot export service.
+
+The default plots of the measurement files (see qkit.gui.plot.plot.h5plot)
+are rendered by a pool of separate python processes, so matplotlib does not
+compete with the next measurement for the GIL of the kernel. The files are
+queued with submit() and handled one after the other by a dispatcher
+thread, the datasets of a file are rendered in parallel by the processes.
+
+A dataset is not rendered again, if the hash of its data, its attributes
+and the datasets it refers to (coordinates, views) did not change since its
+last export and the image still exists. The export time of every dataset is
+logged and kept in PlotExporter.timings.
+
+The number of processes is qkit.cfg['plot_export_processes'] (default: the
+number of CPUs, at most 4). With 0 the plots are rendered in the dispatcher
+thread of this process.
+
+The worker processes run
+    python -m qkit.gui.plot.export
+and read one task per line (json) from stdin. They get the sys.path of this
+process, so qkit is found also if it was added to sys.path at runtime. A
+process which does not finish a dataset within qkit.cfg['plot_export_timeout']
+seconds (default: 600) is killed and restarted, the dataset is not exported
+then. If the processes can not be started, the plots are rendered in this
+process.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+import qkit
+from qkit.storage import store
+from qkit.storage.hdf_overview import OVERVIEW_GROUP
+from qkit.gui.plot.plot import h5plot, image_path
+
+_RESULT = 'PLOT_EXPORT '  # marks the result lines of the workers
+_READY = 'PLOT_EXPORT_READY'  # first line of a worker after its imports
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def _dataset_urls(h5_filepath):
+    """Returns the urls of all datasets of a file."""
+    data = store.Data(h5_filepath, mode='r', lazy=True)
+    try:
+        urls = []
+        for pentry in data['/entry'].keys():
+            key = '/entry/' + pentry
+            if key == OVERVIEW_GROUP:
+                continue
+            for centry in data[key].keys():
+                urls.append(key + '/' + centry)
+        return urls
+    finally:
+        data.close()
+
+
+def _dataset_hash(data, url):
+    """
+    Returns the sha1 digest of the data and the attributes of the dataset url
+    and of all datasets it refers to.
+    """
+    h = hashlib.sha1()
+    todo, seen = [url], set()
+    while todo:
+        url = todo.pop()
+        if url in seen:
+            continue
+        seen.add(url)
+        try:
+            ds = data[url]
+        except KeyError:
+            continue
+        h.update(url.encode())
+        for k in sorted(ds.attrs.keys()):
+            v = ds.attrs[k]
+            if isinstance(v, bytes):
+                v = v.decode('utf-8', 'replace')
+            if isinstance(v, str) and (k.endswith('_ds_url') or k.startswith('xy_')):
+                todo.extend(v.split(':'))
+            if isinstance(v, np.ndarray) and v.dtype.kind != 'O':
+                v = v.tobytes()
+            h.update(repr((k, v)).encode())
+        if not hasattr(ds, 'dtype'):
+            continue  # group
+        if ds.dtype.kind == 'O' or not ds.shape:
+            h.update(repr(ds[()]).encode())
+            continue
+        # read large datasets in blocks of about 4 MB
+        row_bytes = max(1, ds.dtype.itemsize * ds.size // max(1, ds.shape[0]))
+        step = max(1, 2 ** 22 // row_bytes)
+        for i in range(0, ds.shape[0], step):
+            h.update(np.ascontiguousarray(ds[i:i + step]).tobytes())
+    return h.hexdigest()
+
+
+def _export_dataset(h5_filepath, url, comment, save_pdf, known_hash):
+    """
+    Renders the plot of one dataset, unless its hash is known_hash.
+
+    Returns:
+        [url, hash (None on errors), seconds, rendered, image written]
+    """
+    t0 = time.time()
+    try:
+        data = store.Data(h5_filepath, mode='r', lazy=True)
+        try:
+            digest = _dataset_hash(data, url)
+        finally:
+            data.close()
+        if digest == known_hash:
+            return [url, digest, time.time() - t0, False, True]
+        h5plot(h5_filepath, comment=comment, save_pdf=save_pdf, datasets=[url])
+    except Exception as e:
+        logging.error("Plot export of %s in %s failed: %s" % (url, h5_filepath, e))
+        return [url, None, time.time() - t0, False, False]
+    image = os.path.isfile(image_path(h5_filepath, url, comment) + '.png')
+    return [url, digest, time.time() - t0, True, image]
+
+
+class PlotExporter(object):
+    """
+    Queue of plot exports and the pool of plot processes.
+
+    Args:
+        processes: number of plot processes, default: qkit.cfg['plot_export_processes'].
+        timeout: seconds per dataset before a plot process is killed, default: qkit.cfg['plot_export_timeout'].
+    """
+
+    def __init__(self, processes=None, timeout=None):
+        if processes is None:
+            processes = qkit.cfg.get('plot_export_processes', None)
+        if processes is None:
+            processes = min(4, multiprocessing.cpu_count())
+        if timeout is None:
+            timeout = qkit.cfg.get('plot_export_timeout', 600)
+        self.processes = processes
+        self.timeout = timeout
+        self._in_process = False  # the plot processes could not be started
+        self._render_lock = threading.Lock()
+        self.timings = {}  # (h5 file, ds url): seconds of the last export
+        self._hashes = {}  # image path: (hash, image written) of the last export
+        self._jobs = queue.Queue()
+        self._tasks = queue.Queue()
+        threads = [threading.Thread(target=self._run, name='plot_export')]
+        threads += [threading.Thread(target=self._serve, name='plot_export_%i' % i) for i in range(processes)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+    def submit(self, h5_filepath, comment='', save_pdf=False):
+        """
+        Queues the export of the default plots of all datasets of a (closed) h5 file.
+        """
+        self._jobs.put((os.path.abspath(h5_filepath), comment or '', save_pdf))
+
+    def wait(self):
+        """Waits until all queued files are exported."""
+        self._jobs.join()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                self._export(*job)
+            except Exception as e:
+                logging.error("Plot export of %s failed: %s" % (job[0], e))
+            finally:
+                self._jobs.task_done()
+
+    def _export(self, h5_filepath, comment, save_pdf):
+        t0 = time.time()
+        tasks = []
+        for url in _dataset_urls(h5_filepath):
+            known = self._hashes.get(image_path(h5_filepath, url, comment))
+            if known is not None and known[1] and not os.path.isfile(image_path(h5_filepath, url, comment) + '.png'):
+                known = None  # image deleted
+            tasks.append([h5_filepath, url, comment, save_pdf, known and known[0]])
+        if self.processes:
+            results = queue.Queue()
+            for task in tasks:
+                self._tasks.put((task, results))
+            results = [results.get() for task in tasks]
+        else:
+            results = [_export_dataset(*task) for task in tasks]
+
+        rendered = 0
+        for url, digest, seconds, new, image in results:
+            self.timings[(h5_filepath, url)] = seconds
+            if digest is None:
+                continue
+            self._hashes[image_path(h5_filepath, url, comment)] = (digest, image)
+            rendered += new
+            logging.info("Plot export %s: %s in %.2f s" % (url, 'rendered' if new else 'unchanged', seconds))
+        print('Plots saved in %s (%i of %i datasets rendered, %.1f s)' % (
+            os.path.join(os.path.dirname(h5_filepath), 'images'), rendered, len(tasks), time.time() - t0))
+
+    def _serve(self):
+        """Feeds the tasks to one plot process, restarted if it dies or hangs."""
+        proc, lines = None, None
+        while True:
+            task, results = self._tasks.get()
+            t0 = time.time()
+            try:
+                if not self._in_process and (proc is None or proc.poll() is not None):
+                    _stop(proc)
+                    proc, lines = self._start_process()
+                    if proc is None:
+                        logging.error("Plot export: the plot process could not be started, "
+                                      "the plots are rendered in this process.")
+                        self._in_process = True
+                if self._in_process:
+                    with self._render_lock:
+                        results.put(_export_dataset(*task))
+                    continue
+                proc.stdin.write(json.dumps(task) + '\n')
+                proc.stdin.flush()
+                while True:
+                    try:
+                        line = lines.get(timeout=max(0., t0 + self.timeout - time.time()))
+                    except queue.Empty:
+                        raise IOError('no result within %s s, plot process killed' % self.timeout)
+                    if not line:
+                        raise IOError('plot process exited')
+                    if line.startswith(_RESULT):
+                        results.put(json.loads(line[len(_RESULT):]))
+                        break
+            except Exception as e:
+                logging.error("Plot export of %s failed: %s" % (task[1], e))
+                _stop(proc)
+                proc = None
+                results.put([task[1], None, time.time() - t0, False, False])
+
+    def _start_process(self):
+        """
+        Starts a plot process with the sys.path of this process.
+
+        Returns:
+            (process, queue of its output lines), (None, None) if it exits or
+            hangs before it is ready.
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(os.path.abspath(p) if p else os.getcwd() for p in sys.path)
+        try:
+            proc = subprocess.Popen([sys.executable, '-m', 'qkit.gui.plot.export'], shell=False, env=env,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+        except OSError as e:
+            logging.error("Plot export: %s" % e)
+            return None, None
+        lines = queue.Queue()
+        reader = threading.Thread(target=_read_lines, args=(proc.stdout, lines), name='plot_export_reader')
+        reader.daemon = True
+        reader.start()
+        t0 = time.time()
+        while True:
+            try:
+                line = lines.get(timeout=max(0., t0 + self.timeout - time.time()))
+            except queue.Empty:
+                line = ''
+            if not line:
+                _stop(proc)
+                return None, None
+            if line.strip() == _READY:
+                return proc, lines
+
+
+def _read_lines(stream, lines):
+    """Puts the lines of the output of a plot process into a queue, '' at the end."""
+    try:
+        for line in iter(stream.readline, ''):
+            lines.put(line)
+    except (IOError, ValueError):
+        pass  # pipe closed
+    lines.put('')
+
+
+def _stop(proc):
+    """Kills a plot process (if still running) and closes its pipes."""
+    if proc is None:
+        return
+    try:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+    except OSError:
+        pass
+    for pipe in (proc.stdin, proc.stdout):
+        try:
+            pipe.close()
+        except (IOError, OSError, ValueError):
+            pass
+
+
+def get_exporter():
+    """
+    Returns the plot export service, started on the first call.
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = PlotExporter()
+            atexit.register(_exporter.wait)  # like the former plot threads, exit after the export
+        return _exporter
+
+
+def _worker():
+    out = sys.stdout
+    sys.stdout = sys.stderr  # prints of the plot code do not mix with the results
+    out.write(_READY + '\n')
+    out.flush()
+    for line in iter(sys.stdin.readline, ''):
+        result = _export_dataset(*json.loads(line))
+        out.write(_RESULT + json.dumps(result) + '\n')
+        out.flush()
+
+
+if __name__ == '__main__':
+    _worker()
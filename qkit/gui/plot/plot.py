@@ -12,6 +12,8 @@ logging.basicConfig(level=logging.INFO)
 import qkit
 from qkit.storage import store
 from qkit.storage.hdf_constants import ds_types
+from qkit.storage.hdf_overview import OVERVIEW_GROUP, select_level
+from qkit.storage.hdf_file import filled_rows
 
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
@@ -89,6 +91,45 @@ def save_plots(h5_filepath, comment='', save_pdf=False):
     h5plot(h5_filepath, comment=comment, save_pdf=save_pdf)
 
 
+def save_plots_async(h5_filepath, comment='', save_pdf=False):
+    """
+    Queues the export of the plots of all datasets to the plot export service,
+    which renders them in separate processes (see qkit.gui.plot.export).
+    The file has to be closed by the measurement before.
+    
+    Args:
+        h5_filepath: String, absolute filepath.
+        comment: Optional comment for the plots to be added to the filenames.
+            default : ''
+        save_pdf: Optional boolean setting for the output file type.
+            default: False
+    """
+    from qkit.gui.plot.export import get_exporter
+    get_exporter().submit(h5_filepath, comment=comment, save_pdf=save_pdf)
+
+
+def image_path(h5_filepath, ds_url, comment=''):
+    """
+    Returns the path (without extension) of the saved plot of a dataset.
+    """
+    filedir = os.path.dirname(os.path.abspath(h5_filepath))
+    save_name = str(os.path.basename(filedir))[0:6] + '_' + ds_url.replace('/entry/','').replace('/','_')
+    if comment:
+        save_name = save_name+'_'+comment
+    return str(os.path.join(filedir, 'images', save_name))
+
+
+def _last_trace(ds):
+    """
+    Returns the last written trace of a matrix or box, preallocated rows
+    without data are skipped (see qkit.storage.hdf_file.filled_rows()).
+    """
+    row = max(filled_rows(ds), 1) - 1
+    if len(ds.shape) == 2:
+        return np.array(ds[row])
+    return np.array(ds[row, max(filled_rows(ds, 1, row), 1) - 1, :])
+
+
 class h5plot(object):
     """
     h5plot class plots and saves all dataset in the h5 file.
@@ -99,9 +140,10 @@ class h5plot(object):
     """
     y_data = None  # type: ndarray
 
-    def __init__(self,h5_filepath, comment='', save_pdf=False):
+    def __init__(self,h5_filepath, comment='', save_pdf=False, datasets=None):
         """Inits h5plot with a h5_filepath (string, absolute path), optional 
-        comment string, and optional save_pdf boolean.
+        comment string, optional save_pdf boolean, and an optional list of 
+        dataset urls to be plotted (default: all).
         """
         self.comment = comment
         self.save_pdf = save_pdf
@@ -114,18 +156,22 @@ class h5plot(object):
         try:
             os.mkdir(self.image_dir)
         except OSError:
-            logging.warning('Error creating image directory.')
-            pass
+            if not os.path.isdir(self.image_dir):
+                logging.warning('Error creating image directory.')
 
         # open the h5 file and get the hdf_lib object
-        self.hf = store.Data(self.path)
+        self.hf = store.Data(self.path, mode='r', lazy=True)
 
         # check for datasets
         for i, pentry in enumerate(self.hf['/entry'].keys()):
             key='/entry/'+pentry
+            if key == OVERVIEW_GROUP:
+                continue
             for j, centry in enumerate(self.hf[key].keys()):
                 try:
                     self.key='/entry/'+pentry+"/"+centry
+                    if datasets is not None and self.key not in datasets:
+                        continue
                     self.ds = self.hf[self.key]
                     if self.ds.attrs.get('save_plot', True):
                         self.plt() # this is the plot function
@@ -135,7 +181,8 @@ class h5plot(object):
                     print(e)
         #close hf file
         self.hf.close()
-        print('Plots saved in ' + self.image_dir)
+        if datasets is None:
+            print('Plots saved in ' + self.image_dir)
 
     def plt(self):
         """
@@ -190,14 +237,11 @@ class h5plot(object):
         for i in self.ax.get_yticklabels():
             i.set_fontsize(16)
 
-        save_name = str(os.path.basename(self.filedir))[0:6] + '_' + self.key.replace('/entry/','').replace('/','_')
-        if self.comment:
-            save_name = save_name+'_'+self.comment
-        image_path = str(os.path.join(self.image_dir,save_name))
+        save_path = image_path(self.path, self.key, self.comment)
 
         if self.save_pdf:
-            self.canvas.print_figure(image_path+'.pdf')
-        self.canvas.print_figure(image_path+'.png')
+            self.canvas.print_figure(save_path+'.pdf')
+        self.canvas.print_figure(save_path+'.png')
 
         """
         except Exception as e:
@@ -253,12 +297,12 @@ class h5plot(object):
         self.y_ds = self.hf[self.y_ds_url]
         self.y_exp = self._get_exp(np.array(self.y_ds))
         self.y_label = self.y_ds.attrs.get('name', '_yname_') + ' (' + self._unit_prefixes[self.y_exp] + self.y_ds.attrs.get('unit', '_yunit_') + ')'
-        self.ds_data = np.array(self.ds).T #transpose matrix to get x/y axis correct
+        self.ds_data = self._get_matrix_data().T #transpose matrix to get x/y axis correct
         self.ds_exp = self._get_exp(self.ds_data)
         self.ds_data *= 10.**-self.ds_exp
         self.ds_label = self.ds.attrs.get('name', '_name_') + ' (' + self._unit_prefixes[self.ds_exp] + self.ds.attrs.get('unit', '_unit_') + ')'
 
-        x_data = np.array(self.x_ds)*10.**-self.x_exp
+        x_data = np.array(self.x_ds)[:filled_rows(self.ds)]*10.**-self.x_exp  # only the measured traces
         x_min, x_max = np.amin(x_data), np.amax(x_data)
         dx = self.x_ds.attrs.get('dx', (x_data[-1]-x_data[0])/(len(x_data)-1))
         y_data = np.array(self.y_ds)*10.**-self.y_exp
@@ -289,6 +333,27 @@ class h5plot(object):
         for i in self.cbar.ax.get_yticklabels():
             i.set_fontsize(16)
 
+    def _get_matrix_data(self):
+        """
+        Reads the written traces of the matrix self.ds for the figure, the
+        rows of a preallocated matrix without data are left out. For large 
+        matrices with overview levels (see qkit.storage.hdf_overview) the mean
+        values of the coarsest level with at least one value per pixel of the 
+        figure are used.
+
+        Args:
+            self: Object of the h5plot class.
+        Returns:
+            numpy array with the (downsampled) matrix.
+        """
+        rows = filled_rows(self.ds)
+        width, height = self.fig.get_size_inches() * self.fig.dpi
+        factor, url = select_level(self.ds, rows, self.ds.shape[1], width, height)
+        if url is None:
+            return np.array(self.ds[:rows])
+        logging.info(" -> using overview level with factor %i" % factor)
+        return np.array(self.hf[url][:-(-rows // factor), :, 2])
+
     def plt_box(self):
         """
         Plot two-dimensional dataset. Print data color-coded y-coordinate
@@ -309,12 +374,12 @@ class h5plot(object):
         self.z_ds = self.hf[self.z_ds_url]
         self.z_exp = self._get_exp(np.array(self.z_ds))
         self.z_label = self.z_ds.attrs.get('name', '_zname_') + ' (' + self._unit_prefixes[self.z_exp] + self.z_ds.attrs.get('unit', '_zunit_') + ')'
-        self.ds_data = np.array(self.ds)[:, :, self.ds.shape[2] / 2].T  # transpose matrix to get x/y axis correct
+        self.ds_data = np.array(self.ds[:filled_rows(self.ds)])[:, :, self.ds.shape[2] / 2].T  # transpose matrix to get x/y axis correct
         self.ds_exp = self._get_exp(self.ds_data)
         self.ds_data *= 10.**-self.ds_exp
         self.ds_label = self.ds.attrs.get('name', '_name_') + ' (' + self._unit_prefixes[self.ds_exp] + self.ds.attrs.get('unit', '_unit_') + ')'
 
-        x_data = np.array(self.x_ds)*10.**-self.x_exp
+        x_data = np.array(self.x_ds)[:filled_rows(self.ds)]*10.**-self.x_exp  # only the measured matrices
         x_min, x_max = np.amin(x_data), np.amax(x_data)
         dx = self.x_ds.attrs.get('dx', (x_data[-1]-x_data[0])/(len(x_data)-1))
         y_data = np.array(self.y_ds)*10.**-self.y_exp
@@ -423,26 +488,16 @@ class h5plot(object):
                     if err_ds:
                         err_data = np.array(err_ds)
     
-                elif y_ds.attrs.get('ds_type',0) == ds_types['matrix']:
+                elif y_ds.attrs.get('ds_type',0) == ds_types['matrix'] or y_ds.attrs.get('ds_type',0) == ds_types['box']:
                     x_data = np.array(x_ds)
-                    y_data = np.array(y_ds[-1])
+                    y_data = _last_trace(y_ds)
                     if err_ds:
-                        err_data = np.array(err_ds[-1])
-    
-                elif y_ds.attrs.get('ds_type',0) == ds_types['box']:
-                    x_data = np.array(x_ds)
-                    y_data = np.array(y_ds[-1,-1,:])
-                    if err_ds:
-                        err_data = np.array(err_ds[-1,-1,:])
+                        err_data = _last_trace(err_ds)
     
             ## This is in our case used so far only for IQ plots. The functionality derives from this application.
-            elif x_ds.attrs.get('ds_type',0) == ds_types['matrix']:
-                x_data = np.array(x_ds[-1])
-                y_data = np.array(y_ds[-1])
-            
-            elif x_ds.attrs.get('ds_type',0) == ds_types['box']:
-                x_data = np.array(x_ds[-1,-1,:])
-                y_data = np.array(y_ds[-1,-1,:])
+            elif x_ds.attrs.get('ds_type',0) == ds_types['matrix'] or x_ds.attrs.get('ds_type',0) == ds_types['box']:
+                x_data = _last_trace(x_ds)
+                y_data = _last_trace(y_ds)
 
             plot_style = self.plot_styles[view_params.get('plot_style', int(not (len(y_data) - 1)) * 2)] # default is 'x' for one point and '-' for lines
             if err_ds:
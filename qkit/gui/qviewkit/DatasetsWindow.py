@@ -29,6 +29,8 @@ if not in_pyqt5:
 
 import h5py
 from qkit.gui.qviewkit.main_view import Ui_MainWindow
+from qkit.storage.hdf_overview import OVERVIEW_GROUP
+from qkit.storage.hdf_file import is_swmr_writing
 
 class DatasetsWindow(QMainWindow, Ui_MainWindow):
     """DatasetsWindow fills the frame of the Ui_MainWindow.
@@ -62,13 +64,17 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
         
         self.refreshTime_value = 2000
         self.tree_refresh  = True
+        self.h5file = None
+        self._h5file_stat = None
+        self._ds_handles = {}
+        self._swmr = False
         self._setup_signal_slots()        
         self.setup_timer()
         self.set_cmd_options()
         
     def setup_timer(self):
         self.timer = QTimer()
-        self.timer.timeout.connect(self.update_file)
+        self.timer.timeout.connect(self._live_update)
         self.timer.timeout.connect(self.live_update_onoff)
             
     def set_cmd_options(self):
@@ -100,7 +106,7 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
         self.treeWidget.itemSelectionChanged.connect((self.handleSelectionChanged))
                 
         self.refreshTime.valueChanged.connect(self._refresh_time_handler)
-        self.updateButton.released.connect(self.update_file)
+        self.updateButton.released.connect(self._reopen_file)
         
         self.FileButton.clicked.connect(self.open_file)
         self.liveCheckBox.clicked.connect(self.live_update_onoff)
@@ -111,6 +117,7 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
 
         self.DATA._remove_plot_widgets( closeAll = True)
         self.DATA.set_info_thread_continue(False)
+        self._close_h5file()
         event.accept()
     
     @pyqtSlot()
@@ -143,6 +150,9 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
         """itterate over the whole entry tree and collect the attributes """
         for i,pentry in enumerate(self.h5file["/entry"].keys()):
             tree_key = "/entry/"+pentry
+            if tree_key == OVERVIEW_GROUP:
+                # downsampled copies of the data, used by the 2d plots
+                continue
             if tree_key not in self.DATA.ds_tree_items:
                 parent = self.addParent(self.parent, column, str(pentry))
                 self.DATA.ds_tree_items[tree_key] = parent
@@ -229,14 +239,93 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
             self.Dataset_properties.insertPlainText(self.DATA.dataset_info[ds])
  
             
+    def _get_file_stat(self):
+        try:
+            st = os.stat(str(self.DATA.DataFilePath))
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def _file_changed(self):
+        "True if the file was modified on disk since the last update"
+        stat = self._get_file_stat()
+        return stat is None or stat != self._h5file_stat
+
+    def _open_h5file(self):
+        """Opens the h5 file for reading.
+        
+        The file is opened once and kept open. Files written in SWMR (single 
+        writer multiple reader) mode stay open for the whole measurement, the 
+        datasets are refreshed on every update (see get_dataset()). All other 
+        files are only reopened if they changed on disk (mtime or size), as 
+        the hdf5 library does not see changes of other processes otherwise.
+        The SWMR mode is marked by the writer in the file (see 
+        qkit.storage.hdf_file.is_swmr_writing()), the hdf5 library opens any
+        file in the latest format as SWMR reader.
+        """
+        path = str(self.DATA.DataFilePath)
+        if self.h5file and self._h5file_path == path and (
+                (self._swmr and is_swmr_writing(self.h5file)) or not self._file_changed()):
+            # a SWMR file is reopened like other files after the writer closed it
+            return
+        self._close_h5file()
+        stat = self._get_file_stat()
+        try:
+            self.h5file = h5py.File(path, mode='r')
+        except (IOError, OSError):
+            # a file in SWMR mode can only be opened as SWMR reader
+            self.h5file = None
+        if self.h5file is None or is_swmr_writing(self.h5file):
+            if self.h5file:
+                self.h5file.close()
+            self.h5file = h5py.File(path, mode='r', libver='latest', swmr=True)
+        self._swmr = self.h5file.swmr_mode and is_swmr_writing(self.h5file)
+        self._h5file_path = path
+        self._h5file_stat = stat
+
+    def _close_h5file(self):
+        self._ds_handles = {}
+        self._h5file_stat = None
+        self._swmr = False
+        if self.h5file:
+            self.h5file.close()
+
+    def _live_update(self):
+        "the timer only updates the tree and the plots if the file has changed"
+        if self.h5file and not self._file_changed():
+            return
+        self.update_file()
+
+    def _reopen_file(self):
+        "a manual update also reopens a SWMR file, e.g. to show new datasets"
+        self._close_h5file()
+        self.update_file()
+
+    def get_dataset(self, ds_url):
+        """Returns the dataset 'ds_url' of the open file.
+        
+        In SWMR mode the dataset handles are kept and refreshed to see the 
+        data appended since the last update.
+        """
+        if not self._swmr:
+            return self.h5file[ds_url]
+        ds = self._ds_handles.get(ds_url)
+        if ds is None:
+            ds = self.h5file[ds_url]
+            self._ds_handles[ds_url] = ds
+        ds.refresh()
+        return ds
+
     def update_file(self):
-        "update_file is regularly called when _something_ has to be updated. open-> do something->close"
+        """update_file is regularly called when _something_ has to be updated. 
+        The file is kept open between the updates, see _open_h5file()."""
         try:
-            self.h5file= h5py.File(str(self.DATA.DataFilePath),mode='r')
+            self._open_h5file()
+            if self._swmr:
+                self._h5file_stat = self._get_file_stat()
             self.DATA.filename = self.h5file.filename.split(os.path.sep)[-1]
             self.populate_data_list()
             self.update_plots()
-            self.h5file.close()
             
             s = (self.DATA.DataFilePath.split(os.path.sep)[-5:])
             self.statusBar().showMessage((os.path.sep).join(s for s in s))
@@ -254,10 +343,9 @@ class DatasetsWindow(QMainWindow, Ui_MainWindow):
             
         if _DataFilePath:
             self.DATA.DataFilePath = _DataFilePath
-            self.h5file= h5py.File(self.DATA.DataFilePath,mode='r')
+            self._open_h5file()
             self.DATA.filename = self.h5file.filename.split(os.path.sep)[-1]
             self.populate_data_list()
-            self.h5file.close()
             
             s = (self.DATA.DataFilePath.split(os.path.sep)[-5:])
             self.statusBar().showMessage((os.path.sep).join(s for s in s))
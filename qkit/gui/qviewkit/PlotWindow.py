@@ -32,7 +32,7 @@ import qkit
 from qkit.gui.qviewkit.plot_view import Ui_Form
 from qkit.storage.hdf_constants import ds_types, view_types
 from qkit.gui.qviewkit.PlotWindow_lib import _display_1D_view, _display_1D_data, _display_2D_data, _display_table, _display_text
-from qkit.gui.qviewkit.PlotWindow_lib import _get_ds, _get_ds_url, _get_name, _get_unit
+from qkit.gui.qviewkit.PlotWindow_lib import _get_ds, _get_ds_url, _get_name, _get_unit, _overview_outdated
 
 class PlotWindow(QWidget,Ui_Form):
     """PlotWindow class organizes the correct display of data in a h5 file.
@@ -95,7 +95,7 @@ class PlotWindow(QWidget,Ui_Form):
         """
         #print "PWL update_plots:", self.obj_parent.h5file
 
-        self.ds = self.obj_parent.h5file[self.dataset_url]
+        self.ds = self.obj_parent.get_dataset(self.dataset_url)
         self.ds_type = self.ds.attrs.get('ds_type', -1)
         
         # The axis names are parsed to plot_view's Ui_Form class to label the UI selectors 
@@ -165,6 +165,7 @@ class PlotWindow(QWidget,Ui_Form):
                     self.graphicsView.setObjectName(self.dataset_url)
                     self.addQvkMenu(self.graphicsView.view.getMenu())
                     self.graphicsView.view.setAspectLocked(False)
+                    self.graphicsView.view.sigRangeChanged.connect(self._onViewRangeChanged)
                     self.gridLayout.addWidget(self.graphicsView,0,0)
                 _display_2D_data(self,self.graphicsView)
 
@@ -193,6 +194,11 @@ class PlotWindow(QWidget,Ui_Form):
             print(e)
 
 
+    def _onViewRangeChanged(self, *args):
+        """Reloads the 2d plot, if zooming needs a different overview level of the data."""
+        if _overview_outdated(self, self.graphicsView):
+            self.update_plots()
+
     def _setup_signal_slots(self):
         """Depending on the dataset type the possible signal slots are created
         
@@ -31,9 +31,12 @@ if not in_pyqt5:
 
 import numpy as np
 import json
+import warnings
 import pyqtgraph as pg
 import qkit
 from qkit.storage.hdf_constants import ds_types
+from qkit.storage.hdf_overview import get_levels, select_level
+from qkit.storage.hdf_file import filled_rows
 import pprint
 
 
@@ -108,9 +111,9 @@ def _display_1D_view(self, graphicsView):
                     self.VTraceYSelector.setEnabled(False)
                     
                     x_data = dss[0][()]
-                    y_data = dss[1][()][self.VTraceXNum]
+                    y_data = _get_slice(dss[1], (self.VTraceXNum,))
                     if err_url:
-                        err_data = dss[2][()][self.VTaceXNum]
+                        err_data = _get_slice(dss[2], (self.VTraceXNum,))
                 
                 elif y_ds_type == ds_types['box']:
                     self.VTraceXSelector.setEnabled(True)
@@ -123,9 +126,9 @@ def _display_1D_view(self, graphicsView):
                     self.VTraceYValue.setText(self._getYValueFromTraceNum(dss[1], self.VTraceYNum))
                     
                     x_data = dss[0][()]
-                    y_data = dss[1][()][self.VTraceXNum, self.VTraceYNum, :]
+                    y_data = _get_slice(dss[1], (self.VTraceXNum, self.VTraceYNum))
                     if err_url:
-                        err_data = dss[2][()][self.VTraceXNum, self.VTraceYNum, :]
+                        err_data = _get_slice(dss[2], (self.VTraceXNum, self.VTraceYNum))
             
             ## This is in our case used so far only for IQ plots. The 
             ## functionality derives from this application.
@@ -136,8 +139,8 @@ def _display_1D_view(self, graphicsView):
                 self.VTraceXValue.setText(self._getXValueFromTraceNum(dss[1], self.VTraceXNum))
                 self.VTraceYSelector.setEnabled(False)
                 
-                x_data = dss[0][()][self.VTraceXNum]
-                y_data = dss[1][()][self.VTraceXNum]
+                x_data = _get_slice(dss[0], (self.VTraceXNum,))
+                y_data = _get_slice(dss[1], (self.VTraceXNum,))
             
             elif x_ds_type == ds_types['box']:
                 self.VTraceXSelector.setEnabled(True)
@@ -149,8 +152,8 @@ def _display_1D_view(self, graphicsView):
                 self.VTraceYSelector.setRange(-1 * range_maxY, range_maxY - 1)
                 self.VTraceYValue.setText(self._getYValueFromTraceNum(dss[1], self.VTraceYNum))
                 
-                x_data = dss[0][()][self.VTraceXNum, self.VTraceYNum, :]
-                y_data = dss[1][()][self.VTraceXNum, self.VTraceYNum, :]
+                x_data = _get_slice(dss[0], (self.VTraceXNum, self.VTraceYNum))
+                y_data = _get_slice(dss[1], (self.VTraceXNum, self.VTraceYNum))
             
             else:
                 return
@@ -243,7 +246,7 @@ def _display_1D_data(self, graphicsView):
         # timestamps do (not?) have a x_ds_url in the 1d case. This is more a bug to be fixed in the
         # timstamp_ds part of qkit the resulting error is fixed here for now.
         try:
-            x_data = dss[0][()][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if neccessary
+            x_data = dss[0][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if neccessary
         except:
             x_data = [i for i in range(dss[1].shape[-1])]
         y_data = dss[1][()]
@@ -280,8 +283,8 @@ def _display_1D_data(self, graphicsView):
                 self.TraceXSelector.setValue(self.TraceXNum)
                 self.TraceXValueChanged = False
             
-            y_data = dss[1][()][self.TraceXNum]
-            x_data = dss[0][()][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if neccessary
+            y_data = _get_slice(dss[1], (self.TraceXNum,))
+            x_data = dss[0][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if neccessary
         
         if self.PlotTypeSelector.currentIndex() == 2:  # x_ds on x-axis
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url'])
@@ -298,8 +301,8 @@ def _display_1D_data(self, graphicsView):
                 self.TraceYSelector.setValue(self.TraceYNum)
                 self.TraceYValueChanged = False
             
-            y_data = dss[1][()][:, self.TraceYNum]
-            x_data = dss[0][()][:dss[1].shape[0]]  # x_data gets truncated to y_data shape if neccessary
+            y_data = _get_slice(dss[1], (slice(None), self.TraceYNum))
+            x_data = dss[0][:dss[1].shape[0]]  # x_data gets truncated to y_data shape if neccessary
         
         self.TraceXValue.setText(self._getXValueFromTraceNum(self.ds, self.TraceXNum))
         self.TraceYValue.setText(self._getYValueFromTraceNum(self.ds, self.TraceYNum))
@@ -339,8 +342,8 @@ def _display_1D_data(self, graphicsView):
         self.TraceXValue.setText(self._getXValueFromTraceNum(self.ds, self.TraceXNum))
         self.TraceYValue.setText(self._getYValueFromTraceNum(self.ds, self.TraceYNum))
         
-        x_data = dss[0][()][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if neccessary
-        y_data = dss[1][()][self.TraceXNum, self.TraceYNum, :]
+        x_data = dss[0][:dss[1].shape[-1]]  # x_data gets truncated to y_data shape if neccessary
+        y_data = _get_slice(dss[1], (self.TraceXNum, self.TraceYNum))
     
     ## Any data manipulation (dB <-> lin scale, etc) is done here
     y_data, units[1] = _do_data_manipulation(y_data, units[1], self.ds_type, self.manipulation, self.manipulations)
@@ -398,6 +401,8 @@ def _display_2D_data(self, graphicsView):
     scaled axis data.
     Depending on the ds-type, the QComboBox handles the index of the shown 
     data.
+    Large matrices and boxes with overview levels are displayed downsampled, 
+    see _choose_overview().
     
     Args:
         self: Object of the PlotWindow class.
@@ -407,14 +412,21 @@ def _display_2D_data(self, graphicsView):
         No return variable. The function operates on an object of the 
         PlotWindow class.
     """
-    
+    self._overview_state = None  # no level changes while the image is set
+    self._image_update = None  # set by _get_image()
+    self._overview_key, self._overview_levels, self._overview_zoomed = None, [], False
+    factor = 1
     if self.ds_type == ds_types['matrix']:
         """
         The matrix ds-type only knows one 2d plotting option. x_ds on x- and y_ds on y-axis
         """
         dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url', 'y_ds_url'])
         try:
-          data = dss[2][()]
+          factor, overview = _choose_overview(self, graphicsView, dss[2], dss[2].shape[0], dss[2].shape[1])
+          if overview is None:
+            data = _get_image(self, dss[2], (slice(None), slice(None)), _get_fill(dss[2], 0))
+          else:
+            data = _get_image(self, overview, (slice(None), slice(None), 2), _scale_fill(_get_fill(dss[2], 0), factor))
         except IOError as e:
               print("Could not open data file")
               print(e)
@@ -441,7 +453,14 @@ def _display_2D_data(self, graphicsView):
             
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['y_ds_url', 'z_ds_url'])
             try:
-              data = dss[2][()][self.TraceXNum, :, :]
+              factor, overview = _choose_overview(self, graphicsView, dss[2], dss[2].shape[1], dss[2].shape[2])
+              matrix = _resolve_index(dss[2], (self.TraceXNum,))[0]
+              if overview is None or matrix >= overview.shape[0]:
+                factor = 1
+                data = _get_image(self, dss[2], (matrix, slice(None), slice(None)), _get_fill(dss[2], 1, matrix))
+              else:
+                data = _get_image(self, overview, (matrix, slice(None), slice(None), 2),
+                                  _scale_fill(_get_fill(dss[2], 1, matrix), factor))
             except IOError as e:
               print("Could not open data file")
               print(e)
@@ -460,7 +479,7 @@ def _display_2D_data(self, graphicsView):
             
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url', 'z_ds_url'])
             try:
-              data = dss[2][()][:, self.TraceYNum, :]
+              data = _get_image(self, dss[2], (slice(None), self.TraceYNum, slice(None)), _get_fill(dss[2], 0))
             except IOError as e:
               print("Could not open data file")
               print(e)
@@ -479,7 +498,7 @@ def _display_2D_data(self, graphicsView):
             
             dss, names, units, scales = _get_all_ds_names_units_scales(self.ds, ['x_ds_url', 'y_ds_url'])
             try:
-              data = dss[2][()][:, :, self.TraceZNum]
+              data = _get_slice(dss[2], (slice(None), slice(None), self.TraceZNum))
             except IOError as e:
               print("Could not open data file")
               print(e)
@@ -492,7 +511,8 @@ def _display_2D_data(self, graphicsView):
         self.TraceYValue.setText(self._getYValueFromTraceNum(self.ds, self.TraceYNum))
         self.TraceZValue.setText(self._getZValueFromTraceNum(self.ds, self.TraceZNum))
     
-    data, units[2] = _do_data_manipulation(data, units[2], self.ds_type, self.manipulation, self.manipulations, colorplot=True)
+    image_key, image_start = self._image_update or (None, None)
+    data, units[2] = _get_manipulated(self, data, units[2], image_key, image_start, colorplot=True)
     
     graphicsView.clear()
     graphicsView.view.setLabel('left', names[1], units=units[1])
@@ -503,8 +523,13 @@ def _display_2D_data(self, graphicsView):
     # pos is the zero-point of the axis  
     # scale is responsible for the "accidential" correct display of the axis
     # for downsweeps scale has negative values and extends the axis from the min values into the correct direction
-    graphicsView.setImage(data, pos=(scales[0][0] - scales[0][1] / 2., scales[1][0] - scales[1][1] / 2.), scale=(scales[0][1], scales[1][1]))
+    pos = (scales[0][0] - scales[0][1] / 2., scales[1][0] - scales[1][1] / 2.)
+    graphicsView.setImage(data, pos=pos, scale=(scales[0][1] * factor, scales[1][1] * factor), autoRange=not self._overview_zoomed)
     graphicsView.show()
+    # extent of the full image, its visible part selects the overview level
+    self._image_extent = (self._overview_key, [sorted((p, p + fill * scale[1])) for p, fill, scale in zip(pos, (fill_x, fill_y), scales)])
+    if self._overview_levels:
+        self._overview_state = (dss[2], fill_x, fill_y, factor)
     
     # Fixme roi ...
     """
@@ -526,12 +551,12 @@ def _display_2D_data(self, graphicsView):
                 x_index = int(mousePoint.x())
                 y_index = int(mousePoint.y())
                 if x_index >= 0 and y_index >= 0:
-                    if x_index < fill_x and y_index < fill_y:
+                    if x_index * factor < fill_x and y_index * factor < fill_y:
                         # Check this for < or <=
                         # Also the x0s and dxs
                         
-                        xval = scales[0][0] + x_index * scales[0][1]
-                        yval = scales[1][0] + y_index * scales[1][1]
+                        xval = scales[0][0] + x_index * factor * scales[0][1]
+                        yval = scales[1][0] + y_index * factor * scales[1][1]
                         zval = data[x_index][y_index]
                         self.PointX.setText("X: %.6e %s" % (xval, units[0]))
                         self.PointY.setText("Y: %.6e %s" % (yval, units[1]))
@@ -659,9 +684,188 @@ def _get_ds(ds, ds_url):
         Object of hdf_dataset class.
     """
     try:
-        return ds.file[ds_url]
+        ds = ds.file[ds_url]
     except:
         return None
+    if ds.file.swmr_mode and hasattr(ds, 'refresh'):
+        # SWMR reader: get the data appended since the file was opened
+        ds.refresh()
+    return ds
+
+
+def _get_slice(ds, index):
+    """Reads only the hyperslab ds[index] from the file.
+
+    Negative integer indices count from the last written trace (see 
+    _resolve_index()).
+    
+    Args:
+        ds: hdf_dataset.
+        index: tuple of integers and slices.
+
+    Returns:
+        Numpy array with the selected data.
+    """
+    return ds[_resolve_index(ds, index)]
+
+
+def _resolve_index(ds, index):
+    """Replaces negative integer indices by the positive ones.
+
+    Along the traces of a matrix and the matrices and traces of a box they 
+    count from the last written row, as the dataset can be preallocated 
+    (see _get_fill()), along the other axes from the end of the axis.
+    
+    Args:
+        ds: hdf_dataset.
+        index: tuple of integers and slices.
+
+    Returns:
+        Tuple with the index.
+    """
+    index = list(index)
+    for n, i in enumerate(index):
+        if not isinstance(i, (int, np.integer)) or i >= 0:
+            continue
+        if n == 0 and len(ds.shape) > 1:
+            length = _get_fill(ds, 0)
+        elif n == 1 and len(ds.shape) == 3 and isinstance(index[0], (int, np.integer)):
+            length = _get_fill(ds, 1, index[0])
+        else:
+            length = ds.shape[n]
+        index[n] = i + length if i + length >= 0 else i + ds.shape[n]
+    return tuple(index)
+
+
+def _get_fill(ds, axis, index=None):
+    """Returns the number of rows holding data along an axis of a matrix or box.
+
+    The number is taken from the 'fill' attribute written by qkit (see 
+    qkit.storage.hdf_file.filled_rows()). axis 0 counts the traces of a 
+    matrix or the matrices of a box, axis 1 the traces in the matrix 'index'
+    of a box. 
+    
+    Args:
+        ds: hdf_dataset.
+        axis: 0 or 1.
+        index: Integer, matrix of a box for axis 1, negative values count 
+            from the last written matrix.
+
+    Returns:
+        Integer, the shape if the fill state is not known, e.g. for files 
+        not written by qkit.
+    """
+    return filled_rows(ds, axis, index)
+
+
+def _get_image(self, ds, index, filled=None):
+    """Reads the 2d slice ds[index] of a matrix or box for a color plot.
+
+    The image is cached in the PlotWindow object. On a refresh only the rows 
+    (along the first sliced axis) from the last row holding data on the 
+    previous read on are read from the file and patched into the cached 
+    image, which grows with the dataset. The last row is read again, as it 
+    may have been incomplete. The rows holding data are counted in the read 
+    data, so rows of a preallocated dataset, which were still NaN, are read 
+    again also if the fill state is not known. The whole slice is read, if 
+    the trace length changed or a different slice is displayed.
+    
+    Args:
+        self: Object of the PlotWindow class.
+        ds: hdf_dataset.
+        index: tuple with one integer (for a box) and slices selecting the image.
+        filled: Integer, number of rows holding data (see _get_fill()), the 
+            rows after it are not read. Default: all rows.
+
+    Returns:
+        Numpy array with the image, a copy of the cached data.
+    """
+    index = _resolve_index(ds, index)
+    axes = [n for n, i in enumerate(index) if isinstance(i, slice)]
+    shape = tuple(ds.shape[n] for n in axes)
+    rows = shape[0] if filled is None else min(filled, shape[0])
+    key = (ds.file.filename, ds.name, index, shape[1:])
+    
+    cache = getattr(self, '_image_cache', None)
+    if cache is not None and cache[0] == key and cache[1].shape[0] <= shape[0]:
+        image, start = cache[1], max(min(cache[2], rows) - 1, 0)
+        if image.shape[0] < shape[0]:
+            image = np.concatenate([image, np.full((shape[0] - image.shape[0],) + shape[1:], np.nan, dtype=image.dtype)])
+    else:
+        image, start = np.full(shape, np.nan, dtype=np.promote_types(ds.dtype, np.float32)), 0
+    seen = start
+    if rows > start:
+        ds_index = list(index)
+        ds_index[axes[0]] = slice(start, rows)
+        image[start:rows] = ds[tuple(ds_index)]
+        written = np.flatnonzero(~np.all(np.isnan(image[start:rows].reshape(rows - start, -1)), axis=1))
+        if len(written):
+            seen = start + written[-1] + 1
+    self._image_cache = (key, image, seen)
+    self._image_update = (key, start)
+    return image.copy()
+
+
+def _choose_overview(self, graphicsView, ds, rows, cols):
+    """Chooses the resolution of the color plot of a large matrix or box.
+
+    Datasets can be stored with downsampled overview levels (see 
+    qkit.storage.hdf_overview). The coarsest level which still has one value 
+    per screen pixel in the visible part of the image is displayed (the mean 
+    of the downsampled blocks). Zooming in switches to finer levels and 
+    finally to the full data, zooming out back to the coarse levels.
+    
+    Args:
+        self: Object of the PlotWindow class.
+        graphicsView: Modified object of pyqtgraph's ImageView class.
+        ds: hdf_dataset.
+        rows, cols: Integers, shape of the full image.
+
+    Returns:
+        Tuple (factor, overview dataset), (1, None) for the full data.
+    """
+    plot_type = self.PlotTypeSelector.currentIndex() if self.ds_type == ds_types['box'] else None
+    self._overview_key = (ds.file.filename, ds.name, plot_type)
+    self._overview_levels = get_levels(ds)
+    if not self._overview_levels:
+        return 1, None
+    fx, fy = _visible_fraction(self, graphicsView)
+    self._overview_zoomed = fx < 1 or fy < 1
+    factor, url = select_level(ds, rows * fx, cols * fy, graphicsView.width(), graphicsView.height(), self._overview_levels)
+    if url is None:
+        return 1, None
+    return factor, _get_ds(ds, url)
+
+
+def _visible_fraction(self, graphicsView):
+    """Returns the visible fractions of the displayed image along x and y."""
+    key, extent = getattr(self, '_image_extent', (None, None))
+    if key is None or key != self._overview_key:
+        return 1., 1.  # a new image is shown completely
+    fractions = []
+    for (lo, hi), (v_lo, v_hi) in zip(extent, graphicsView.view.viewRange()):
+        if hi <= lo:
+            fractions.append(1.)
+        else:
+            fractions.append(min(max((min(hi, v_hi) - max(lo, v_lo)) / (hi - lo), 1e-6), 1.))
+    return fractions
+
+
+def _overview_outdated(self, graphicsView):
+    """Checks if the zoom requires a different overview level of the displayed image."""
+    state = getattr(self, '_overview_state', None)
+    if state is None:
+        return False
+    ds, rows, cols, factor = state
+    fx, fy = _visible_fraction(self, graphicsView)
+    return select_level(ds, rows * fx, cols * fy, graphicsView.width(), graphicsView.height(), self._overview_levels)[0] != factor
+
+
+def _scale_fill(filled, factor):
+    """Number of overview rows holding data for 'filled' rows of the full data."""
+    if filled is None:
+        return None
+    return -(-filled // factor)
 
 
 def _get_axis_scale(ds):
@@ -761,6 +965,9 @@ def _do_data_manipulation(data, unit, ds_type, manipulation, manipulations, colo
     urls are read out (data, name, unit, and scale). This information is used
     by the _display_...() fcts to correcly label and scale the plots. The order
     in the input- and output-list is maintained.
+    All manipulations except the normalization work trace by trace, i.e. on 
+    the rows of 2d data (see _manipulate_traces()), the live update of color 
+    plots uses the cached version _get_manipulated().
     
     Args:
         data: Numpy array of the to be displayed / to be manipulated data.
@@ -774,14 +981,75 @@ def _do_data_manipulation(data, unit, ds_type, manipulation, manipulations, colo
         dimension as the input array and a string of the data unit after the 
         manipulation.
     """
+    data = _manipulate_traces(data, manipulation, manipulations, colorplot)
+    return _normalize(data, manipulation, manipulations), _manipulated_unit(unit, manipulation, manipulations)
+
+
+def _get_manipulated(self, data, unit, key, start=None, colorplot=False):
+    """Cached version of _do_data_manipulation() for live color plots.
+
+    The trace-wise manipulated data is kept for one (key, manipulation, 
+    trace length) in the PlotWindow object. On a refresh only the rows from 
+    'start' on are manipulated again, the rows before are taken from the 
+    cache. The normalization along x depends on all rows and is applied to 
+    the whole array.
+    
+    Args:
+        self: Object of the PlotWindow class.
+        data: 2d numpy array of the to be displayed data.
+        unit: String, unit of the data.
+        key: Identifier of the data, e.g. the key of _get_image().
+        start: Integer, the rows before 'start' did not change since the last 
+            call with the same key. None: everything is manipulated.
+        colorplot: Boolean, see _do_data_manipulation().
+
+    Returns:
+        Tuple of the manipulated data and its unit.
+    """
+    cache_key = (key, self.manipulation, data.shape[1:], colorplot)
+    cache = getattr(self, '_manipulation_cache', None)
+    if (data.ndim != 2 or key is None or start is None or cache is None
+            or cache[0] != cache_key or start > cache[1].shape[0]):
+        traces = _manipulate_traces(data, self.manipulation, self.manipulations, colorplot)
+    else:
+        traces = cache[1]
+        if traces.shape[0] != data.shape[0]:
+            traces = np.concatenate([traces[:start], np.empty((data.shape[0] - start,) + traces.shape[1:], dtype=traces.dtype)])
+        if start < data.shape[0]:
+            traces[start:] = _manipulate_traces(data[start:], self.manipulation, self.manipulations, colorplot)
+    self._manipulation_cache = (cache_key, traces)
+    data = _normalize(traces, self.manipulation, self.manipulations)
+    if data is traces:
+        data = traces.copy()  # the cached rows are modified by the next update
+    return data, _manipulated_unit(unit, self.manipulation, self.manipulations)
+
+
+def _manipulated_unit(unit, manipulation, manipulations):
+    if manipulation & manipulations['dB']:
+        return 'dB'
+    return unit
+
+
+def _manipulate_traces(data, manipulation, manipulations, colorplot=False):
+    """Applies the manipulations working along the traces (last axis) of the data.
+
+    Args:
+        data: Numpy array, a single trace or one trace per row.
+        manipulation: Integer, bitmask of the manipulations.
+        manipulations: Lookup dict, mapping a manipulation to a power of 2.
+        colorplot: Boolean, zeros are removed only for color plots.
+
+    Returns:
+        Numpy array with the same shape as data.
+    """
     # set the y data  to the decibel scale 
     if manipulation & manipulations['dB']:
-        data = 20 * np.log10(data)
-        unit = 'dB'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            data = 20 * np.log10(data)
     
     # unwrap the phase
     if manipulation & manipulations['wrap']:
-        data[~np.isnan(data)] = np.unwrap(data[~np.isnan(data)])
+        data = _unwrap(data)
     
     if manipulation & manipulations['linear']:
         if len(data.shape) == 1:
@@ -795,19 +1063,40 @@ def _do_data_manipulation(data, unit, ds_type, manipulation, manipulations, colo
             ## This manipulation removes all zeros which would blow up the color scale.
             ## Only relevant for matrices and boxes in 2d
             if manipulation & manipulations['remove_zeros']:
-                data[np.where(data == 0)] = np.NaN  # replace all exact zeros in the hd5 data with NaNs, otherwise the 0s in uncompleted files blow up the colorscale
+                data[data == 0] = np.NaN  # replace all exact zeros in the hd5 data with NaNs, otherwise the 0s in uncompleted files blow up the colorscale
     
+    # subtract the offset (average along the trace)
     if manipulation & manipulations['sub_offset_avg_y']:
-        # ignore division by zero
-        old_warn = np.seterr(divide='print')
-        np.seterr(**old_warn)
-        data = data - np.nanmean(data, axis=1, keepdims=True)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # traces without data
+            data = data - np.nanmean(data, axis=-1, keepdims=True)
     
-    # subtract offset from the data
+    return data
+
+
+def _normalize(data, manipulation, manipulations):
+    """Divides the data by its average along x (the first axis)."""
     if manipulation & manipulations['norm_data_avg_x']:
-        # ignore division by zero
-        old_warn = np.seterr(divide='print')
-        np.seterr(**old_warn)
-        data = data / np.nanmean(data, axis=0, keepdims=True)
-    
-    return data, unit
+        with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+            warnings.simplefilter('ignore', RuntimeWarning)  # columns without data
+            data = data / np.nanmean(data, axis=0, keepdims=True)
+    return data
+
+
+def _unwrap(data):
+    """Unwraps the phase along the last axis, skipping NaNs (e.g. missing data)."""
+    valid = ~np.isnan(data)
+    if valid.all():
+        return np.unwrap(data, axis=-1)
+    n = data.shape[-1]
+    # fill the gaps with the last valid value (the first one at the beginning), 
+    # they do not add phase jumps
+    index = np.where(valid, np.arange(n), 0)
+    np.maximum.accumulate(index, axis=-1, out=index)
+    first = np.argmax(valid, axis=-1)[..., np.newaxis]
+    index = np.where(np.arange(n) < first, first, index)
+    filled = np.take_along_axis(data, index, axis=-1)
+    filled[np.isnan(filled)] = 0  # traces without data
+    data = np.unwrap(filled, axis=-1)
+    data[~valid] = np.nan
+    return data
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Background fitting of the traces of a spectroscopy measurement.
+
+The measurement loop hands every new trace to put() and continues with the
+next VNA sweep, a worker thread fits the traces in the order of acquisition
+and writes the results to the analysis folder of the file.
+
+At most `backlog` traces wait for the fit. If the fits fall behind, the
+policy decides what happens to a new trace:
+    'block':       the measurement waits until there is room (no trace is lost)
+    'drop_oldest': the oldest waiting trace is discarded
+    'drop_newest': the new trace is not fitted
+With the drop policies the fit datasets only hold the fitted traces, so they
+are not aligned with the x axis of the data anymore.
+
+An error in the fit stops the live fitting, the measurement itself goes on.
+"""
+import collections
+import logging
+import threading
+
+import qkit
+
+
+class LiveFit(object):
+    """
+    Args:
+        fit: function fit(amplitude, phase) fitting and storing one trace.
+        backlog: maximum number of traces waiting for the fit.
+        policy: 'block', 'drop_oldest' or 'drop_newest', see above.
+    """
+    policies = ('block', 'drop_oldest', 'drop_newest')
+
+    def __init__(self, fit, backlog=4, policy='block'):
+        if policy not in self.policies:
+            logging.error(__name__ + ": Unknown policy '%s', use one of %s." % (policy, ', '.join(self.policies)))
+            raise ValueError
+        self._fit = fit
+        self.backlog = max(1, int(backlog))
+        self.policy = policy
+        self.fitted = 0
+        self.dropped = 0
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='live_fit')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, amplitude, phase):
+        """Queues a trace for the fit, see the policy for a full backlog."""
+        if self.policy == 'block':
+            while True:
+                with self._cond:
+                    if len(self._pending) < self.backlog or self._error is not None:
+                        break
+                qkit.flow.sleep(.01)  # raises on a human abort
+        with self._cond:
+            if self._error is not None:
+                return  # fitting stopped
+            if len(self._pending) >= self.backlog:
+                self.dropped += 1
+                if self.policy == 'drop_newest':
+                    return
+                self._pending.popleft()
+            self._pending.append((amplitude, phase))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return  # closed and drained
+                amplitude, phase = self._pending.popleft()
+            try:
+                self._fit(amplitude, phase)
+            except Exception as e:
+                logging.error(__name__ + ': Live fit failed, no further traces are fitted: %s' % e)
+                with self._cond:
+                    self._error = e
+                    self.dropped += len(self._pending)
+                    self._pending.clear()
+                return
+            self.fitted += 1
+
+    def close(self):
+        """
+        Waits until all queued traces are fitted and stops the worker.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        if self.dropped:
+            logging.warning(__name__ + ': %i traces fitted, %i traces were not fitted.' % (self.fitted, self.dropped))
@@ -24,7 +24,6 @@ from scipy.optimize import curve_fit
 from time import sleep,time
 import sys
 import qt
-import threading
 
 import qkit
 from qkit.storage import store as hdf
@@ -544,10 +543,8 @@ class spectrum(object):
         the data file is closed and filepath is printed
         '''
         print self._data_file.get_filepath()
-        # qviewkit.save_plots(self._data_file.get_filepath(),comment=self._plot_comment) #old version where we have to wait for the plots
-        t = threading.Thread(target=qviewkit.save_plots, args=[self._data_file.get_filepath(), self._plot_comment])
-        t.start()
         self._data_file.close_file()
+        qviewkit.save_plots_async(self._data_file.get_filepath(), comment=self._plot_comment)
         waf.close_log_file(self._log)
         self.dirname = None
         if self.averaging_start_ready: self.sig_analyzer.post_measurement()
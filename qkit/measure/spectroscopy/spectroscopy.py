@@ -22,11 +22,11 @@ import matplotlib.pylab as plt
 from scipy.optimize import curve_fit
 from time import sleep,time
 import sys
-import threading
 
 import qkit
 from qkit.storage import store as hdf
 from qkit.analysis.resonator import Resonator as resonator
+from qkit.measure.spectroscopy.live_fit import LiveFit
 from qkit.gui.plot import plot as qviewkit
 from qkit.gui.notebook.Progress_Bar import Progress_Bar
 from qkit.measure.measurement_class import Measurement 
@@ -68,7 +68,12 @@ class spectrum(object):
         self.y_set_obj = None
 
         self.progress_bar = True
+        self.poll_interval = (.01, .2)  # [s] min/max interval between the vna.ready() checks
         self._fit_resonator = False
+        self.fit_in_background = True  # live fits run in a worker thread during the next sweep
+        self.fit_backlog = 4           # traces waiting for the live fit
+        self.fit_policy = 'block'      # full backlog: 'block', 'drop_oldest' or 'drop_newest'
+        self._live_fit = None
         self._plot_comment=""
 
         self.set_log_function()
@@ -252,8 +257,9 @@ class spectrum(object):
         if self._scan_2D:
             self._data_x = self._data_file.add_coordinate(self.x_coordname, unit = self.x_unit)
             self._data_x.add(self.x_vec)
-            self._data_amp = self._data_file.add_value_matrix('amplitude', x = self._data_x, y = self._data_freq, unit = 'arb. unit', save_timestamp = True)
-            self._data_pha = self._data_file.add_value_matrix('phase', x = self._data_x, y = self._data_freq, unit='rad', save_timestamp = True)
+            shape = (len(self.x_vec), self._nop)
+            self._data_amp = self._data_file.add_value_matrix('amplitude', x = self._data_x, y = self._data_freq, unit = 'arb. unit', save_timestamp = True, shape = shape)
+            self._data_pha = self._data_file.add_value_matrix('phase', x = self._data_x, y = self._data_freq, unit='rad', save_timestamp = True, shape = shape)
 
             if self.log_function != None:   #use logging
                 self._log_value = []
@@ -271,8 +277,9 @@ class spectrum(object):
             self._data_x.add(self.x_vec)
             self._data_y = self._data_file.add_coordinate(self.y_coordname, unit = self.y_unit)
             self._data_y.add(self.y_vec)
-            self._data_amp = self._data_file.add_value_box('amplitude', x = self._data_x, y = self._data_y, z = self._data_freq, unit = 'arb. unit', save_timestamp = False)
-            self._data_pha = self._data_file.add_value_box('phase', x = self._data_x, y = self._data_y, z = self._data_freq, unit = 'rad', save_timestamp = False)
+            shape = (len(self.x_vec), len(self.y_vec), self._nop)
+            self._data_amp = self._data_file.add_value_box('amplitude', x = self._data_x, y = self._data_y, z = self._data_freq, unit = 'arb. unit', save_timestamp = False, shape = shape)
+            self._data_pha = self._data_file.add_value_box('phase', x = self._data_x, y = self._data_y, z = self._data_freq, unit = 'rad', save_timestamp = False, shape = shape)
             
             if self.log_function != None:   #use logging
                 self._log_value = []
@@ -332,7 +339,7 @@ class spectrum(object):
         if self.open_qviewkit:
             self._qvk_process = qviewkit.plot(self._data_file.get_filepath(), datasets=['amplitude', 'phase'])
         if self._fit_resonator:
-            self._resonator = resonator(self._data_file.get_filepath()) 
+            self._start_resonator_fit()
         print('recording trace...')
         sys.stdout.flush()
 
@@ -370,14 +377,14 @@ class spectrum(object):
                             if self.progress_bar: self._p.iterate()
 
         data_amp, data_pha = self.vna.get_tracedata()
-        data_real, data_imag = self.vna.get_tracedata('RealImag')
+        data_real, data_imag = data_amp*np.cos(data_pha), data_amp*np.sin(data_pha)  # one transfer from the VNA
 
         self._data_amp.append(data_amp)
         self._data_pha.append(data_pha)
         self._data_real.append(data_real)
         self._data_imag.append(data_imag)
         if self._fit_resonator:
-            self._do_fit_resonator()
+            self._fit_trace(data_amp, data_pha)
 
         qkit.flow.end()
         self._end_measurement()
@@ -419,7 +426,7 @@ class spectrum(object):
         else:
             if self.open_qviewkit: self._qvk_process = qviewkit.plot(self._data_file.get_filepath(), datasets=['amplitude', 'phase'])
         if self._fit_resonator:
-            self._resonator = resonator(self._data_file.get_filepath())
+            self._start_resonator_fit()
         self._measure()
 
 
@@ -459,7 +466,7 @@ class spectrum(object):
         """only middle point in freq array is plotted vs x and y"""
         if self.open_qviewkit: self._qvk_process = qviewkit.plot(self._data_file.get_filepath(), datasets=['amplitude', 'phase'])
         if self._fit_resonator:
-            self._resonator = resonator(self._data_file.get_filepath())
+            self._start_resonator_fit()
 
         if self.landscape:
             self.center_freqs = np.array(self.landscape).T
@@ -558,8 +565,11 @@ class spectrum(object):
         '''
         measures and plots the data depending on the measurement type.
         the measurement loops feature the setting of the objects and saving the data in the .h5 file.
+        the data of a trace is written (and fitted) while the VNA is already measuring the next trace.
         '''
         qkit.flow.start()
+        self._pending = []
+        self._sweep_estimate = self._sweeptime_averages
         try:
             """
             loop: x_obj with parameters from x_vec
@@ -583,26 +593,12 @@ class spectrum(object):
                         else:
                             self.y_set_obj(y)
                             sleep(self.tdy)
-                            if self.averaging_start_ready:
-                                self.vna.start_measurement()
-                                qkit.flow.sleep(.2) #just to make sure, the ready command does not *still* show ready
-                                while not self.vna.ready():
-                                    qkit.flow.sleep(.2)
-                            else:
-                                self.vna.avg_clear()
-                                qkit.flow.sleep(self._sweeptime_averages)
-                                
-                            #if "avg_status" in self.vna.get_function_names():
-                            #       while self.vna.avg_status() < self.vna.get_averages():
-                            #            qkit.flow.sleep(.2) #maybe one would like to adjust this at a later point
+                            self._acquire_trace()
                             
                             """ measurement """
                             data_amp, data_pha = self.vna.get_tracedata()
 
-                        self._data_amp.append(data_amp)
-                        self._data_pha.append(data_pha)
-                        if self._fit_resonator:
-                            self._do_fit_resonator()
+                        self._defer(self._store_trace, data_amp, data_pha)
                         if self.progress_bar:
                             self._p.iterate()
                         qkit.flow.sleep()
@@ -610,45 +606,83 @@ class spectrum(object):
                     filling of value-box is done here.
                     after every y-loop the data is stored the next 2d structure
                     """
-                    self._data_amp.next_matrix()
-                    self._data_pha.next_matrix()
+                    self._defer(self._data_amp.next_matrix)
+                    self._defer(self._data_pha.next_matrix)
 
                 if self._scan_2D:
-                    if self.averaging_start_ready:
-                        self.vna.start_measurement()
-                        qkit.flow.sleep(.2) #just to make sure, the ready command does not *still* show ready
-                        while not self.vna.ready():
-                            qkit.flow.sleep(.2)
-                    else:
-                        self.vna.avg_clear()
-                        qkit.flow.sleep(self._sweeptime_averages)
+                    self._acquire_trace()
                     """ measurement """
                     data_amp, data_pha = self.vna.get_tracedata()
-                    self._data_amp.append(data_amp)
-                    self._data_pha.append(data_pha)
-                    if self._nop < 10:
-                        #print(data_amp[self._nop/2])
-                        self._data_amp_mid.append(float(data_amp[self._nop/2]))
-                        self._data_pha_mid.append(float(data_pha[self._nop/2]))
-                        
-                    if self._fit_resonator:
-                        self._do_fit_resonator()
+                    self._defer(self._store_trace, data_amp, data_pha)
                     if self.progress_bar:
                         self._p.iterate()
                     qkit.flow.sleep()
+                if ix == 0 and qkit.cfg.get('hdf_swmr', False) and not self._fit_resonator:
+                    """all datasets exist now, live viewers can read the file in SWMR mode"""
+                    self._flush_pending()
+                    self._data_file.start_swmr()
         finally:
-            self._end_measurement()
-            qkit.flow.end()
+            try:
+                self._flush_pending()
+            finally:
+                self._end_measurement()
+                qkit.flow.end()
+
+    def _acquire_trace(self):
+        '''
+        starts the VNA measurement and waits until it is finished.
+        the pending data of the previous trace is written while the VNA is sweeping.
+        vna.ready() is first checked after 90% of the expected sweep time (the duration of the last sweep,
+        initially get_sweeptime_averages()) and then polled in increasing intervals within poll_interval.
+        '''
+        t_start = time()
+        if not self.averaging_start_ready:
+            self.vna.avg_clear()
+            self._flush_pending()
+            qkit.flow.sleep(max(0, self._sweeptime_averages - (time() - t_start)))
+            return
+        self.vna.start_measurement()
+        self._flush_pending()
+        poll_min, poll_max = self.poll_interval
+        qkit.flow.sleep(max(poll_min, .9*self._sweep_estimate - (time() - t_start))) # the ready command should not *still* show ready
+        interval = poll_min
+        while not self.vna.ready():
+            qkit.flow.sleep(interval)
+            interval = min(2*interval, poll_max)
+        self._sweep_estimate = time() - t_start
+
+    def _defer(self, func, *args):
+        '''
+        queues a write to the data file, executed during the next VNA sweep or at the end of the measurement
+        '''
+        self._pending.append((func, args))
+
+    def _flush_pending(self):
+        pending, self._pending = self._pending, []
+        for func, args in pending:
+            func(*args)
+
+    def _store_trace(self, data_amp, data_pha):
+        self._data_amp.append(data_amp)
+        self._data_pha.append(data_pha)
+        if self._scan_2D and self._nop < 10:
+            self._data_amp_mid.append(float(data_amp[self._nop//2]))
+            self._data_pha_mid.append(float(data_pha[self._nop//2]))
+        if self._fit_resonator:
+            self._fit_trace(data_amp, data_pha)
 
     def _end_measurement(self):
         '''
         the data file is closed and filepath is printed
         '''
+        if self._live_fit:
+            print('waiting for the live fits...')
+            self._live_fit.close()
+            self._live_fit = None
         print(self._data_file.get_filepath())
-        #qviewkit.save_plots(self._data_file.get_filepath(),comment=self._plot_comment) #old version where we have to wait for the plots
-        t = threading.Thread(target=qviewkit.save_plots,args=[self._data_file.get_filepath(),self._plot_comment])
-        t.start()
         self._data_file.close_file()
+        # the plots are rendered in separate processes, see qkit.gui.plot.export
+        qviewkit.save_plots_async(self._data_file.get_filepath(), comment=self._plot_comment)
         waf.close_log_file(self._log)
         self.dirname = None
         if self.averaging_start_ready: self.vna.post_measurement()
@@ -677,23 +711,42 @@ class spectrum(object):
             self._f_min = f_min
             self._f_max = f_max
 
-    def _do_fit_resonator(self):
+    def _start_resonator_fit(self):
+        '''
+        opens the resonator for the live fit, a worker thread is started if fit_in_background is set
+        '''
+        self._resonator = resonator(self._data_file.get_filepath())
+        if self.fit_in_background:
+            self._live_fit = LiveFit(self._do_fit_resonator, backlog=self.fit_backlog, policy=self.fit_policy)
+
+    def _fit_trace(self, data_amp, data_pha):
+        '''
+        fits the trace, in the background while the next trace is measured if fit_in_background is set
+        '''
+        if self._live_fit:
+            self._live_fit.put(data_amp, data_pha)
+        else:
+            self._do_fit_resonator(data_amp, data_pha)
+
+    def _do_fit_resonator(self, data_amp, data_pha):
         '''
         calls fit function in resonator class
         fit function is specified in self.set_fit, with boundaries f_mim and f_max
         only the last 'slice' of data is fitted, since we fit live while measuring.
+        the trace is handed over directly, so the resonator does not read the file.
         '''
+        trace = (data_amp, data_pha)
 
         if self._fit_function == 0: #lorentzian
-            self._resonator.fit_lorentzian(f_min=self._f_min, f_max = self._f_max)
+            self._resonator.fit_lorentzian(f_min=self._f_min, f_max = self._f_max, trace = trace)
         if self._fit_function == 1: #skewed_lorentzian
-            self._resonator.fit_skewed_lorentzian(f_min=self._f_min, f_max = self._f_max)
+            self._resonator.fit_skewed_lorentzian(f_min=self._f_min, f_max = self._f_max, trace = trace)
         if self._fit_function == 2: #circle_reflection
-            self._resonator.fit_circle(reflection = True, f_min=self._f_min, f_max = self._f_max)
+            self._resonator.fit_circle(reflection = True, f_min=self._f_min, f_max = self._f_max, trace = trace)
         if self._fit_function == 3: #circle_notch
-            self._resonator.fit_circle(notch = True, f_min=self._f_min, f_max = self._f_max)
+            self._resonator.fit_circle(notch = True, f_min=self._f_min, f_max = self._f_max, trace = trace)
         if self._fit_function == 4: #fano
-            self._resonator.fit_fano(f_min=self._f_min, f_max = self._f_max)
+            self._resonator.fit_fano(f_min=self._f_min, f_max = self._f_max, trace = trace)
         #if self._fit_function == 5: #all fits
             #self._resonator.fit_all_fits(f_min=self._f_min, f_max = self._f_max)
 
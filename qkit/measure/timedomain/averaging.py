@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming average of complex readout data over iterations.
+
+The data amplitude * exp(1j * phase) is averaged with a running mean
+(Welford's update), so only the mean and optionally the sum of squared
+deviations are kept in memory, independent of the number of iterations.
+The data can be added as a whole or row by row, e.g. one AWG sequence
+(row) per y value of a 2D measurement.
+"""
+
+import numpy as np
+
+
+class Averager(object):
+    """
+    Args:
+        shape: shape of the averaged data, e.g. (sequence length, devices) or
+            (rows, sequence length, devices).
+        stats: also keep the variance to calculate the standard error.
+    """
+
+    def __init__(self, shape, stats=False):
+        self.mean = np.zeros(shape, dtype=complex)
+        self.m2 = np.zeros(shape) if stats else None
+        self.count = np.zeros(shape[0], dtype=int)
+
+    def add(self, amp, pha, row=None):
+        """
+        Adds one iteration of the data (row=None) or of one row.
+        """
+        z = np.asarray(amp) * np.exp(1j * np.asarray(pha))
+        idx = slice(None) if row is None else row
+        self.count[idx] += 1
+        n = self._broadcast(self.count[idx], z)
+        delta = z - self.mean[idx]
+        self.mean[idx] += delta / n
+        if self.m2 is not None:
+            self.m2[idx] += (delta * np.conj(z - self.mean[idx])).real
+
+    def _broadcast(self, n, z):
+        n = np.asarray(n)
+        return n.reshape(n.shape + (1,) * (z.ndim - n.ndim))
+
+    def amplitude(self, row=None):
+        return np.abs(self.mean[slice(None) if row is None else row])
+
+    def phase(self, row=None):
+        return np.angle(self.mean[slice(None) if row is None else row])
+
+    def stderr(self, row=None):
+        """
+        Standard error of the complex mean, sqrt(var / n), zero before the second iteration.
+        """
+        if self.m2 is None:
+            raise ValueError('Averager: statistics are not recorded, use stats=True.')
+        idx = slice(None) if row is None else row
+        m2 = self.m2[idx]
+        n = self._broadcast(self.count[idx], m2)
+        return np.sqrt(m2 / np.maximum(n - 1, 1) / np.maximum(n, 1))
@@ -32,6 +32,31 @@ import scipy.special
 
 dtype = np.float16 #you can change this via gwf.dtype to anything you want
 
+_erf_edges = {}   #cached attack/decay edges of erf(), see _erf_edge()
+
+def sweep(func, values, sample, *args, **kwargs):
+    '''
+    Convenience wrapper collecting the waveforms of a whole sweep as rows of one 2D array, e.g. sweep(ramsey, delays, sample).
+    func is still called once per value, the rows are written into one preallocated array of the dtype of the first waveform.
+    
+    Inputs:
+        - func: waveform function called as func(value, sample, *args, **kwargs)
+        - values: sweep values, i.e. delays or pulse lengths
+    Outputs:
+        - array (len(values), samples), (0, samples) for no values with samples from length (default sample.exc_T) and clock
+    '''
+    if len(values) == 0:
+        length = kwargs.get('length') or getattr(sample, 'exc_T', 0)
+        clock = kwargs.get('clock') or getattr(sample, 'clock', 0)
+        return np.zeros((0, int(np.round(length*clock))), dtype=dtype)
+    wfms = None
+    for i, value in enumerate(values):
+        wfm = func(value, sample, *args, **kwargs)
+        if wfms is None:
+            wfms = np.empty((len(values),) + np.shape(wfm), dtype=np.asarray(wfm).dtype)
+        wfms[i] = wfm
+    return wfms
+
 def compensate(wfm, gamma, sample):
     '''
     Function that translates a given (analog) waveform wfm into a waveform wfc that needs to be programmed to the AWG
@@ -40,19 +65,31 @@ def compensate(wfm, gamma, sample):
     is passed to the function as gamma.
     Credits to A. Schneider
     
+    The correction wfc[i] = wfc[i-1] + wfm[i-1]/(clock*gamma) + wfm[i]-wfm[i-1] is an integrator (IIR filter with a
+    single pole at 1), it is evaluated as cumulative sum in double precision along the last axis.
+    
     Inputs:
-        - wfm: original waveform to be compensated
+        - wfm: original waveform to be compensated, or array (waveforms, samples) of a whole sweep
         - gamma: bias T time constant in seconds
         - sample: sample object form which the function reads the AWG clock
     Outputs:
         - wfc: corrected waveform to be loaded to the AWG
     '''
+    wfm = np.asarray(wfm)
     wfc = np.zeros_like(wfm)
-    dif = np.diff(wfm)
-    for i in range(1,len(wfm)):
-        wfc[i]=wfc[i-1]+wfm[i-1]/(sample.clock*gamma)+dif[i-1]
+    increments = wfm[..., :-1].astype(np.result_type(wfm, np.float64))/(sample.clock*gamma) + np.diff(wfm, axis=-1)
+    wfc[..., 1:] = np.cumsum(increments, axis=-1)
     return wfc
 
+def _erf_edge(n, rising=True):
+    '''
+    returns the (cached) erf shaped attack (rising) or decay edge of n samples
+    '''
+    key = (n, rising)
+    if key not in _erf_edges:
+        _erf_edges[key] = 0.5*(1+scipy.special.erf(np.linspace(-2, 2, n) if rising else np.linspace(2, -2, n)))
+    return _erf_edges[key]
+
 
 def erf(pulse, attack, decay, sample, length=None, position = None, low=0, high=1, clock = None):
     '''
@@ -84,7 +121,7 @@ def erf(pulse, attack, decay, sample, length=None, position = None, low=0, high=
             logging.warning(__name__ + ' : attack too small compared to AWG sample frequency, setting to %.4g s'%(2./clock))
             attack = 2./clock
         nAttack = int(clock*attack)
-        sAttack = 0.5*(1+scipy.special.erf(np.linspace(-2, 2, nAttack)))
+        sAttack = _erf_edge(nAttack, True)
         wfm[sample_start:sample_start+nAttack] += sAttack * (high-low)
     else:
         nAttack = 0
@@ -93,7 +130,7 @@ def erf(pulse, attack, decay, sample, length=None, position = None, low=0, high=
             logging.warning(__name__ + ' : decay too small compared to AWG sample frequency, setting to %.4g s'%(2./clock))
             decay = 2./clock
         nDecay = int(clock*decay)
-        sDecay = 0.5*(1+scipy.special.erf(np.linspace(2, -2, nDecay)))
+        sDecay = _erf_edge(nDecay, False)
         wfm[sample_end-nDecay:sample_end] += sDecay * (high-low)
     else:
         nDecay = 0
@@ -178,8 +215,8 @@ def square(pulse, sample, length = None,position = None, low = 0, high = 1, cloc
     if(sample_start < sample_end): wfm[int(sample_start)] = high + (low-high)*(sample_start-int(sample_start))
     if freq==None: wfm[int(np.ceil(sample_start)):int(sample_end)] = high
     else:
-        for i in range(int(sample_end)-int(np.ceil(sample_start))):
-            wfm[i+int(np.ceil(sample_start))] = high*np.sin(2*np.pi*freq/clock*(i))
+        i = np.arange(max(int(sample_end)-int(np.ceil(sample_start)), 0))
+        wfm[i+int(np.ceil(sample_start))] = high*np.sin(2*np.pi*freq/clock*i)
     if(np.ceil(sample_end) != np.floor(sample_end)): wfm[int(sample_end)] = low + (high-low)*(sample_end-int(sample_end))
     return wfm
     
@@ -218,8 +255,8 @@ def gauss(pulse, sample, length = None,position = None, low = 0, high = 1, clock
     if(sample_start < sample_end): wfm[int(sample_start)] = 0.#high + (low-high)*(sample_start-int(sample_start))
     #wfm[int(np.ceil(sample_start)):int(sample_end)] = high
     pulsesamples = int(int(sample_end)-int(sample_start))
-    for i in range(pulsesamples):
-        wfm[int(np.ceil(sample_start)+i)] = high*np.exp(-(i-pulsesamples/2.)**2/(2.*(pulsesamples/5.)**2))
+    i = np.arange(max(pulsesamples, 0))
+    wfm[int(np.ceil(sample_start))+i] = high*np.exp(-(i-pulsesamples/2.)**2/(2.*(pulsesamples/5.)**2))
     if(np.ceil(sample_end) != np.floor(sample_end)): wfm[int(sample_end)] = low + (high-low)*(sample_end-int(sample_end))
     return wfm
 
@@ -448,7 +485,8 @@ def drag(pulse, sample, amplitude, length = None, position=None, clock = None):
             position -= sample.overlap
         else:
             logging.warning('overlap attribute not found in sample object')
-    wfm = gauss(pulse, sample, length=np.ceil(length*1e9)/1e9, position=position) + 1j * np.concatenate([np.diff(gauss(pulse, sample,length=np.ceil(length*1e9)/1e9, position=position)*amplitude),[0]]) # actual pulse
+    envelope = gauss(pulse, sample, length=np.ceil(length*1e9)/1e9, position=position)
+    wfm = envelope + 1j * np.concatenate([np.diff(envelope*amplitude),[0]]) # actual pulse
     wfm[int((position-pulse)*clock-1):int((position-pulse)*clock+1)]=wfm.real[int((position-pulse)*clock-1):int((position-pulse)*clock+1)] # for smooth derivative
     wfm[int(position*clock-1):int(position*clock+1)]= wfm.real[int(position*clock-1):int(position*clock+1)] 
     
@@ -20,10 +20,11 @@ import qkit
 import numpy as np
 import logging
 from qkit.gui.notebook.Progress_Bar import Progress_Bar
+from qkit.measure.timedomain.awg.waveform_cache import get_cache, reset_cache, waveform_hash, TaborUploader, TEKTRONIX_BYTES
 import gc
 
 
-def update_sequence(ts, wfm_func, sample, iq = None, loop = False, drive = 'c:', path = '\\waveforms', reset = True, marker=None, markerfunc=None, ch2_amp = 2,chpair=1,awg= None, show_progress_bar = True):
+def update_sequence(ts, wfm_func, sample, iq = None, loop = False, drive = 'c:', path = '\\waveforms', reset = True, marker=None, markerfunc=None, ch2_amp = 2,chpair=1,awg= None, show_progress_bar = True, use_cache = True):
     '''
         set awg to sequence mode and push a number of waveforms into the sequencer
         
@@ -42,6 +43,8 @@ def update_sequence(ts, wfm_func, sample, iq = None, loop = False, drive = 'c:',
         for the 1.2GS/s AWG, it must be divisible by 4
         
         chpair: if you use the 4ch Tabor AWG as a single 2ch instrument, you can chose to take the second channel pair here (this can be either 1 or 2).
+        
+        use_cache: only send waveforms which are not yet in the awg and store identical waveforms only once (see waveform_cache.py)
     '''
     qkit.flow.start()
     if awg==None:
@@ -72,6 +75,13 @@ def update_sequence(ts, wfm_func, sample, iq = None, loop = False, drive = 'c:',
     wfm_fn = [None,None]
     wfm_pn = [None,None]
     if show_progress_bar: p = Progress_Bar(len(ts)*(2 if "Tektronix" in awg.get_type() else 1),'Load AWG')   #init progress bar
+    if not use_cache:
+        reset_cache(awg)   #waveforms are overwritten without updating the cache
+    cache = get_cache(awg)
+    cache.reset_stats()
+    used = set()   #content-addressed waveform names of this sequence
+    if "Tabor" in awg.get_type():
+        uploader = TaborUploader(awg, clock, use_cache)
     
     #update all channels and times
     for ti, t in enumerate(ts):   #run through all sequences
@@ -106,14 +116,27 @@ def update_sequence(ts, wfm_func, sample, iq = None, loop = False, drive = 'c:',
                 marker2 = c_marker2[ti]
             
             if "Tektronix" in awg.get_type():
-                wfm_fn[chan] = 'ch%d_t%05d'%(chan+1, ti) # filename is kept until changed
-                if len(wfm_samples) == 1 and chan == 1:
-                    wfm_pn[chan] = '%s%s\\%s'%(drive, path, np.zeros_like(wfm_fn[0]))   #create empty array
+                if use_cache:
+                    key = waveform_hash(clock, wfm_samples[chan], marker1, marker2)
+                    wfm_fn[chan] = 'qk_%s'%key[:20]   #identical waveforms share the name
+                    nbytes = TEKTRONIX_BYTES*len(wfm_samples[chan])
+                    if cache.holds(wfm_fn[chan], key):
+                        cache.skip(nbytes)
+                    else:
+                        wfm_pn[chan] = '%s%s\\%s'%(drive, path, wfm_fn[chan])
+                        awg.wfm_send(wfm_samples[chan], marker1, marker2, wfm_pn[chan], clock)
+                        awg.wfm_import(wfm_fn[chan], wfm_pn[chan], 'WFM')
+                        cache.store(wfm_fn[chan], key, nbytes)
+                    used.add(wfm_fn[chan])
                 else:
-                    wfm_pn[chan] = '%s%s\\%s'%(drive, path, wfm_fn[chan])
-                awg.wfm_send(wfm_samples[chan], marker1, marker2, wfm_pn[chan], clock)
-                
-                awg.wfm_import(wfm_fn[chan], wfm_pn[chan], 'WFM')
+                    wfm_fn[chan] = 'ch%d_t%05d'%(chan+1, ti) # filename is kept until changed
+                    if len(wfm_samples) == 1 and chan == 1:
+                        wfm_pn[chan] = '%s%s\\%s'%(drive, path, np.zeros_like(wfm_fn[0]))   #create empty array
+                    else:
+                        wfm_pn[chan] = '%s%s\\%s'%(drive, path, wfm_fn[chan])
+                    awg.wfm_send(wfm_samples[chan], marker1, marker2, wfm_pn[chan], clock)
+                    
+                    awg.wfm_import(wfm_fn[chan], wfm_pn[chan], 'WFM')
                 
                 # assign waveform to channel/time slot
                 awg.wfm_assign(chan+1, ti+1, wfm_fn[chan])
@@ -122,7 +145,7 @@ def update_sequence(ts, wfm_func, sample, iq = None, loop = False, drive = 'c:',
                     awg.set_seq_loop(ti+1, np.infty)
             elif "Tabor" in awg.get_type():
                 if chan == 1:   #write out both together
-                    awg.wfm_send2(wfm_samples[0],wfm_samples[1],marker1,marker2,chpair*2-1,ti+1)
+                    uploader.send(wfm_samples[0],wfm_samples[1],marker1,marker2,chpair,ti)
                 else: continue
             else:
                 raise ValueError("AWG type not known")
@@ -130,6 +153,16 @@ def update_sequence(ts, wfm_func, sample, iq = None, loop = False, drive = 'c:',
 
         gc.collect()
 
+    if "Tabor" in awg.get_type():
+        uploader.define_sequences()
+    elif use_cache:
+        #delete waveforms not used anymore if too many piled up in the awg
+        if len(cache.slots) > cache.max_slots and hasattr(awg, 'del_waveform'):
+            for name in [name for name in cache.slots if name not in used]:
+                awg.del_waveform(name)
+                cache.forget(name)
+        logging.info(cache.report())
+
     if reset and "Tektronix" in awg.get_type():
         # enable channels
         awg.set_ch1_status(True)
@@ -19,13 +19,14 @@
 import numpy as np
 import logging
 from qkit.gui.notebook.Progress_Bar import Progress_Bar
+from qkit.measure.timedomain.awg.waveform_cache import TaborUploader, reset_cache
 import gc
 
 
-def _adjust_wfs_for_tabor(wf1, wf2, ro_index, chpair, segment, sample):
+def _adjust_wfs_for_tabor(wf1, wf2, ro_index, chpair, segment, sample, uploader):
     """
     This function simply adjust the waveforms, coming from the virtual awg, to fit the requirements of the
-    Tabor awg
+    Tabor awg. The waveforms are sent with the uploader, which skips waveforms already in the awg.
     """
     divisor = 16
     readout_ind = int(ro_index[segment] + int(sample.clock * sample.readout_delay))
@@ -52,10 +53,10 @@ def _adjust_wfs_for_tabor(wf1, wf2, ro_index, chpair, segment, sample):
         wf1 = np.append(wf1, np.zeros(divisor - end_zeros))
         wf2 = np.append(wf2, np.zeros(divisor - end_zeros))
         marker1 = np.append(marker1, np.zeros(divisor - end_zeros))
-    sample.awg.wfm_send2(wf1, wf2, marker1, marker1, chpair * 2 - 1, segment + 1)
+    uploader.send(wf1, wf2, marker1, marker1, chpair, segment)
 
 
-def load_tabor(channel_sequences, ro_index, sample, reset=True, show_progress_bar=True):
+def load_tabor(channel_sequences, ro_index, sample, reset=True, show_progress_bar=True, use_cache=True):
     """
     This function takes the data, coming from virtual awg, and loads them into the awg
     :param channel_sequences: This must be a list of list, i.e., a list of channels each containing the sequences
@@ -64,10 +65,15 @@ def load_tabor(channel_sequences, ro_index, sample, reset=True, show_progress_ba
     :param sample: you should know this
     :param reset: simply sets the awg_channel active, probably not needed
     :param show_progress_bar: enables the progress bar
+    :param use_cache: only send waveforms which are not yet in the awg memory and store identical waveforms
+                      only once (see waveform_cache.py). If False, the awg is cleared and everything is sent.
     :return:
     """
     awg = sample.awg
-    awg.clear_waveforms()
+    if not use_cache:
+        awg.clear_waveforms()
+        reset_cache(awg)
+    uploader = TaborUploader(awg, sample.clock, use_cache)
     number_of_channels = 0
     complex_channel = []
     for chan in channel_sequences:
@@ -96,63 +102,64 @@ def load_tabor(channel_sequences, ro_index, sample, reset=True, show_progress_ba
 
     if number_of_channels == 1:
         for j, seq in enumerate(channel_sequences[0]):
-            _adjust_wfs_for_tabor(seq, [0], ro_index, 1, j, sample)
+            _adjust_wfs_for_tabor(seq, [0], ro_index, 1, j, sample, uploader)
             if show_progress_bar:
                 p.iterate()
 
     elif number_of_channels == 2:
         if complex_channel[0]:
             for j, seq in enumerate(channel_sequences[0]):
-                _adjust_wfs_for_tabor(seq.real, seq.imag, ro_index, 1, j, sample)
+                _adjust_wfs_for_tabor(seq.real, seq.imag, ro_index, 1, j, sample, uploader)
                 if show_progress_bar:
                     p.iterate()
         else:
             for j, seq in enumerate(zip(channel_sequences[0], channel_sequences[1])):
-                _adjust_wfs_for_tabor(seq[0], seq[1], ro_index, 1, j, sample)
+                _adjust_wfs_for_tabor(seq[0], seq[1], ro_index, 1, j, sample, uploader)
                 if show_progress_bar:
                     p.iterate()
 
     elif number_of_channels == 3:
         if complex_channel[0]:
             for j, seq in enumerate(zip(channel_sequences[0], channel_sequences[1])):
-                _adjust_wfs_for_tabor(seq[0].real, seq[0].imag, ro_index, 1, j, sample)
-                _adjust_wfs_for_tabor(seq[1], [0], ro_index, 2, j, sample)
+                _adjust_wfs_for_tabor(seq[0].real, seq[0].imag, ro_index, 1, j, sample, uploader)
+                _adjust_wfs_for_tabor(seq[1], [0], ro_index, 2, j, sample, uploader)
                 if show_progress_bar:
                     p.iterate()
         else:
             for j, seq in enumerate(zip(channel_sequences[0], channel_sequences[1], channel_sequences[2])):
-                _adjust_wfs_for_tabor(seq[0], seq[1], ro_index, 1, j, sample)
-                _adjust_wfs_for_tabor(seq[2], [0], ro_index, 2, j, sample)
+                _adjust_wfs_for_tabor(seq[0], seq[1], ro_index, 1, j, sample, uploader)
+                _adjust_wfs_for_tabor(seq[2], [0], ro_index, 2, j, sample, uploader)
                 if show_progress_bar:
                     p.iterate()
 
     else:  # 4 channels
         if complex_channel == [True, True]:
             for j, seq in enumerate(zip(channel_sequences[0], channel_sequences[1])):
-                _adjust_wfs_for_tabor(seq[0].real, seq[0].imag, ro_index, 1, j, sample)
-                _adjust_wfs_for_tabor(seq[1].real, seq[1].imag, ro_index, 2, j, sample)
+                _adjust_wfs_for_tabor(seq[0].real, seq[0].imag, ro_index, 1, j, sample, uploader)
+                _adjust_wfs_for_tabor(seq[1].real, seq[1].imag, ro_index, 2, j, sample, uploader)
                 if show_progress_bar:
                     p.iterate()
         elif complex_channel == [True, False, False]:
             for j, seq in enumerate(zip(channel_sequences[0], channel_sequences[1], channel_sequences[2])):
-                _adjust_wfs_for_tabor(seq[0].real, seq[0].imag, ro_index, 1, j, sample)
-                _adjust_wfs_for_tabor(seq[1], seq[2], ro_index, 2, j, sample)
+                _adjust_wfs_for_tabor(seq[0].real, seq[0].imag, ro_index, 1, j, sample, uploader)
+                _adjust_wfs_for_tabor(seq[1], seq[2], ro_index, 2, j, sample, uploader)
                 if show_progress_bar:
                     p.iterate()
         elif complex_channel == [False, False, True]:
             for j, seq in enumerate(zip(channel_sequences[0], channel_sequences[1], channel_sequences[2])):
-                _adjust_wfs_for_tabor(seq[0], seq[1], ro_index, 1, j, sample)
-                _adjust_wfs_for_tabor(seq[2].real, seq[2].imag, ro_index, 2, j, sample)
+                _adjust_wfs_for_tabor(seq[0], seq[1], ro_index, 1, j, sample, uploader)
+                _adjust_wfs_for_tabor(seq[2].real, seq[2].imag, ro_index, 2, j, sample, uploader)
                 if show_progress_bar:
                     p.iterate()
         else:
             for j, seq in enumerate(zip(channel_sequences[0], channel_sequences[1],
                                         channel_sequences[2], channel_sequences[3])):
-                _adjust_wfs_for_tabor(seq[0], seq[1], ro_index, 1, j, sample)
-                _adjust_wfs_for_tabor(seq[2], seq[3], ro_index, 2, j, sample)
+                _adjust_wfs_for_tabor(seq[0], seq[1], ro_index, 1, j, sample, uploader)
+                _adjust_wfs_for_tabor(seq[2], seq[3], ro_index, 2, j, sample, uploader)
                 if show_progress_bar:
                     p.iterate()
 
+    uploader.define_sequences()
     gc.collect()
 
     if number_of_channels <= 2:
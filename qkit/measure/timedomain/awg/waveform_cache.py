@@ -0,0 +1,187 @@
+# waveform_cache.py
+# content-addressed cache of the waveforms loaded into the AWGs
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Every waveform is identified by a hash of its samples, markers and the clock.
+The cache remembers which waveform each AWG holds in which slot (waveform name
+for the Tektronix AWGs, (channel pair, segment) for the Tabor AWG), so that
+load_awg and load_tawg only send new or changed waveforms. Identical waveforms
+of different sequence steps and channels share one waveform in the AWG memory.
+
+Only the driver calls wfm_send/wfm_import/wfm_assign (Tektronix) and
+wfm_send2/define_sequence (Tabor) are used, so any object providing them,
+e.g. a virtual AWG recording the calls, can be loaded as well.
+
+The cache can not see changes made to the AWG memory by other means. Call
+reset_cache(awg) after clearing the AWG by hand, after a reset or a power
+cycle of the AWG, or when the waveforms were loaded by other programs.
+Loading with use_cache=False overwrites waveforms without checking the cache,
+so the cache of the AWG is reset then.
+"""
+
+import hashlib
+import logging
+import numpy as np
+
+# bytes per sample sent over the instrument link
+TEKTRONIX_BYTES = 5  # float32 + marker byte in the wfm file
+TABOR_BYTES = 4  # two 16 bit channels
+
+_caches = {}
+
+
+def waveform_hash(clock, *arrays):
+    """
+    Returns the hex digest of the clock and the arrays (samples and markers).
+    """
+    h = hashlib.sha1(repr(float(clock)).encode())
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(repr((a.dtype.str, a.shape)).encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+class WaveformCache(object):
+    """
+    Record of the waveforms held by one AWG and of the upload statistics.
+    """
+
+    def __init__(self):
+        self.max_slots = 2000  # stale Tektronix waveforms are deleted above this number
+        self.reset()
+
+    def reset(self):
+        self.slots = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.sent = 0
+        self.reused = 0
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+
+    def holds(self, slot, key):
+        return self.slots.get(slot) == key
+
+    def store(self, slot, key, nbytes):
+        """Records the upload of the waveform key into slot."""
+        self.slots[slot] = key
+        self.sent += 1
+        self.bytes_sent += nbytes
+
+    def skip(self, nbytes):
+        """Records a waveform which did not have to be sent."""
+        self.reused += 1
+        self.bytes_saved += nbytes
+
+    def forget(self, slot):
+        self.slots.pop(slot, None)
+
+    def report(self):
+        """
+        Returns a one line summary of the last load.
+        """
+        return "AWG upload: %i waveforms sent (%.1f MB), %i reused (%.1f MB saved)" % (
+            self.sent, self.bytes_sent / 1e6, self.reused, self.bytes_saved / 1e6)
+
+
+def get_cache(awg):
+    """
+    Returns the waveform cache of the AWG instrument.
+    """
+    try:
+        name = awg.get_name()
+    except AttributeError:
+        name = id(awg)
+    if name not in _caches:
+        _caches[name] = WaveformCache()
+    return _caches[name]
+
+
+def reset_cache(awg):
+    """
+    Forgets all waveforms of the AWG, e.g. after its memory was cleared.
+    """
+    get_cache(awg).reset()
+
+
+class TaborUploader(object):
+    """
+    Sends the segments of one sequence to a Tabor AWG.
+
+    Identical waveforms of a channel pair are stored in one segment and the
+    sequencer steps point to it. Segments which already hold the waveform are
+    not sent again. Call define_sequences() after all steps are sent.
+
+    Args:
+        awg: Tabor AWG instrument
+        clock: sample clock
+        use_cache: if False, every step is sent into its own segment as before
+            and the cache of the AWG is reset.
+    """
+
+    def __init__(self, awg, clock, use_cache=True):
+        self.awg = awg
+        self.clock = clock
+        self.cache = get_cache(awg) if use_cache else None
+        if self.cache is not None:
+            self.cache.reset_stats()
+        else:
+            reset_cache(awg)  # the segments are overwritten
+        self.steps = {}  # channel pair: list of segments of the sequence steps
+        self._segments = {}  # channel pair: {hash: segment} of this sequence
+
+    def send(self, wf1, wf2, m1, m2, chpair, step):
+        """
+        Sends the waveforms of channel pair chpair for the sequence step (starting from 0).
+        """
+        steps = self.steps.setdefault(chpair, [])
+        if self.cache is None:
+            self.awg.wfm_send2(wf1, wf2, m1, m2, chpair * 2 - 1, step + 1)
+            steps.append(step + 1)
+            return
+        nbytes = TABOR_BYTES * len(wf1)
+        key = waveform_hash(self.clock, wf1, wf2, m1, m2)
+        segments = self._segments.setdefault(chpair, {})
+        seg = segments.get(key)
+        if seg is None:
+            seg = len(segments) + 1
+            segments[key] = seg
+            if self.cache.holds((chpair, seg), key):
+                self.cache.skip(nbytes)
+            else:
+                self.awg.wfm_send2(wf1, wf2, m1, m2, chpair * 2 - 1, seg)
+                self.cache.store((chpair, seg), key, nbytes)
+        else:
+            self.cache.skip(nbytes)
+        steps.append(seg)
+
+    def define_sequences(self):
+        """
+        Points the sequencer steps to the shared segments.
+        """
+        if self.cache is None:
+            return  # one segment per step
+        for chpair, segs in self.steps.items():
+            if segs == list(range(1, len(segs) + 1)):
+                self.awg.define_sequence(chpair * 2 - 1, len(segs))
+            else:
+                if len(segs) < 3:  # the sequencer needs at least 3 steps
+                    segs = segs * (3 if len(segs) == 1 else 2)
+                self.awg.define_sequence(chpair * 2 - 1, segs)
+        logging.info(self.cache.report())
@@ -4,7 +4,6 @@
 
 import numpy as np
 import logging
-import threading
 
 import qkit
 from qkit.gui.notebook.Progress_Bar import Progress_Bar
@@ -12,6 +11,8 @@ from qkit.storage import store as hdf
 from qkit.gui.plot import plot as qviewkit
 import qkit.measure.write_additional_files as waf
 from qkit.measure.timedomain.initialize import InitializeTimeDomain as iniTD
+from qkit.measure.timedomain.pipeline import Pipeline
+from qkit.measure.timedomain.averaging import Averager
 
 
 class Measure_td(object):
@@ -27,6 +28,11 @@ class Measure_td(object):
     Generally, we want to use
     ReadoutTrace = True -> if we want to record the readout pulse or
     AWGTrace = True -> if we have a N different time steps in the AWG (Not used, this is done via the mode variable now.)
+    pipelined = True -> decode and store the data in worker threads while the next point is acquired,
+                        at most pipeline_depth acquisitions are waiting (see pipeline.py)
+    store_iterations = False -> measure_1D_AWG and measure_2D_AWG(iterations > 1) only store the averages,
+                                not the data of every iteration
+    averaging_stats = True -> also store the standard error of the averages (amplitude_err_i, phase_err_i)
 
     ToDO (S1, 09/2017):
         - Include LogFunctions
@@ -56,8 +62,15 @@ class Measure_td(object):
         
         self.ReadoutTrace = False
         
+        self.pipelined = False
+        self.pipeline_depth = 4
+        self._pipeline = None
+        self._adc_clock = None
+        
         self.open_qviewkit = True
         self.create_averaged_data = False
+        self.store_iterations = True
+        self.averaging_stats = False
         
         self.qviewkit_singleInstance = True
         self._qvk_process = False
@@ -134,9 +147,7 @@ class Measure_td(object):
                     qkit.flow.sleep()
                     self._append_data()
                     if self.show_progress_bar: p.iterate()
-                for i in range(self.ndev):
-                    self._hdf_amp[i].next_matrix()
-                    self._hdf_pha[i].next_matrix()
+                self._commit(self._next_matrix)
         finally:
             self._end_measurement()
     
@@ -149,7 +160,6 @@ class Measure_td(object):
         self.y_set_obj = lambda y: True
         self.y_unit = ''
         self.create_averaged_data = True
-        self.avg_complex_sum = np.zeros_like(self.x_vec)
         try:
             return self.measure_2D_AWG(iterations=1)
         finally:
@@ -171,27 +181,16 @@ class Measure_td(object):
             self.z_set_obj = lambda z: True
             self.z_unit = ''
             
-            self.measure_3D_AWG()
-            
-            # For 3D measurements with iterations, averages are only created at the end to get a consistent averaging base.
-            hdf_file = hdf.Data(self._hdf.get_filepath())
-            for j in range(self.ndev):
-                amp = np.array(hdf_file["/entry/data0/amplitude_%i" % j])
-                pha = np.array(hdf_file["/entry/data0/phase_%i" % j])
-                amp_avg = sum(amp[i] for i in range(iterations)) / iterations
-                pha_avg = sum(pha[i] for i in range(iterations)) / iterations
-                hdf_amp_avg = hdf_file.add_value_matrix('amplitude_avg_%i' % i, x=self._hdf_y, y=self._hdf_x, unit='a.u.')
-                hdf_pha_avg = hdf_file.add_value_matrix('phase_avg_%i' % i, x=self._hdf_y, y=self._hdf_x, unit='rad')
-                
-                for i in range(len(self.y_vec)):
-                    hdf_amp_avg.append(amp_avg[i])
-                    hdf_pha_avg.append(pha_avg[i])
-            hdf_file.close_file()
+            # the averages are updated row by row during the measurement
+            self.create_averaged_data = True
+            try:
+                self.measure_3D_AWG()
+            finally:
+                self.create_averaged_data = False
         
         else:
             self.mode = 3  # 1: 1D, 2: 2D, 3:1D_AWG/2D_AWG, 4:3D_AWG
             self._prepare_measurement_file()
-            if self.ndev > 1: raise ValueError('Multiplexed readout is currently not supported for 2D measurements')
             if self.show_progress_bar:
                 p = Progress_Bar(len(self.y_vec), name=self.dirname)
             try:
@@ -220,17 +219,15 @@ class Measure_td(object):
         if self.show_progress_bar: p = Progress_Bar(len(self.y_vec) * len(self.z_vec), name=self.dirname)
         try:
             # measurement loop
-            for z in self.z_vec:
+            for iz, z in enumerate(self.z_vec):
                 self.z_set_obj(z)
-                for y in self.y_vec:
+                for iy, y in enumerate(self.y_vec):
                     qkit.flow.sleep()
                     self.y_set_obj(y)
                     qkit.flow.sleep()
-                    self._append_data()
+                    self._append_data(iteration=iz, row=iy)
                     if self.show_progress_bar: p.iterate()
-                for i in range(self.ndev):
-                    self._hdf_amp[i].next_matrix()
-                    self._hdf_pha[i].next_matrix()
+                self._commit(self._next_matrix)
         finally:
             self._end_measurement()
     
@@ -240,9 +237,7 @@ class Measure_td(object):
         in your network by performing a digital down conversion
         :return: None
         """
-        time_end = float(self.sample.mspec.get_samples()) / self.sample.mspec.get_samplerate()
-        time_array = np.linspace(0, time_end, self.sample.mspec.get_samples())
-        self.set_x_parameters(time_array, 'time', True, 'sec')
+        self.set_x_parameters(self._ddc_time_array(), 'time', True, 'sec')
         self.mode = 1  # 1: 1D, 2: 2D, 3:1D_AWG/2D_AWG
         self._prepare_measurement_file()
         try:
@@ -259,9 +254,7 @@ class Measure_td(object):
         """
         if self.y_set_obj is None:
             raise ValueError('y-axes parameters not properly set')
-        time_end = float(self.sample.mspec.get_samples()) / self.sample.mspec.get_samplerate()
-        time_array = np.linspace(0, time_end, self.sample.mspec.get_samples())
-        self.set_x_parameters(time_array, 'time', True, 'sec')
+        self.set_x_parameters(self._ddc_time_array(), 'time', True, 'sec')
         
         self.mode = 2  # 1: 1D, 2: 2D, 3:1D_AWG/2D_AWG
         self._prepare_measurement_file()
@@ -288,9 +281,7 @@ class Measure_td(object):
         """
         if self.y_vec is None:
             raise ValueError('y-axes parameters not properly set')
-        time_end = float(self.sample.mspec.get_samples()) / self.sample.mspec.get_samplerate()
-        time_array = np.linspace(0, time_end, self.sample.mspec.get_samples())
-        self.set_x_parameters(time_array, 'time', True, 'sec')
+        self.set_x_parameters(self._ddc_time_array(), 'time', True, 'sec')
         
         self.mode = 2  # 1: 1D, 2: 2D, 3:1D_AWG/2D_AWG
         self._prepare_measurement_file()
@@ -310,9 +301,7 @@ class Measure_td(object):
         """
         if (self.y_vec is None) or (self.z_set_obj is None):
             raise ValueError('Axes parameters not properly set')
-        time_end = float(self.sample.mspec.get_samples()) / self.sample.mspec.get_samplerate()
-        time_array = np.linspace(0, time_end, self.sample.mspec.get_samples())
-        self.set_x_parameters(time_array, 'time', True, 'sec')
+        self.set_x_parameters(self._ddc_time_array(), 'time', True, 'sec')
         self.mode = 4
         self._prepare_measurement_file()
         try:
@@ -320,15 +309,18 @@ class Measure_td(object):
                 self.z_set_obj(z)
                 qkit.flow.sleep()
                 self._append_data(ddc=True)
-                for i in range(self.ndev):
-                    self._hdf_amp[i].next_matrix()
-                    self._hdf_pha[i].next_matrix()
-                if self.ReadoutTrace:
-                    self._hdf_I.next_matrix()
-                    self._hdf_Q.next_matrix()
+                self._commit(self._next_matrix, self.ReadoutTrace)
         finally:
             self._end_measurement()
     
+    def _ddc_time_array(self):
+        """
+        time axis of the down converted traces, thinned out like the data if the readout decimates (ddc_decimation)
+        """
+        time_end = float(self.sample.mspec.get_samples()) / self.sample.mspec.get_samplerate()
+        time_array = np.linspace(0, time_end, self.sample.mspec.get_samples())
+        return time_array[::getattr(self.readout, 'ddc_decimation', 1)]
+    
     def _prepare_measurement_file(self):
         qkit.flow.start()
         if self.dirname is None:
@@ -414,75 +406,142 @@ class Measure_td(object):
                 self._hdf_Q = self._hdf.add_value_box('Q_TimeTrace', x=self._hdf_y, y=self._hdf_y,
                                                       z=self._hdf_TimeTraceAxis, unit='V', save_timestamp=False)
         
+        # datasets are only created in the file with the first append, the raw data of the iterations is skipped
+        self._store_raw = self.store_iterations or not self.create_averaged_data or self.mode < 3
         if self.create_averaged_data:
-            self._hdf_amp_avg = []
-            self._hdf_pha_avg = []
-            for i in range(self.ndev):
-                self._hdf_amp_avg.append(self._hdf.add_value_vector('amplitude_avg_%i' % i, x=self._hdf_x, unit='a.u.'))
-                self._hdf_pha_avg.append(self._hdf.add_value_vector('phase_avg_%i' % i, x=self._hdf_x, unit='rad'))
+            if self.mode == 4:  # averages over z for every y
+                self._averager = Averager((len(self.y_vec), len(self.x_vec), self.ndev), stats=self.averaging_stats)
+                add_average = lambda name, unit: self._hdf.add_value_matrix(name, x=self._hdf_y, y=self._hdf_x, unit=unit)
+            else:  # averages over y
+                self._averager = Averager((len(self.x_vec), self.ndev), stats=self.averaging_stats)
+                add_average = lambda name, unit: self._hdf.add_value_vector(name, x=self._hdf_x, unit=unit)
+            self._hdf_amp_avg = [add_average('amplitude_avg_%i' % i, 'a.u.') for i in range(self.ndev)]
+            self._hdf_pha_avg = [add_average('phase_avg_%i' % i, 'rad') for i in range(self.ndev)]
+            if self.averaging_stats:
+                self._hdf_amp_err = [add_average('amplitude_err_%i' % i, 'a.u.') for i in range(self.ndev)]
+                self._hdf_pha_err = [add_average('phase_err_%i' % i, 'rad') for i in range(self.ndev)]
         
         if self.comment:
             self._hdf.add_comment(self.comment)
         if self.qviewkit_singleInstance and self.open_qviewkit and self._qvk_process:
             self._qvk_process.terminate()  # terminate an old qviewkit instance
         if self.open_qviewkit:
+            prefix = ('amplitude_%i', 'phase_%i') if self._store_raw else ('amplitude_avg_%i', 'phase_avg_%i')
             self._qvk_process = qviewkit.plot(self._hdf.get_filepath(),
-                                              datasets=['amplitude_%i' % i for i in range(min(5,self.ndev))] + ['phase_%i' % i for i in range(min(5,self.ndev))]
+                                              datasets=[prefix[0] % i for i in range(min(5,self.ndev))] + [prefix[1] % i for i in range(min(5,self.ndev))]
                                               )
+        
+        if self.pipelined:
+            if hasattr(self.readout, 'acquire') and hasattr(self.readout, 'process'):
+                # the decoding thread must not query the digitizer
+                self._adc_clock = self.readout.get_adc_clock()
+                self._pipeline = Pipeline(self._decode_data, self._store_data, self.pipeline_depth)
+            else:
+                logging.warning(__name__ + ': Readout does not support pipelining (acquire/process), measuring sequentially.')
+    
+    def _append_data(self, iteration=0, ddc=None, row=None):
+        if self._pipeline is not None:
+            # decoding and storing is done in the pipeline threads while the next point is measured
+            self._pipeline.put(self.readout.acquire(), iteration, ddc, row)
+        else:
+            self._store_data(self.readout.readout(timeTrace=self.ReadoutTrace, ddc=ddc), iteration, ddc, row)
     
-    def _append_data(self, iteration=0, ddc=None):
+    def _decode_data(self, raw, iteration=0, ddc=None, row=None):
+        Is, Qs = raw
+        return self.readout.process(Is, Qs, timeTrace=self.ReadoutTrace, ddc=ddc, samplerate=self._adc_clock)
+    
+    def _store_data(self, data, iteration=0, ddc=None, row=None):
         if self.ReadoutTrace:
-            ampliData, phaseData, Is, Qs = self.readout.readout(timeTrace=True, ddc=ddc)
+            ampliData, phaseData, Is, Qs = data
         else:
-            ampliData, phaseData = self.readout.readout(timeTrace=False, ddc=ddc)
+            ampliData, phaseData = data
+        
+        if self._store_raw:
+            if len(ampliData.shape) < 3:  # "normal" measurements
+                for i in range(self.ndev):
+                    self._hdf_amp[i].append(np.atleast_1d(ampliData.T[i]))
+                    self._hdf_pha[i].append(np.atleast_1d(phaseData.T[i]))
+                if self.ReadoutTrace:
+                    if self.mode < 3:  # mode 2 not yet fully supported but working for DDC timetrace experiments
+                        self._hdf_I.append(Is)
+                        self._hdf_Q.append(Qs)
+                    elif self.mode == 3:  # mode 4 not supported for 3D_awg yet
+                        for ix in range(len(self.x_vec)):
+                            self._hdf_I.append(Is[:, ix])
+                            self._hdf_Q.append(Qs[:, ix])
+                        self._hdf_I.next_matrix()
+                        self._hdf_Q.next_matrix()
+        
+            else:  # for AWG DDC ReadoutTrace, all data are there at once
+                for i in range(self.ndev):
+                    for j in range(ampliData.T.shape[2]):
+                        self._hdf_amp[i].append(np.atleast_1d(ampliData.T[i, :, j]))
+                        self._hdf_pha[i].append(np.atleast_1d(phaseData.T[i, :, j]))
+                        if self.ReadoutTrace:
+                            self._hdf_I.append(Is[:, j])
+                            self._hdf_Q.append(Qs[:, j])
         
-        if len(ampliData.shape) < 3:  # "normal" measurements
-            for i in range(self.ndev):
-                self._hdf_amp[i].append(np.atleast_1d(ampliData.T[i]))
-                self._hdf_pha[i].append(np.atleast_1d(phaseData.T[i]))
-            if self.ReadoutTrace:
-                if self.mode < 3:  # mode 2 not yet fully supported but working for DDC timetrace experiments
-                    self._hdf_I.append(Is)
-                    self._hdf_Q.append(Qs)
-                elif self.mode == 3:  # mode 4 not supported for 3D_awg yet
-                    for ix in range(len(self.x_vec)):
-                        self._hdf_I.append(Is[:, ix])
-                        self._hdf_Q.append(Qs[:, ix])
-                    self._hdf_I.next_matrix()
-                    self._hdf_Q.next_matrix()
-        
-        else:  # for AWG DDC ReadoutTrace, all data are there at once
-            for i in range(self.ndev):
-                for j in range(ampliData.T.shape[2]):
-                    self._hdf_amp[i].append(np.atleast_1d(ampliData.T[i, :, j]))
-                    self._hdf_pha[i].append(np.atleast_1d(phaseData.T[i, :, j]))
-                    if self.ReadoutTrace:
-                        self._hdf_I.append(Is[:, j])
-                        self._hdf_Q.append(Qs[:, j])
         
         if self.create_averaged_data:
-            if iteration == 0:
-                self.avg_complex_sum = ampliData * np.exp(1j * phaseData)
+            # running mean over the iterations, the whole sequence (1D_AWG) or one row (3D_AWG) at a time
+            self._averager.add(ampliData, phaseData, row)
+            amp_avg = self._averager.amplitude(row)
+            pha_avg = self._averager.phase(row)
+            for i in range(self.ndev):
+                self._write_average(self._hdf_amp_avg[i], amp_avg.T[i], iteration, row)
+                self._write_average(self._hdf_pha_avg[i], pha_avg.T[i], iteration, row)
+            if self.averaging_stats:
+                err = self._averager.stderr(row)
+                pha_err = err / np.maximum(amp_avg, np.finfo(float).tiny)  # small angle approximation
                 for i in range(self.ndev):
-                    self._hdf_amp_avg[i].append(np.atleast_1d(ampliData.T[i]))
-                    self._hdf_pha_avg[i].append(np.atleast_1d(phaseData.T[i]))
+                    self._write_average(self._hdf_amp_err[i], err.T[i], iteration, row)
+                    self._write_average(self._hdf_pha_err[i], pha_err.T[i], iteration, row)
+            self._hdf.flush()
+    
+    def _write_average(self, ds, data, iteration, row=None):
+        """
+        appends the average in the first iteration and overwrites it (or its row) afterwards
+        """
+        data = np.atleast_1d(data)
+        if iteration == 0:
+            ds.append(data)
+        else:
+            ds.flush_buffer()
+            if row is None:
+                ds.ds.write_direct(np.ascontiguousarray(data))
             else:
-                self.avg_complex_sum += ampliData * np.exp(1j * phaseData)
-                amp_avg = np.abs(self.avg_complex_sum / (iteration + 1))
-                pha_avg = np.angle(self.avg_complex_sum / (iteration + 1))
-                for i in range(self.ndev):
-                    self._hdf_amp_avg[i].ds.write_direct(np.ascontiguousarray(np.atleast_1d(amp_avg.T[i])))
-                    self._hdf_pha_avg[i].ds.write_direct(np.ascontiguousarray(np.atleast_1d(pha_avg.T[i])))
-                    self._hdf_pha_avg[i].ds.attrs['iteration'] = iteration + 1
-                    self._hdf_amp_avg[i].ds.attrs['iteration'] = iteration + 1
-                self._hdf.flush()
+                ds.ds[row] = data
+            ds.ds.attrs['iteration'] = iteration + 1
+    
+    def _commit(self, func, *args):
+        """
+        runs func(*args), in pipelined mode queued in order with the data
+        """
+        if self._pipeline is not None:
+            self._pipeline.call(func, *args)
+        else:
+            func(*args)
+    
+    def _next_matrix(self, readout_trace=False):
+        if not self._store_raw:
+            return
+        for i in range(self.ndev):
+            self._hdf_amp[i].next_matrix()
+            self._hdf_pha[i].next_matrix()
+        if readout_trace:
+            self._hdf_I.next_matrix()
+            self._hdf_Q.next_matrix()
     
     def _end_measurement(self):
-        t = threading.Thread(target=qviewkit.save_plots, args=[self._hdf.get_filepath(), self._plot_comment])
-        t.start()
-        self._hdf.close_file()
-        waf.close_log_file(self._log)
-        qkit.flow.end()
+        pipeline, self._pipeline = self._pipeline, None
+        try:
+            if pipeline is not None:
+                pipeline.close()  # write everything acquired so far, also after an abort
+        finally:
+            self._hdf.close_file()
+            qviewkit.save_plots_async(self._hdf.get_filepath(), comment=self._plot_comment)
+            waf.close_log_file(self._log)
+            qkit.flow.end()
     
     def set_plot_comment(self, comment):
         '''
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Acquisition/processing pipeline for the time domain measurements.
+
+The measurement loop only sets the parameters and acquires the raw data.
+Decoding (IQ_decode or the digital down conversion) and writing to the h5
+file run in two worker threads connected by bounded queues:
+
+    measurement loop --(raw data)--> decode thread --(results)--> store thread
+
+Each stage is a single thread reading a FIFO, so everything is committed to
+the file in the order of acquisition. If a queue is full, put() blocks
+(back-pressure) while still checking qkit.flow for an abort. An error in a
+stage stops the pipeline, the remaining items are dropped and the error is
+raised in the measurement loop.
+"""
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import qkit
+
+_STOP = object()
+
+
+class Pipeline(object):
+    """
+    Args:
+        decode: function decode(raw, *args) returning the processed data.
+        store: function store(result, *args) writing the data.
+        depth: maximum number of items waiting in each queue.
+    """
+
+    def __init__(self, decode, store, depth=4):
+        self._decode = decode
+        self._store = store
+        self._raw = queue.Queue(maxsize=depth)
+        self._results = queue.Queue(maxsize=depth)
+        self._error = None
+        self._abort = threading.Event()
+        self._threads = [threading.Thread(target=self._run, args=(self._raw, self._results), name='td_decode'),
+                         threading.Thread(target=self._run, args=(self._results, None), name='td_store')]
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def put(self, raw, *args):
+        """Queues raw data for decoding, blocks while the pipeline is full."""
+        self._put(('data', raw, args))
+
+    def call(self, func, *args):
+        """Queues func(*args) to run in the store thread, in order with the data (e.g. next_matrix)."""
+        self._put(('call', func, args))
+
+    def _put(self, item):
+        while True:
+            self._check()
+            try:
+                self._raw.put(item, timeout=0.05)
+                return
+            except queue.Full:
+                qkit.flow.sleep()  # raises on a human abort
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self, source, sink):
+        while True:
+            item = source.get()
+            if item is _STOP:
+                break
+            if self._abort.is_set():
+                continue  # drop everything after an error or abort
+            kind, obj, args = item
+            try:
+                if kind == 'call':
+                    if sink is None:
+                        obj(*args)
+                elif sink is None:
+                    self._store(obj, *args)
+                else:
+                    item = (kind, self._decode(obj, *args), args)
+            except Exception as e:
+                logging.error(__name__ + ': %s stage failed: %s' % (threading.current_thread().name, e))
+                self._error = e
+                self._abort.set()
+                continue
+            if sink is not None:
+                sink.put(item)
+        if sink is not None:
+            sink.put(_STOP)
+
+    def close(self, abort=False):
+        """
+        Waits until all queued data is written and stops the threads.
+        With abort=True the queued data is dropped. Raises a pending error.
+        """
+        if abort:
+            self._abort.set()
+        self._raw.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._check()
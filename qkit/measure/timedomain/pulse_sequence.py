@@ -5,18 +5,27 @@ import matplotlib.pyplot as plt
 from inspect import getargspec as getargspec
 from inspect import getsourcelines as getsourcelines
 import logging
+import time
 
 class Shape(np.vectorize):
     """
     A vectorized function describing a possible shape
     defined on the standardized interval [0,1).
+    With vectorized=True func is evaluated for the whole array at once
+    (numpy expression), otherwise element by element like np.vectorize.
     """
     def __init__(self, name, func, *args, **kwargs):
         self.name = name
+        self.vectorized = kwargs.pop("vectorized", False)
         super(Shape, self).__init__(func, *args, **kwargs)
 
+    def __call__(self, *args, **kwargs):
+        if self.vectorized:
+            return self.pyfunc(*[np.asarray(a, dtype=float) for a in args], **kwargs)
+        return super(Shape, self).__call__(*args, **kwargs)
+
     def __mul__(self, other):
-        return Shape(self.name, lambda x: self.pyfunc(x) * other.pyfunc(x))
+        return Shape(self.name, lambda x: self(x) * other(x), vectorized=True)
 
 
 class ShapeLib(object):
@@ -26,8 +35,8 @@ class ShapeLib(object):
     """
 
     def __init__(self):
-        self.rect = Shape("rect", lambda x: np.where(x >= 0 and x < 1, 1, 0))
-        self.gauss = Shape("gauss", lambda x: np.exp(-0.5 * np.power((x - 0.5) / 0.166, 2.0))) * self.rect
+        self.rect = Shape("rect", lambda x: np.where((x >= 0) & (x < 1), 1, 0), vectorized=True)
+        self.gauss = Shape("gauss", lambda x: np.exp(-0.5 * np.power((x - 0.5) / 0.166, 2.0)), vectorized=True) * self.rect
 
 
 # Make ShapeLib a singleton:
@@ -115,6 +124,45 @@ class Pulse(object):
 
 
 
+def benchmark_sequence(n_points=500, samplerate=2.4e9, repeat=3):
+    """
+    Times the synthesis of a Rabi and a Ramsey sweep with n_points time steps:
+    as baseline with the shapes evaluated element by element and without caches,
+    without caches (first sweep) and with the memoized waveforms (repeated sweep).
+
+    Returns:
+        dict with the times per sweep in s.
+    """
+    def sequences(shape):
+        pi2 = Pulse(20e-9, shape=shape, name="pi/2", iq_frequency=50e6)
+        rabi = PulseSequence(samplerate=samplerate)
+        rabi.add(Pulse(lambda t: t, shape=shape, name="drive", iq_frequency=50e6))
+        rabi.add_readout()
+        ramsey = PulseSequence(samplerate=samplerate)
+        ramsey.add(pi2)
+        ramsey.add_wait(lambda t: t)
+        ramsey.add(pi2)
+        ramsey.add_readout()
+        return [("rabi", rabi), ("ramsey", ramsey)]
+
+    times = np.linspace(10e-9, 1e-6, n_points)
+    elementwise = Shape("gauss", ShapeLib.gauss.pyfunc)
+    results = {}
+    for (name, seq), (_, baseline) in zip(sequences(ShapeLib.gauss), sequences(elementwise)):
+        for key, s, cached in [(name + "_baseline", baseline, False), (name, seq, False), (name + "_cached", seq, True)]:
+            t = time.time()
+            for i in range(repeat):
+                if not cached:
+                    s._cache = {}
+                    s._shape_cache = {}
+                for tau in times:
+                    s(tau, IQ_mixing=True)
+            results[key] = (time.time() - t) / repeat
+        print("{:s}: {:d} points, baseline {:.1f} ms, first sweep {:.1f} ms, repeated {:.2f} ms".format(
+            name, n_points, 1e3 * results[name + "_baseline"], 1e3 * results[name], 1e3 * results[name + "_cached"]))
+    return results
+
+
 class PulseSequence(object):
     """
     Class for aranging pulses for a time-domain experiment.
@@ -151,6 +199,10 @@ class PulseSequence(object):
         self._cols = ["C0" ,"C1", "C2", "C3", "C4", "C5", "C6", "C8", "C9", "r", "g", "b", "y", "k", "m"]
         self._cols_temp = self._cols[:]
         self._pulse_cols = {"readout": "C7", "wait": "w"}
+        # waveforms per argument tuple and pulse shapes per length, see __call__
+        self.cache_size = 1024
+        self._cache = {}
+        self._shape_cache = {}
 
     def __call__(self, *args, **kwargs):
         """
@@ -180,31 +232,67 @@ class PulseSequence(object):
             logging.error("Sequence call requires samplerate.")
             return
         
-        if kwargs.has_key("IQ_mixing"):
-            IQ_mixing = kwargs["IQ_mixing"]
-        else:
-            IQ_mixing = False
+        IQ_mixing = kwargs.get("IQ_mixing", False)
 
         # find readout
         pulse_names = [p["name"] for p in self._pulses]
-        num_pulses = len(pulse_names) # number of pulses in the sequence
-        if "readout" in pulse_names:
-            readout_pos = pulse_names.index("readout")
-        else:
-            readout_pos = num_pulses
+        if "readout" not in pulse_names:
             logging.warning("No readout in sequence! Adding readout at the end of the sequence.")
+            pulses = self._pulses[:] # the readout is only used from the next call on
             self.add_readout()
-        
-        # build waveforms for each pulse
-        # if iq-mixing is enabled 
-        wfms = [np.zeros(0)] * num_pulses # list of waveforms for each pulse
+        else:
+            pulses = self._pulses
+
+        # the waveform only depends on the arguments and the current pulse properties
+        try:
+            key = (tuple(args), IQ_mixing, self.samplerate, self.dc_corr, self._signature(pulses))
+            hash(key)
+        except TypeError:
+            key = None
+        if key is not None and key in self._cache:
+            waveform, readout_index = self._cache[key]
+            return waveform.copy(), readout_index
+
+        waveform, readout_index = self._synthesize(pulses, args, IQ_mixing)
+        if key is not None:
+            if len(self._cache) >= self.cache_size:
+                self._cache = {}
+            self._cache[key] = (waveform, readout_index)
+            waveform = waveform.copy()
+        return waveform, readout_index
+
+    def _signature(self, pulses):
+        """
+        Returns a hashable description of the pulses, changes of the pulse objects result in a new signature.
+        """
+        sig = []
+        for pulse_dict in pulses:
+            pulse = pulse_dict.get("pulse")
+            if pulse is None:
+                sig.append((pulse_dict["name"], pulse_dict["length"], pulse_dict["skip"]))
+            else:
+                sig.append((pulse_dict["name"], pulse_dict["length"], pulse_dict["skip"], pulse.shape,
+                            pulse.amplitude, pulse.phase, pulse.iq_frequency, pulse.iq_dc_offset, pulse.iq_angle))
+        return tuple(sig)
+
+    def _layout(self, pulses, args):
+        """
+        Determines the number of samples and the start index of every pulse.
+
+        Returns:
+            lengths:       list of pulse lengths in s
+            samples:       list of the number of samples of each pulse
+            offsets:       list of start indices of each pulse
+            readout_index: index of the readout in the waveform
+        """
+        num_pulses = len(pulses)
         timestep = 1.0 / self.samplerate # minimum time step
-        length = 0 #length of current pulse
+        lengths, samples, offsets = [], [], []
+        position = 0 # start of the next pulse
         readout_index = -1 # index of the readout in the waveform of the whole sequence
-        for i in range(num_pulses):
-            pulse_dict = self._pulses[i]
-
+        for i, pulse_dict in enumerate(pulses):
             # Determine length of the pulse
+            length = 0
             if isinstance(pulse_dict["length"], float):
                 length = pulse_dict["length"]
             elif callable(pulse_dict["length"]):
@@ -212,60 +300,74 @@ class PulseSequence(object):
             elif pulse_dict["length"] is None:
                 length = 0
                 logging.warning("Pulse number {:d} (name = {:}) has no length! Setting length to 0.".format(i, pulse_dict["name"]))
-            if (pulse_dict["name"] is "readout") and (i is num_pulses - 1):
+            if (pulse_dict["name"] == "readout") and (i == num_pulses - 1):
                 length = timestep # if readout is last, omit the wfm (apart from a single digit)
             # Warning if pulse is shorter than smallest possible step
             if (length < 0.5*timestep) and (length != 0):
                 logging.warning("{:}-pulse is shorter than {:.2f} nanoseconds and thus is omitted.".format(pulse_dict["name"], 0.5*timestep*1e9))
-            
-            # create waveform array of the current pulse
-            if pulse_dict["name"] is "wait":
-                wfm = np.zeros(int(round(length * self.samplerate)))
-            elif pulse_dict["name"] is "readout":
-                wfm = np.zeros(int(round(length * self.samplerate)))
+
+            # number of samples of the current pulse
+            if pulse_dict["name"] in ["wait", "readout"]:
+                n = int(round(length * self.samplerate))
+            elif length > 0.5*timestep:
+                n = len(np.arange(0, length, timestep))
             else:
-                if length > 0.5*timestep:
-                    wfm = pulse_dict["pulse"](np.arange(0, length, timestep) / length)
-                else:
-                    wfm = np.zeros(0)
+                n = 0
             # if current pulse is readout set readout_index
-            if (pulse_dict["name"] is "readout") and (readout_index == -1):
-                readout_index = len(wfms[i])
-            #append in current wfm
-            wfms[i] = np.append(wfms[i], wfm)
-            # append zeros in wfms if skip is False
+            if (pulse_dict["name"] == "readout") and (readout_index == -1):
+                readout_index = position
+            lengths.append(length)
+            samples.append(n)
+            offsets.append(position)
+            # the next pulse starts after this one if skip is False
             if not pulse_dict["skip"]:
-                for j in range(i + 1, num_pulses): # only necessary for pulses after the current pulse
-                    wfms[j] = np.append(wfms[j], np.zeros_like(wfm))
-        
-        # Create waveform of the sequence
-        max_len = max([len(w) for w in wfms]) # length of the longest waveform
-        for i in range(num_pulses):
-            wfms[i] = np.append(wfms[i], np.zeros(max_len - len(wfms[i])))
-            if not any(wfms[i]):
+                position += n
+        return lengths, samples, offsets, readout_index
+
+    def _get_shape(self, shape, length):
+        """
+        Returns the (cached) shape of a pulse of the given length, sampled at the samplerate.
+        """
+        key = (shape, length, self.samplerate)
+        values = self._shape_cache.get(key)
+        if values is None:
+            if len(self._shape_cache) >= self.cache_size:
+                self._shape_cache = {}
+            values = shape(np.arange(0, length, 1.0 / self.samplerate) / length)
+            self._shape_cache[key] = values
+        return values
+
+    def _synthesize(self, pulses, args, IQ_mixing):
+        """
+        Lays out all pulses in one preallocated waveform.
+        """
+        timestep = 1.0 / self.samplerate
+        lengths, samples, offsets, readout_index = self._layout(pulses, args)
+        max_len = max([o + n for o, n in zip(offsets, samples)] + [0]) # length of the longest waveform
+        # first and last point of the waveform go to 0
+        waveform = np.zeros(max_len + 2, dtype=complex)
+        mixed = False
+        for pulse_dict, length, n, offset in zip(pulses, lengths, samples, offsets):
+            if pulse_dict["name"] in ["wait", "readout"] or n == 0:
+                continue
+            pulse = pulse_dict["pulse"]
+            wfm = pulse.amplitude * self._get_shape(pulse.shape, length)
+            if not wfm.any():
                 continue
             # Encode I and Q in real/imaginary part of the sequence
-            if IQ_mixing:
-                pulse = self._pulses[i]["pulse"]
-                iq_freq = pulse.iq_frequency
-                if iq_freq == 0: # homodyne pulses are not mixed
-                    continue
-                # calculate I and Q
-                time = np.arange(0, max_len, 1) * timestep - readout_index * timestep # adjust global phase relative to the readout
-                iq_phase = np.exp(1.j *(2 * np.pi * iq_freq * time - np.pi/180 * pulse.phase))
-                wfms[i] = wfms[i] * iq_phase
+            if IQ_mixing and pulse.iq_frequency != 0: # homodyne pulses are not mixed
+                mixed = True
+                # calculate I and Q, the global phase is relative to the readout
+                t = (np.arange(offset, offset + n) - readout_index) * timestep
+                wfm = wfm * np.exp(1.j * (2 * np.pi * pulse.iq_frequency * t - np.pi/180 * pulse.phase))
                 # account for mixer calibration i.e. dc offset and phase != 90deg between I and Q
                 if pulse.iq_angle != 90:
-                    I = np.real(wfms[i])
-                    Q = np.imag(wfms[i] * np.exp(1.j * np.pi /180 * (90 - pulse.iq_angle)))
-                    wfms[i] = I + 1.j * Q
-                wfms[i][wfms[i] != 0] += pulse.iq_dc_offset
-            
-        # generate full waveform from wfms
-        waveform = np.sum(np.array(wfms), axis = 0) + self.dc_corr
-        # make sure first and last point of the waveform go to 0
-        waveform = np.append(0, waveform)
-        waveform = np.append(waveform, 0)
+                    wfm = np.real(wfm) + 1.j * np.imag(wfm * np.exp(1.j * np.pi /180 * (90 - pulse.iq_angle)))
+                wfm[wfm != 0] += pulse.iq_dc_offset
+            waveform[offset + 1:offset + n + 1] += wfm
+        waveform[1:-1] += self.dc_corr
+        if not mixed and not np.iscomplexobj(self.dc_corr):
+            waveform = np.real(waveform).copy()
         return waveform, readout_index + 1 # +1 due to leading 0
 
     def add(self, pulse, skip = False):
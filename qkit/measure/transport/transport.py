@@ -22,7 +22,6 @@ from scipy import signal
 import logging
 import time
 import sys
-import threading
 
 import qkit
 from qkit.storage import store as hdf
@@ -1017,9 +1016,8 @@ class transport(object):
         finally:
             ''' end measurement '''
             qkit.flow.end()
-            t = threading.Thread(target=qviewkit.save_plots, args=[self._data_file.get_filepath(), self._plot_comment])
-            t.start()
             self._data_file.close_file()
+            qviewkit.save_plots_async(self._data_file.get_filepath(), comment=self._plot_comment)
             waf.close_log_file(self._log)
             self._set_IVD_status(False)
             self._filename = None
@@ -1143,11 +1141,13 @@ class transport(object):
             self.sweeps.create_iterator()
             for i in range(self.sweeps.get_nos()):
                 self._data_bias.append(self._data_file.add_coordinate('{:s}_b_{!s}'.format(self._IV_modes[self._bias], i), unit=self._IV_units[self._bias]))
-                self._data_bias[i].add(self._get_bias_values(sweep=self.sweeps.get_sweep()))
-                self._data_I.append(self._data_file.add_value_matrix('I_{!s}'.format(i), x=self._data_x, y=self._data_bias[i], unit='A', save_timestamp=False))
-                self._data_V.append(self._data_file.add_value_matrix('V_{!s}'.format(i), x=self._data_x, y=self._data_bias[i], unit='V', save_timestamp=False))
+                bias_values = self._get_bias_values(sweep=self.sweeps.get_sweep())
+                self._data_bias[i].add(bias_values)
+                shape = (len(self._x_vec), len(bias_values))  # preallocate datasets
+                self._data_I.append(self._data_file.add_value_matrix('I_{!s}'.format(i), x=self._data_x, y=self._data_bias[i], unit='A', save_timestamp=False, shape=shape))
+                self._data_V.append(self._data_file.add_value_matrix('V_{!s}'.format(i), x=self._data_x, y=self._data_bias[i], unit='V', save_timestamp=False, shape=shape))
                 if self._dVdI:
-                    self._data_dVdI.append(self._data_file.add_value_matrix('dVdI_{!s}'.format(i), x=self._data_x, y=self._data_bias[i], unit='V/A', save_timestamp=False, folder='analysis', comment=self._get_numder_comment(self._data_V[i].name)+'/'+self._get_numder_comment(self._data_I[i].name)))
+                    self._data_dVdI.append(self._data_file.add_value_matrix('dVdI_{!s}'.format(i), x=self._data_x, y=self._data_bias[i], unit='V/A', save_timestamp=False, folder='analysis', comment=self._get_numder_comment(self._data_V[i].name)+'/'+self._get_numder_comment(self._data_I[i].name), shape=shape))
                     self._data_file.add_comment(comment='numerical_derivative: '+self._get_numder_comment('x'), folder='analysis')
             # log-function
             self._add_log_value_vector()
@@ -1163,11 +1163,13 @@ class transport(object):
             self.sweeps.create_iterator()
             for i in range(self.sweeps.get_nos()):
                 self._data_bias.append(self._data_file.add_coordinate('{:s}_b_{!s}'.format(self._IV_modes[self._bias], i), unit=self._IV_units[self._bias]))
-                self._data_bias[i].add(self._get_bias_values(sweep=self.sweeps.get_sweep()))
-                self._data_I.append(self._data_file.add_value_box('I_{!s}'.format(i), x=self._data_x, y=self._data_y, z=self._data_bias[i], unit='A', save_timestamp=False))
-                self._data_V.append(self._data_file.add_value_box('V_{!s}'.format(i), x=self._data_x, y=self._data_y, z=self._data_bias[i], unit='V', save_timestamp=False))
+                bias_values = self._get_bias_values(sweep=self.sweeps.get_sweep())
+                self._data_bias[i].add(bias_values)
+                shape = (len(self._x_vec), len(self._y_vec), len(bias_values))  # preallocate datasets
+                self._data_I.append(self._data_file.add_value_box('I_{!s}'.format(i), x=self._data_x, y=self._data_y, z=self._data_bias[i], unit='A', save_timestamp=False, shape=shape))
+                self._data_V.append(self._data_file.add_value_box('V_{!s}'.format(i), x=self._data_x, y=self._data_y, z=self._data_bias[i], unit='V', save_timestamp=False, shape=shape))
                 if self._dVdI:
-                    self._data_dVdI.append(self._data_file.add_value_box('dVdI_{!s}'.format(i), x=self._data_x, y=self._data_y, z=self._data_bias[i], unit='V/A', save_timestamp=False, folder='analysis', comment=self._get_numder_comment(self._data_V[i].name)+'/'+self._get_numder_comment(self._data_I[i].name)))
+                    self._data_dVdI.append(self._data_file.add_value_box('dVdI_{!s}'.format(i), x=self._data_x, y=self._data_y, z=self._data_bias[i], unit='V/A', save_timestamp=False, folder='analysis', comment=self._get_numder_comment(self._data_V[i].name)+'/'+self._get_numder_comment(self._data_I[i].name), shape=shape))
                     self._data_file.add_comment(comment='numerical_derivative: '+self._get_numder_comment('x'), folder='analysis')
             # log-function
             self._add_log_value_vector()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the qkit hdf5 storage layer.
+
+The functions here write synthetic measurement data with the qkit storage
+classes and time the typical access patterns of the measurement scripts
+and the viewer. They can be run standalone, no running qkit instance is
+required.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import qkit
+from qkit.storage.hdf_file import H5_file
+from qkit.storage.store import Data
+from qkit.storage.hdf_constants import ds_types
+
+default_policies = [
+    {'access_pattern':'fixed'},
+    {'access_pattern':'row-append'},
+    {'access_pattern':'column-read'},
+    {'access_pattern':'row-append', 'compression':'lzf', 'shuffle':True},
+    {'access_pattern':'row-append', 'compression':'gzip', 'compression_opts':4, 'shuffle':True},
+]
+
+
+def _time_read(read, repeat):
+    t = time.time()
+    for i in range(repeat):
+        read(i)
+    return (time.time() - t) / repeat
+
+
+def benchmark_storage_options(policies=None, shape=(10, 20, 10001), folder=None, repeat=5, verbose=True):
+    """Compares chunk/compression policies on a synthetic value box.
+
+    For every policy a box of the given shape is written trace by trace (like
+    a 3D VNA scan) and the write throughput is measured. Afterwards the read
+    latency of a single trace, of a matrix at fixed x (the qviewkit 2D view
+    of a box) and of a cut at fixed trace index is measured.
+
+    Args:
+        policies: list of dicts with arguments of hdf_file.storage_options(),
+            default: fixed, row-append, column-read, lzf and gzip compression.
+        shape: tuple (x, y, tracelength) of the box.
+        folder: directory for the temporary files, default: tempdir.
+        repeat: number of repetitions for the read timing.
+        verbose: print the results as a table.
+
+    Returns:
+        list of dicts with the policy, chunks, file size (MB), write
+        throughput (MB/s) and the read latencies (s).
+    """
+    if policies is None:
+        policies = default_policies
+    if folder is None:
+        folder = qkit.cfg.get('tempdir', tempfile.gettempdir())
+    nx, ny, nz = shape
+    rng = np.random.RandomState(0)
+    # noise on a smooth background compresses similar to real VNA data
+    traces = (np.sin(np.linspace(0, 20, nz)) + 1e-3*rng.randn(ny, nz)).astype('f')
+    results = []
+    for policy in policies:
+        fd, path = tempfile.mkstemp(suffix='.h5', dir=folder)
+        os.close(fd)
+        try:
+            hf = H5_file(path, 'w')
+            t = time.time()
+            ds = hf.create_dataset('amplitude', nz, ds_type=ds_types['box'], dim=3,
+                                   shape=shape, storage_opts=policy)
+            for ix in range(nx):
+                for iy in range(ny):
+                    hf.append(ds, traces[iy], next_matrix=(ix > 0 and iy == 0), flush=False)
+            hf.flush()
+            t_write = time.time() - t
+            chunks = ds.chunks
+            hf.close_file()
+            size = os.path.getsize(path) / 1e6
+
+            hf = H5_file(path, 'r')
+            ds = hf['/entry/data0/amplitude']
+            result = {'policy': policy,
+                      'chunks': chunks,
+                      'size_MB': size,
+                      'write_MB_s': nx*ny*nz*traces.itemsize / 1e6 / t_write,
+                      'read_trace_s': _time_read(lambda i: ds[i % nx, i % ny, :], repeat),
+                      'read_matrix_s': _time_read(lambda i: ds[i % nx, :, :], repeat),
+                      'read_column_s': _time_read(lambda i: ds[:, :, (i*nz) // repeat], repeat)}
+            hf.close_file()
+        finally:
+            os.remove(path)
+        results.append(result)
+
+    if verbose:
+        print("%-60s %-16s %9s %9s %10s %10s %10s" % ('policy', 'chunks', 'size/MB', 'MB/s',
+                                                      'trace/ms', 'matrix/ms', 'column/ms'))
+        for r in results:
+            print("%-60s %-16s %9.1f %9.1f %10.2f %10.2f %10.2f" % (
+                r['policy'], r['chunks'], r['size_MB'], r['write_MB_s'],
+                1e3*r['read_trace_s'], 1e3*r['read_matrix_s'], 1e3*r['read_column_s']))
+    return results
+
+
+
+def benchmark_open(n_datasets=(5, 50, 500), tracelength=1001, folder=None, repeat=20, verbose=True):
+    """Compares the open latency of store.Data with eager and lazy mapping.
+    
+    For every number of datasets a file with value vectors of the given
+    length is written. Afterwards the time to open the file with 
+    Data(path, mode='r') and Data(path, mode='r', lazy=True) and to read 
+    the unit of one dataset is measured.
+    
+    Args:
+        n_datasets: list with the number of datasets per file.
+        tracelength: number of points per dataset.
+        folder: directory for the temporary files, default: tempdir.
+        repeat: number of repetitions of the timing.
+        verbose: print the results as a table.
+    
+    Returns:
+        list of dicts with the number of datasets, file size (MB) and the
+        eager and lazy open latencies (s).
+    """
+    if folder is None:
+        folder = qkit.cfg.get('tempdir', tempfile.gettempdir())
+    results = []
+    for n in n_datasets:
+        fd, path = tempfile.mkstemp(suffix='.h5', dir=folder)
+        os.close(fd)
+        os.remove(path)
+        try:
+            d = Data(path, mode='a')
+            x = d.add_coordinate('x', unit='Hz')
+            x.add(np.linspace(0, 1, tracelength))
+            for i in range(n):
+                ds = d.add_value_vector('value_%i' % i, x=x, unit='V', comment='benchmark')
+                ds.append(np.random.rand(tracelength))
+            d.close_file()
+            size = os.path.getsize(path) / 1e6
+
+            def open_file(lazy):
+                d = Data(path, mode='r', lazy=lazy)
+                unit = d.data.value_0.unit
+                d.close_file()
+                return unit
+
+            results.append({'datasets': n,
+                            'size_MB': size,
+                            'eager_open_s': _time_read(lambda i: open_file(False), repeat),
+                            'lazy_open_s': _time_read(lambda i: open_file(True), repeat)})
+        finally:
+            os.remove(path)
+
+    if verbose:
+        print("%10s %9s %10s %10s" % ('datasets', 'size/MB', 'eager/ms', 'lazy/ms'))
+        for r in results:
+            print("%10i %9.1f %10.2f %10.2f" % (r['datasets'], r['size_MB'],
+                                               1e3*r['eager_open_s'], 1e3*r['lazy_open_s']))
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_storage_options()
+    benchmark_open()
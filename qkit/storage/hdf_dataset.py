@@ -11,6 +11,8 @@ import numpy
 import time
 import qkit
 from qkit.storage.hdf_constants import ds_types
+from qkit.storage.hdf_file import storage_option_keys
+from qkit.storage.hdf_overview import Overview
 from qkit.measure.json_handler import QkitJSONEncoder, QkitJSONDecoder
 
 class hdf_dataset(object):
@@ -46,9 +48,18 @@ class hdf_dataset(object):
         self.z_object = z
         self.dim = meta.get('dim', None)
         self.dtype = meta.get('dtype','f')
+        self._shape_hint = meta.get('shape', None)
+        self._storage_opts = dict((k, meta[k]) for k in storage_option_keys if k in meta)
+        # downsampled overview levels of matrices and boxes, see qkit.storage.hdf_overview
+        self._overview_enabled = meta.get('overview', qkit.cfg.get('hdf_overview', False))
+        self._overview = None
         self.ds_type = ds_type
         self._next_matrix = False
         self._save_timestamp = save_timestamp
+        # write buffer, only used if the file is in buffered mode
+        self._buffer = []
+        self._buffer_ts = []
+        self._buffer_next_matrix = False
         
         ## only one information: either 'name' (for creation) or 'ds_url' (for readout)
         if (name and ds_url) or (not name and not ds_url) :
@@ -115,33 +126,107 @@ class hdf_dataset(object):
         else:
             ## we cast everything to a float numpy array
             data = numpy.atleast_1d(numpy.array(data,dtype=self.dtype))
-        # at this point the reference data should be around
-        if self.first:
-            self.first = False
-            if self.ds_type == ds_types['txt']:
-                tracelength = 0
-            else:
-                tracelength = len(data)
-            ## tracelength is used so far only for multi-dimensional datasets to chunk needed memory
+        ## the flush timer of the buffered mode writes from another thread,
+        ## the dataset is created and written under the lock of the file
+        with self.hf.lock:
+            # at this point the reference data should be around
+            if self.first:
+                self.first = False
+                if self.ds_type == ds_types['txt']:
+                    tracelength = 0
+                else:
+                    tracelength = len(data)
+                ## tracelength is used so far only for multi-dimensional datasets to chunk needed memory
             
-            self.ds = self.hf.create_dataset(self.name,tracelength,
-                                             folder=self.folder,
-                                             dim = self.dim,
-                                             ds_type = self.ds_type,
-                                             dtype = self.dtype)
-            self._setup_metadata()
+                self.ds = self.hf.create_dataset(self.name,tracelength,
+                                                 folder=self.folder,
+                                                 dim = self.dim,
+                                                 ds_type = self.ds_type,
+                                                 shape = self._shape_hint,
+                                                 storage_opts = self._storage_opts,
+                                                 dtype = self.dtype)
+                self._setup_metadata()
+                if self._save_timestamp:
+                    self._create_timestamp_ds()
+                if self._overview_enabled and self.ds_type in (ds_types['matrix'], ds_types['box']):
+                    self._overview = Overview(self.hf, self.ds, tracelength, folder=self.folder)
+                    if not self._overview.levels:
+                        self._overview = None
+
+            if self.hf.buffered and self._is_bufferable(data, reset):
+                self._append_to_buffer(data)
+                return
+            # unbuffered write: keep the order of the data in the file
+            self.flush_buffer()
+            self.hf.append(self.ds,data, next_matrix=self._next_matrix, reset = reset, flush = False)
+            if self._overview and not reset:
+                self._overview.append(data, next_matrix=self._next_matrix)
+            if self._next_matrix:
+                self._next_matrix = False
             if self._save_timestamp:
-                self._create_timestamp_ds()
+                self.hf.append(self.ds_ts, numpy.array(time.time()), reset=reset, flush = False)
+
+            self.hf.flush()
+
+    def _is_bufferable(self, data, reset):
+        """Checks if data can be collected in the write buffer.
+        
+        Only the regular appending of values (vector) or whole traces (matrix,
+        box) is buffered. Resets, text and the point-wise filling of matrices
+        are written directly.
+        """
+        if reset or self.ds_type == ds_types['txt']:
+            return False
+        ndim = len(self.ds.shape)
+        if ndim == 2 and len(data) == 1:
+            return False
+        if ndim > 1 and self._buffer and len(self._buffer[0]) != len(data):
+            return False
+        return True
 
-        self.hf.append(self.ds,data, next_matrix=self._next_matrix, reset = reset)
+    def _append_to_buffer(self, data):
         if self._next_matrix:
+            ## a new matrix starts: the traces of the last one are written first
+            self.flush_buffer()
+            self._buffer_next_matrix = True
             self._next_matrix = False
+        if not self._buffer:
+            self.hf.register_buffer(self)
+        self._buffer.append(data)
         if self._save_timestamp:
-            self.hf.append(self.ds_ts, numpy.array(time.time()), reset=reset)
+            self._buffer_ts.append(time.time())
+        flush_rows = self.hf.flush_rows
+        if not flush_rows:
+            ## number of traces (values for a vector) per chunk
+            flush_rows = self.ds.chunks[-2 if len(self.ds.shape) > 1 else 0] if self.ds.chunks else 1
+        if len(self._buffer) >= flush_rows:
+            self.flush_buffer()
+            self.hf.flush()
+
+    def flush_buffer(self):
+        """Writes the buffered data to the hdf file.
+        
+        The dataset is resized once for all buffered traces. The file itself
+        is not flushed, this is left to the H5_file.
+        """
+        if not self._buffer:
+            return
+        with self.hf.lock:
+            if len(self.ds.shape) == 1:
+                block = numpy.concatenate(self._buffer)
+            else:
+                block = numpy.array(self._buffer)
+            self.hf.append_block(self.ds, block, next_matrix=self._buffer_next_matrix)
+            if self._overview:
+                self._overview.append(block, next_matrix=self._buffer_next_matrix)
+            if self._save_timestamp:
+                for ts in self._buffer_ts:
+                    self.hf.append(self.ds_ts, numpy.array(ts), flush = False)
+            self._buffer = []
+            self._buffer_ts = []
+            self._buffer_next_matrix = False
+
 
-        self.hf.flush()
-            
-            
     def add(self,data):
         """Function to save a 1dim dataset once.
         
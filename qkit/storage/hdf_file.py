@@ -7,11 +7,184 @@ Created 2015
 
 """
 import logging
+import threading
 import h5py
 import numpy as np
 import qkit
 from qkit.storage.hdf_constants import ds_types
 
+# keyword arguments of the chunk and compression policy, see storage_options()
+storage_option_keys = ('chunk_bytes', 'access_pattern', 'compression', 'compression_opts', 'shuffle')
+# state of the SWMR mode (see H5_file.start_swmr()), outside of /entry as it is no data:
+#   writing: [1] while the file is written in SWMR mode, [0] after it was closed
+#   fill:    fill state (rows) of the datasets listed in its attribute 'ds_names'
+SWMR_GROUP = '/swmr'
+
+def _swmr_dataset(hf, name):
+    """Returns the dataset 'name' of the SWMR group (refreshed for SWMR readers) or None."""
+    ds = hf.get(SWMR_GROUP + '/' + name)
+    if ds is not None and hf.mode == 'r' and hf.swmr_mode:
+        ds.refresh()
+    return ds
+
+def is_swmr_writing(hf):
+    """True if the h5py File hf is written in SWMR mode by qkit."""
+    writing = _swmr_dataset(hf, 'writing')
+    return writing is not None and bool(writing[0])
+
+def _swmr_fill(ds):
+    """Returns the fill state of ds kept in the SWMR group or None."""
+    fill = _swmr_dataset(ds.file, 'fill')
+    if fill is None:
+        return None
+    names = [n.decode() if isinstance(n, bytes) else n for n in fill.attrs.get('ds_names', [])]
+    if ds.name not in names:
+        return None
+    return fill[names.index(ds.name)]
+
+def filled_rows(ds, axis=0, index=None, fill=None):
+    """Returns the number of rows of a dataset which hold data.
+    
+    Matrices and boxes can be preallocated (see H5_file.create_dataset()), 
+    i.e. their shape is not the number of written traces, the rows after 
+    the written ones are NaN. The number is taken from the 'fill' attribute: 
+    axis 0 counts the traces of a matrix or the matrices of a box, axis 1 
+    the traces in the matrix 'index' of a box. Files written in SWMR mode 
+    keep the fill state in the SWMR group, as attributes can not be changed
+    in SWMR mode. If the fill state is not known (e.g. other files), the 
+    shape is returned.
+    
+    Args:
+        ds: h5py dataset
+        axis: 0 or 1
+        index: matrix of a box for axis 1, negative values count from the 
+            last written matrix, default: the last written matrix
+        fill: fill state of the writer (see H5_file.filled_rows()), 
+            default: the fill state of the file
+    """
+    if len(ds.shape) < 2:
+        return ds.shape[0]
+    if fill is None:
+        fill = _swmr_fill(ds)
+    if fill is None:
+        fill = ds.attrs.get('fill')
+    if fill is None or fill[0] == 0:
+        return ds.shape[axis]
+    matrices = min(int(fill[0]), ds.shape[0])
+    if axis == 0:
+        return matrices
+    if len(ds.shape) == 2:
+        return ds.shape[1]
+    if index is None:
+        index = -1
+    if index < 0:
+        index += matrices
+    if index < matrices - 1:
+        return ds.shape[1]
+    if index == matrices - 1:
+        return min(int(fill[1]), ds.shape[1])
+    return 0
+
+def storage_options(dim, tracelength, dtype='f', shape=None, chunk_bytes=None, access_pattern=None,
+                    compression=None, compression_opts=None, shuffle=None):
+    """Chunk and compression policy for qkit datasets.
+    
+    The chunk shape is derived from the expected access pattern:
+        'fixed' (default): the qkit chunks of 5 (x 5) complete traces.
+        'row-append': chunks hold complete traces, as many as fit into the 
+            target size in bytes. Appending traces and reading single traces
+            or whole matrices (qviewkit) touch only a few chunks.
+        'column-read': chunks are spread over all dimensions, which makes
+            reading a cut at fixed trace index (e.g. one frequency vs. x) fast.
+    The chunks are limited to the shape of the dataset, if it is known, and 
+    to 5 rows along the dimensions of unknown extent, as large chunks of a 
+    short measurement would be mostly empty.
+    Compression is off by default; 'gzip' and 'lzf' as well as the shuffle 
+    filter are supported by every h5py installation.
+    Unset arguments are taken from qkit.cfg ('hdf_chunk_bytes', 
+    'hdf_access_pattern', 'hdf_compression', 'hdf_compression_opts', 
+    'hdf_shuffle').
+    
+    Args:
+        dim: number of dimensions of the dataset (1, 2 or 3)
+        tracelength: length of a trace, i.e. the last dimension
+        dtype: numpy dtype of the data
+        shape: optional full shape of the dataset, chunks are limited to it
+        chunk_bytes: target size of a chunk in bytes
+        access_pattern: 'fixed', 'row-append' or 'column-read'
+        compression: None, 'gzip' or 'lzf'
+        compression_opts: compression level for gzip (0-9)
+        shuffle: boolean, apply the shuffle filter before compression
+    
+    Returns:
+        dict with the 'chunks', 'compression', 'compression_opts' and 
+        'shuffle' arguments for h5py's create_dataset.
+    """
+    if chunk_bytes is None:
+        chunk_bytes = qkit.cfg.get('hdf_chunk_bytes', 256*1024)
+    if access_pattern is None:
+        access_pattern = qkit.cfg.get('hdf_access_pattern', 'fixed')
+    if compression is None:
+        compression = qkit.cfg.get('hdf_compression', None)
+    if compression_opts is None:
+        compression_opts = qkit.cfg.get('hdf_compression_opts', None)
+    if shuffle is None:
+        shuffle = qkit.cfg.get('hdf_shuffle', False)
+    
+    if access_pattern not in ('fixed', 'row-append', 'column-read'):
+        logging.error("Chunk policy: access_pattern '%s' is not 'fixed', 'row-append' or 'column-read'." % (access_pattern))
+        raise ValueError
+    if compression not in (None, 'gzip', 'lzf'):
+        logging.error("Chunk policy: compression '%s' is not supported, use None, 'gzip' or 'lzf'." % (compression))
+        raise ValueError
+    
+    default_rows = 5  # rows per chunk along dimensions of unknown extent
+    itemsize = np.dtype(dtype).itemsize
+    n = max(1, int(chunk_bytes // itemsize))  # elements per chunk
+    tracelength = max(1, int(tracelength))
+    
+    if dim == 1:
+        chunks = True  # let h5py guess
+    elif tracelength == 1:
+        ## point-wise filled matrices and the timestamps of traces grow along
+        ## every dimension, large chunks would be mostly empty
+        chunks = (default_rows, 1) if dim == 2 else (default_rows, default_rows, 1)
+    elif access_pattern == 'fixed':
+        chunks = (default_rows, tracelength) if dim == 2 else (default_rows, default_rows, tracelength)
+    elif access_pattern == 'row-append':
+        ## complete traces per chunk, split only traces exceeding the target size
+        cols = min(tracelength, n)
+        rows = max(1, n // cols)
+        if dim == 2:
+            chunks = (rows, cols)
+        elif shape is not None and rows > shape[1] > 0:
+            ## a whole matrix fits into one chunk, extend the chunk over x
+            rows = int(shape[1])
+            chunks = (max(1, n // (cols*rows)), rows, cols)
+        else:
+            chunks = (1, rows, cols)
+    else:
+        ## balanced chunks over all dimensions
+        cols = min(tracelength, max(1, int(round(n ** (1. / dim)))))
+        if dim == 2:
+            chunks = (max(1, n // cols), cols)
+        else:
+            side = max(1, int((n // cols) ** .5))
+            chunks = (side, side, cols)
+    
+    if chunks is not True:
+        ## limit the rows to the expected extent, to the default rows if unknown
+        extent = tuple(shape) if shape is not None else (0,) * dim
+        chunks = tuple(max(1, min(c, int(s))) if s else (c if i == dim - 1 else min(c, default_rows))
+                       for i, (c, s) in enumerate(zip(chunks, extent)))
+    
+    options = {'chunks': chunks, 'shuffle': bool(shuffle) and compression is not None}
+    if compression is not None:
+        options['compression'] = compression
+        if compression == 'gzip' and compression_opts is not None:
+            options['compression_opts'] = compression_opts
+    return options
+
 class H5_file(object):
     """Base hdf5 class intended for qkit.
     
@@ -25,11 +198,28 @@ class H5_file(object):
     trick of placing added data in the correct position in the dataset.
     """    
     
-    def __init__(self,output_file, mode,**kw):
+    def __init__(self,output_file, mode, swmr = False, **kw):
         """Inits the H5_file at the path 'output_file' with the access mode
         'mode'
+        
+        If 'swmr' is set, the file is opened for SWMR (single writer multiple
+        reader) access: a writer creates the file in the latest hdf5 format
+        and can switch to SWMR mode with start_swmr(), a reader ('r') opens the
+        file as SWMR reader and has to refresh() the datasets.
         """
-        self.create_file(output_file, mode)
+        # write buffering, see set_buffering()
+        self.lock = threading.RLock()
+        self.buffered = False
+        self.flush_rows = None
+        self.flush_interval = 1.
+        self._buffered_datasets = []
+        self._flush_timer = None
+        # SWMR mode, see start_swmr()
+        self.swmr_writing = False
+        self._swmr_capable = False
+        self._swmr_rows = {}
+        
+        self.create_file(output_file, mode, swmr)
         
         if self.hf.attrs.get("qt-file",None) or self.hf.attrs.get("qkit",None):
             "File existed before and was created by qkit."
@@ -42,8 +232,97 @@ class H5_file(object):
             for k in kw:
                 self.grp.attrs[k] = kw[k]
         
-    def create_file(self,output_file, mode):
-        self.hf = h5py.File(output_file, mode)
+    def create_file(self,output_file, mode, swmr = False):
+        self._swmr_capable = bool(swmr) and mode != 'r'
+        if not swmr:
+            self.hf = h5py.File(output_file, mode)
+        elif mode == 'r':
+            self.hf = h5py.File(output_file, mode, libver='latest', swmr=True)
+        else:
+            ## SWMR needs the latest file format, the SWMR mode itself is 
+            ## started when all datasets exist (start_swmr())
+            self.hf = h5py.File(output_file, mode, libver='latest')
+
+    def start_swmr(self):
+        """Switches the file into SWMR (single writer multiple reader) mode.
+        
+        In SWMR mode readers (e.g. qviewkit) can keep the file open and see 
+        the appended data after refreshing their dataset handles, without 
+        reopening the file. The hdf5 library does not allow to create objects
+        or attributes in SWMR mode, i.e. all datasets have to exist (received
+        their first data) before this is called. The fill state of the 
+        matrices and boxes is kept in the dataset SWMR_GROUP/fill, which is 
+        written (unlike attributes) also in SWMR mode. The 'fill' attributes
+        are updated after closing, if the file is not open in a reader.
+        The file has to be opened with swmr=True.
+        
+        Readers can not tell a SWMR file from the hdf5 library, as any file in
+        the latest format can be opened as SWMR reader. The dataset 
+        SWMR_GROUP/writing is set here and cleared on close, see 
+        is_swmr_writing().
+        """
+        with self.lock:
+            if self.swmr_writing:
+                return
+            if not self._swmr_capable:
+                msg = "SWMR mode: file '%s' was not opened with swmr=True." % (self.hf.filename)
+                logging.error(msg)
+                raise ValueError(msg)
+            self.flush()
+            names = []
+            self.hf.visititems(lambda name, obj: names.append(obj.name)
+                               if isinstance(obj, h5py.Dataset) and 'fill' in obj.attrs else None)
+            if SWMR_GROUP in self.hf:
+                del self.hf[SWMR_GROUP]
+            grp = self.hf.create_group(SWMR_GROUP)
+            fill = grp.create_dataset('fill', data=np.array([self.hf[n].attrs['fill'] for n in names],
+                                                            dtype=np.int64).reshape(len(names), 3))
+            fill.attrs.create('ds_names', [n.encode() for n in names])
+            grp.create_dataset('writing', data=np.array([1], dtype=np.int8))
+            self._swmr_rows = dict((n, i) for i, n in enumerate(names))
+            self.flush()
+            self.hf.swmr_mode = True
+            self.swmr_writing = True
+
+    def _stop_swmr(self):
+        """Clears the SWMR mark while the file is still open."""
+        self.hf[SWMR_GROUP + '/writing'][0] = 0
+        self.hf.flush()
+
+    def _get_fill(self, ds):
+        row = self._swmr_rows.get(ds.name) if self.swmr_writing else None
+        if row is not None:
+            return self.hf[SWMR_GROUP + '/fill'][row]
+        return ds.attrs.get('fill')
+
+    def filled_rows(self, ds, axis=0, index=None):
+        """Number of rows of ds holding data, see filled_rows(). 
+        
+        Unlike readers, the writer knows the fill state also in SWMR mode."""
+        return filled_rows(ds, axis, index, fill=self._get_fill(ds))
+
+    def _set_fill(self, ds, fill):
+        if self.swmr_writing:
+            ## attributes can not be written in SWMR mode
+            self.hf[SWMR_GROUP + '/fill'][self._swmr_rows[ds.name]] = fill
+        else:
+            ds.attrs.modify('fill', fill)
+
+    def _write_fill_attributes(self, filename):
+        """Copies the fill state of SWMR_GROUP into the 'fill' attributes.
+        
+        This needs to reopen the file, which fails while a SWMR reader has it
+        open. The fill state stays in SWMR_GROUP then, which is read by 
+        filled_rows(), only other programs see the old attributes."""
+        try:
+            with h5py.File(filename, 'r+') as hf:
+                fill = hf[SWMR_GROUP + '/fill']
+                for ds_name, row in self._swmr_rows.items():
+                    hf[ds_name].attrs.modify('fill', fill[row])
+        except (IOError, OSError, KeyError) as e:
+            logging.warning("SWMR mode: the 'fill' attributes of '%s' are not updated (%s), "
+                            "the fill state is kept in '%s'." % (filename, e, SWMR_GROUP))
+        self._swmr_rows = {}
 
     def set_base_attributes(self):
         "stores some attributes and creates the default data group"
@@ -76,7 +355,7 @@ class H5_file(object):
         self.vgrp = self.entry.require_group("views")
         
     def create_dataset(self,name, tracelength, ds_type = ds_types['vector'],
-                       folder = "data", dim = 1,  **kwargs):
+                       folder = "data", dim = 1, shape = None, storage_opts = None, **kwargs):
         """Dataset for one, two, and three dimensional data
         
             Args:
@@ -90,30 +369,45 @@ class H5_file(object):
                     and are simply appended to the trace array
             
                 'folder' is a optional group relative to the default group
+                
+                'shape' is an optional tuple with the full shape of a matrix or
+                    box, if it is known in advance. The dataset is then created
+                    with this shape (filled with NaNs) and append() writes the
+                    data by index, resizing only if the data exceeds the shape.
+                
+                'storage_opts' is an optional dict with arguments of the chunk 
+                    and compression policy (see storage_options()), e.g.
+                    {'access_pattern':'column-read', 'compression':'lzf'}
             
                 'kwargs' are appended as attributes to the dataset
         """
         self.ds_type = ds_type
+        if self.swmr_writing:
+            logging.error("Create datasets: '%s' can not be created, the file is in SWMR mode." % (name))
+            raise ValueError
         
         if dim == 1:
-            shape    = (0,)
+            init_shape = (0,)
             maxshape = (None,)
-            chunks=True
             
         elif dim == 2:
-            shape    = (0,0)
+            init_shape = (0,0)
             maxshape = (None,None)
-            chunks=(5, tracelength)
             
         elif dim == 3:
-            shape    = (0,0,0)
+            init_shape = (0,0,0)
             maxshape = (None,None,None)
-            chunks=(5, 5, tracelength)
             
         else:
             logging.error("Create datasets: '%s' is wrong number of dims." %(dim))
             raise ValueError
 
+        if shape is not None and dim > 1:
+            if len(shape) != dim:
+                logging.error("Create datasets: shape %s does not match the number of dims (%s)." % (shape, dim))
+                raise ValueError
+            init_shape = tuple(int(s) for s in shape)
+
         if folder == "data":
             self.grp = self.dgrp
         elif folder == "analysis":
@@ -149,9 +443,11 @@ class H5_file(object):
                 # fixme if possible ...
                 
         if ds_type == ds_types['txt']:
-            ds = self.grp.create_dataset(name, shape, maxshape=maxshape, chunks = chunks, dtype=dtype)
+            ds = self.grp.create_dataset(name, init_shape, maxshape=maxshape, chunks = True, dtype=dtype)
         else:
-            ds = self.grp.create_dataset(name, shape, maxshape=maxshape, chunks = chunks, dtype=dtype, fillvalue = np.nan)
+            options = storage_options(dim, tracelength, dtype = dtype,
+                                      shape = shape if dim > 1 else None, **(storage_opts or {}))
+            ds = self.grp.create_dataset(name, init_shape, maxshape=maxshape, dtype=dtype, fillvalue = np.nan, **options)
         
         ds.attrs.create("name",name.encode())
         if ds_type == ds_types['matrix'] or ds_type == ds_types['box']:
@@ -164,7 +460,7 @@ class H5_file(object):
         self.flush()
         return ds
         
-    def append(self,ds,data, next_matrix=False, reset = False):
+    def append(self,ds,data, next_matrix=False, reset = False, flush = True):
         """Method for appending hdf5 data. 
         
         A simple append method for data traces.
@@ -176,6 +472,7 @@ class H5_file(object):
             hdf_dataset 'ds'
             numpy array 'data'
             boolean 'next_matrix'
+            boolean 'flush': flush the file after writing (default True)
             
         Returns:
             The function operates on the given variables.
@@ -222,62 +519,185 @@ class H5_file(object):
         if len(ds.shape) == 2:       
             ## 2 dim dataset: matrix
             ## multiple inputs: list/np.array with one or multiple entries
-            fill = ds.attrs.get('fill')
-            dim1 = ds.shape[1]
+            ## The data is placed according to the 'fill' attribute, the dataset
+            ## is only resized if it is too small (i.e. not preallocated).
+            fill = self._get_fill(ds)
             if len(data) == 1:
-                dim0 = max(1, ds.shape[0])
                 ## single entry; sorting like in the 'len(ds.shape) == 3' case
                 if next_matrix:
-                    dim0 += 1
                     fill[0] += 1
                     fill[1] = 0
-                if dim0 == 1: # very first slice
+                if fill[0] == 0: # very first slice
                     fill[0] = 1
-                    dim1 += 1
-                ds.resize((dim0,dim1))
                 fill[1] += 1
+                self._require_shape(ds, (max(fill[0], ds.shape[0]), max(fill[1], ds.shape[1])))
                 ds[fill[0]-1,fill[1]-1] = data
             else: 
                 ## list of entries, sort the data 'slice by slice'
-                dim0 = ds.shape[0]
                 fill[1] = len(data)
                 if reset:
-                    ds[dim0-1,:] = data  # reset overwrites last data series (last row matrix)
+                    ds[fill[0]-1,:] = data  # reset overwrites last data series (last row matrix)
                 else:  # standard reset = False
                     fill[0] += 1
-                    ds.resize((dim0+1,len(data)))
-                    ds[dim0,:] = data
-            ds.attrs.modify('fill', fill)
+                    self._require_shape(ds, (max(fill[0], ds.shape[0]), len(data)))
+                    ds[fill[0]-1,:] = data
+            self._set_fill(ds, fill)
 
         if len(ds.shape) == 3:      
             ## 3 dim dataset: box
             ## input: np.array with multiple entries
-            dim0 = max(1, ds.shape[0])
-            dim1 = ds.shape[1]
-            fill = ds.attrs.get('fill')
+            ## The number of traces per matrix is defined by the first matrix.
+            fill = self._get_fill(ds)
             if next_matrix:
-                dim0 += 1
                 fill[0] += 1
                 fill[1] = 0
-            if dim0 == 1:
+            if fill[0] == 0:
                 fill[0] = 1
-                dim1 += 1
             if reset:
                 ds[fill[0]-1,fill[1]-2] = data  # reset overwrites last data series
             else:  # standard reset = False
-                ds.resize((dim0,dim1,len(data)))
                 fill[1] += 1
+                self._require_shape(ds, (max(fill[0], ds.shape[0]), max(fill[1], ds.shape[1]), len(data)))
                 ds[fill[0]-1,fill[1]-1] = data
-            ds.attrs.modify("fill", fill)
+            self._set_fill(ds, fill)
 
-        self.flush()
+        if flush:
+            self.flush()
+
+    def append_block(self, ds, block, next_matrix=False):
+        """Method for appending several data traces at once.
+        
+        This is the bulk counterpart of append() used by the write buffer: 
+        the dataset is resized only once for the whole block and the data is 
+        written with a single slice assignment. Only the regular appending 
+        of whole traces is supported here, i.e. single values to a vector, 
+        and complete traces to a matrix or a box.
+        The file is not flushed.
+        
+        Args:
+            hdf_dataset 'ds'
+            numpy array 'block' with one trace (or value) per row
+            boolean 'next_matrix', starts a new matrix in a value_box before 
+                the block is written
+        """
+        n = len(block)
+        if n == 0:
+            return
+        if len(ds.shape) == 1:
+            dim0 = ds.shape[0]
+            ds.resize((dim0+n,))
+            ds[dim0:] = block
+            
+        elif len(ds.shape) == 2:
+            fill = self._get_fill(ds)
+            row = fill[0]
+            fill[0] += n
+            fill[1] = block.shape[1]
+            self._require_shape(ds, (max(fill[0], ds.shape[0]), block.shape[1]))
+            ds[row:fill[0],:] = block
+            self._set_fill(ds, fill)
+            
+        elif len(ds.shape) == 3:
+            ## same sorting as in append(): the first matrix defines the
+            ## number of traces per matrix
+            fill = self._get_fill(ds)
+            if next_matrix:
+                fill[0] += 1
+                fill[1] = 0
+            if fill[0] == 0:
+                fill[0] = 1
+            row = fill[1]
+            fill[1] += n
+            self._require_shape(ds, (max(fill[0], ds.shape[0]), max(fill[1], ds.shape[1]), block.shape[1]))
+            ds[fill[0]-1, row:fill[1]] = block
+            self._set_fill(ds, fill)
+
+    def _require_shape(self, ds, shape):
+        """Resizes the dataset, but only if the shape really changes."""
+        if ds.shape != shape:
+            ds.resize(shape)
+
+    def set_buffering(self, buffered=True, flush_rows=None, flush_interval=1.):
+        """Enables (or disables) the buffered write mode.
         
+        In buffered mode hdf_dataset.append() collects the data in memory and 
+        writes it in blocks. The buffers are written (and the file flushed) 
+        when either a dataset buffer holds 'flush_rows' traces or the oldest 
+        buffered data is older than 'flush_interval' seconds. A timer makes 
+        sure that buffered data shows up in the file (e.g. in qviewkit) 
+        after at most 'flush_interval' seconds, also if the measurement 
+        stalls. Remaining data is written on flush() and close_file().
+        
+        Args:
+            buffered: boolean, switch the buffered mode on or off
+            flush_rows: number of traces a dataset buffer holds before it is 
+                written, default: number of traces per chunk of the dataset
+            flush_interval: maximum time in seconds the data is kept in memory
+        """
+        with self.lock:
+            if not buffered:
+                self.flush()
+            self.buffered = buffered
+            self.flush_rows = flush_rows
+            self.flush_interval = flush_interval
+
+    def register_buffer(self, hdf_ds):
+        """Registers an hdf_dataset whose buffer is written on flush().
+        
+        Called when data is put into the empty buffer of hdf_ds, this starts 
+        the flush timer if it is not running.
+        """
+        with self.lock:
+            if hdf_ds not in self._buffered_datasets:
+                self._buffered_datasets.append(hdf_ds)
+            self._start_flush_timer()
+
+    def _start_flush_timer(self):
+        if self._flush_timer is None and self.flush_interval:
+            self._flush_timer = threading.Timer(self.flush_interval, self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _timed_flush(self):
+        ## the timer is started again by register_buffer() when new data
+        ## is buffered, i.e. it only runs while rows are pending
+        with self.lock:
+            self._flush_timer = None
+            if not self.hf or not any(hdf_ds._buffer for hdf_ds in self._buffered_datasets):
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("Buffered flush of '%s' failed: %s" % (self.hf.filename, e))
+
+    def flush_buffers(self):
+        """Writes all buffered data to the file without flushing it."""
+        with self.lock:
+            for hdf_ds in self._buffered_datasets:
+                hdf_ds.flush_buffer()
+
     def flush(self):
-        self.hf.flush()
+        with self.lock:
+            self.flush_buffers()
+            self.hf.flush()
         
     def close_file(self):
-        # delegate close 
-        self.hf.close()
+        # write remaining buffers and stop the flush timer before closing
+        with self.lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            filename = None
+            if self.hf:
+                self.flush_buffers()
+                filename = self.hf.filename
+                if self.swmr_writing:
+                    self._stop_swmr()
+            # delegate close 
+            self.hf.close()
+            if self.swmr_writing and filename:
+                self.swmr_writing = False
+                self._write_fill_attributes(filename)
         
     def __getitem__(self,s):
         return self.hf[s]
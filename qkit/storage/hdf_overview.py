@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution overview datasets for large matrices and boxes.
+
+A matrix (traces x tracelength) or a box (matrices x traces x tracelength)
+can be shown on the screen with only a few thousand pixels per axis. The
+overview levels hold the data decimated by factor**k (k = 1, 2, ...) along
+the traces and along the tracelength, until the tracelength fits into
+min_size points. For every block of factor**k x factor**k points the
+minimum, maximum and mean are stored:
+
+    /entry/overview0/<folder>_<name>_<factor>    shape (traces, tracelength, 3)
+                                                 or (matrices, traces, tracelength, 3)
+
+The levels are updated while the data is appended, the last (incomplete)
+block of traces is rewritten with every new trace. Overviews are switched on
+with qkit.cfg['hdf_overview'] = True or per dataset with overview=True, e.g.
+    data.add_value_matrix('amplitude', x=power, y=freq, unit='V', overview=True)
+
+Readers pick a level with select_level(); qviewkit and qkit.gui.plot use the
+mean values of the coarsest level which still resolves the displayed range.
+Point-wise filled matrices and resets of the last trace are not reflected in
+the overviews.
+"""
+import logging
+import warnings
+
+import numpy as np
+import qkit
+
+OVERVIEW_GROUP = '/entry/overview0'
+STATS = ('min', 'max', 'mean')
+
+
+def overview_factors(tracelength, factor=None, min_size=None):
+    """
+    Returns the decimation factors of the overview levels for a tracelength.
+    Unset arguments are taken from qkit.cfg ('hdf_overview_factor', 'hdf_overview_min_size').
+    """
+    if factor is None:
+        factor = qkit.cfg.get('hdf_overview_factor', 4)
+    if min_size is None:
+        min_size = qkit.cfg.get('hdf_overview_min_size', 512)
+    factors = []
+    f = factor
+    while factor > 1 and -(-tracelength // (f // factor)) > min_size:
+        factors.append(f)
+        f *= factor
+    return factors
+
+
+def get_levels(ds):
+    """
+    Returns a list of (factor, ds_url) of the overview levels of the h5py dataset ds, finest first.
+    """
+    grp = ds.file.get(OVERVIEW_GROUP)
+    if grp is None:
+        return []
+    levels = []
+    for name, ov in grp.items():
+        source = ov.attrs.get('source', b'')
+        if isinstance(source, bytes):
+            source = source.decode()
+        if source == ds.name:
+            levels.append((int(ov.attrs['factor']), ov.name))
+    return sorted(levels)
+
+
+def select_level(ds, rows, cols, min_rows, min_cols, levels=None):
+    """
+    Chooses the coarsest overview level which keeps at least min_rows x min_cols
+    points of a (visible) range of rows x cols points of ds.
+
+    Returns:
+        (factor, ds_url) of the level, (1, None) if the full data is needed.
+    """
+    if levels is None:
+        levels = get_levels(ds)
+    best = (1, None)
+    for factor, url in levels:
+        if rows / float(factor) >= min_rows and cols / float(factor) >= min_cols:
+            best = (factor, url)
+    return best
+
+
+class Overview(object):
+    """
+    Writes the overview levels of one matrix or box dataset.
+
+    Args:
+        hf: H5_file of the dataset.
+        ds: h5py dataset (matrix or box).
+        tracelength: length of the traces.
+        folder: folder of the dataset ('data' or 'analysis').
+    """
+
+    def __init__(self, hf, ds, tracelength, folder='data'):
+        self.box = len(ds.shape) == 3
+        self.tracelength = tracelength
+        self._matrix = -1
+        self.levels = []
+        grp = hf.hf.require_group(OVERVIEW_GROUP)
+        name = ds.name.split('/')[-1]
+        for factor in overview_factors(tracelength):
+            m = -(-tracelength // factor)
+            ov_name = '%s_%s_%i' % (folder, name, factor)
+            if ov_name in grp:
+                del grp[ov_name]
+            if self.box:
+                shape, chunks = (0, 0, m, 3), (1, 16, m, 3)
+            else:
+                shape, chunks = (0, m, 3), (16, m, 3)
+            ov = grp.create_dataset(ov_name, shape, maxshape=(None,) * len(shape), chunks=chunks,
+                                    dtype='f', fillvalue=np.nan)
+            ov.attrs.create('source', ds.name.encode())
+            ov.attrs.create('factor', factor)
+            ov.attrs.create('stats', ','.join(STATS).encode())
+            self.levels.append({'ds': ov, 'factor': factor, 'row': 0, 'n': 0})
+
+    def append(self, block, next_matrix=False):
+        """
+        Adds traces (one per row of block) to the overview levels.
+        """
+        block = np.atleast_2d(np.asarray(block, dtype=np.float64))
+        if block.shape[1] != self.tracelength:
+            logging.error("Overview: tracelength changed from %i to %i, the overview is not updated anymore."
+                          % (self.tracelength, block.shape[1]))
+            self.levels = []
+            return
+        if next_matrix:
+            self._matrix += 1
+            for level in self.levels:
+                level['row'], level['n'] = 0, 0
+        if self._matrix < 0:
+            self._matrix = 0
+        for level in self.levels:
+            self._append_level(level, block)
+
+    def _append_level(self, level, block):
+        factor = level['factor']
+        mn, mx, me = self._reduce_traces(block, factor)
+        i = 0
+        while i < len(block):
+            take = min(factor - level['n'], len(block) - i)
+            b_min = np.fmin.reduce(mn[i:i + take], axis=0)
+            b_max = np.fmax.reduce(mx[i:i + take], axis=0)
+            b_sum = np.nansum(me[i:i + take], axis=0)
+            b_cnt = np.sum(~np.isnan(me[i:i + take]), axis=0)
+            if level['n'] == 0:
+                level['min'], level['max'], level['sum'], level['cnt'] = b_min, b_max, b_sum, b_cnt
+            else:
+                level['min'] = np.fmin(level['min'], b_min)
+                level['max'] = np.fmax(level['max'], b_max)
+                level['sum'] = level['sum'] + b_sum
+                level['cnt'] = level['cnt'] + b_cnt
+            level['n'] += take
+            i += take
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = level['sum'] / level['cnt']
+            self._write(level, np.stack([level['min'], level['max'], mean], axis=-1))
+            if level['n'] == factor:
+                level['row'] += 1
+                level['n'] = 0
+
+    def _reduce_traces(self, block, factor):
+        """min, max and mean of blocks of factor points along the traces."""
+        n, length = block.shape
+        m = -(-length // factor)
+        if m * factor != length:
+            padded = np.full((n, m * factor), np.nan)
+            padded[:, :length] = block
+            block = padded
+        block = block.reshape(n, m, factor)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # blocks with NaNs only
+            return np.nanmin(block, axis=2), np.nanmax(block, axis=2), np.nanmean(block, axis=2)
+
+    def _write(self, level, data):
+        ov = level['ds']
+        if self.box:
+            index = (self._matrix, level['row'])
+        else:
+            index = (level['row'],)
+        shape = tuple(max(s, i + 1) for s, i in zip(ov.shape, index)) + ov.shape[len(index):]
+        if shape != ov.shape:
+            ov.resize(shape)
+        ov[index] = data
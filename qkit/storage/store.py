@@ -19,6 +19,36 @@ from qkit.storage.hdf_DateTimeGenerator import DateTimeGenerator
 
 
 
+class _lazy_group(object):
+    """Stand-in for the 'data' and 'analysis' group of a lazily opened Data object.
+    
+    The datasets of the hdf group and their attributes are looked up on
+    first access and then cached, like the eager mapping of Data does it
+    for all datasets on open.
+    """
+    def __init__(self, h5_group):
+        self._h5_group = h5_group
+
+    def __getattr__(self, name):
+        # only called if the name is not yet in self.__dict__
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name == 'comment':
+            value = self._h5_group.attrs.get('comment', '')
+        else:
+            try:
+                value = self._h5_group[name]
+            except KeyError:
+                raise AttributeError("No dataset '%s' in '%s'." % (name, self._h5_group.name))
+            for nn, oo in value.attrs.items():
+                value.__dict__[nn] = oo
+        self.__dict__[name] = value
+        return value
+
+    def __dir__(self):
+        return list(self._h5_group.keys()) + ['comment']
+
+
 class Data(object):
     """Basic hdf5 class adopted to our needs.
     
@@ -26,9 +56,15 @@ class Data(object):
     is based in its core on h5py as well as our own adaptions in hdf_view, 
     hdf_file, and hdf_dataset. Here mostly have wrapper that operate on the
     mentioned classes.
+    
+    The chunk and compression policy of the value datasets can be set per 
+    dataset with the keyword arguments 'chunk_bytes', 'access_pattern', 
+    'compression', 'compression_opts' and 'shuffle' of the add_value_* 
+    functions, see qkit.storage.hdf_file.storage_options().
     """
     # a types
-    def __init__(self, name = None, mode = 'r+', copy_file = False):
+    def __init__(self, name = None, mode = 'r+', copy_file = False, buffered = None,
+                 flush_rows = None, flush_interval = None, swmr = None, lazy = False):
         """Creates an empty data set including the file, for which the currently
         set file name generator is used or opens the h5 file at location 'name'.
 
@@ -36,6 +72,20 @@ class Data(object):
             name (string):  filename or absolute filepath
             mode (string):  access mode to the hdf5 file, default: 'r+' (read+write).
                 Other modes are 'a' (read, write, and create)
+            buffered (bool): collect appended data in memory and write it in
+                blocks, default: qkit.cfg['hdf_buffered'] or False.
+            flush_rows (int): number of traces buffered per dataset, default:
+                qkit.cfg['hdf_flush_rows'] or the chunk size of the dataset.
+            flush_interval (float): maximum time in seconds data is buffered,
+                default: qkit.cfg['hdf_flush_interval'] or 1 s.
+            swmr (bool): open the file for SWMR (single writer multiple reader)
+                access. Writers use the latest hdf5 file format and switch to
+                SWMR mode with start_swmr(), readers (mode 'r') open the file
+                as SWMR reader. Default for writers: qkit.cfg['hdf_swmr'] or False.
+            lazy (bool): resolve the datasets in data.data and data.analysis 
+                and their attributes on first access instead of on open. 
+                Data(path, mode='r', lazy=True) is the fast way to open many 
+                files, e.g. in analysis batch jobs.
         """
         self._name = name
         if os.path.isfile(self._name):
@@ -51,12 +101,23 @@ class Data(object):
             self._filepath = os.path.abspath(self._name)
             self._folder,self._filename = os.path.split(self._filepath)
         "setup the  file"
+        if swmr is None:
+            swmr = qkit.cfg.get('hdf_swmr', False) and mode != 'r'
         try:
-            self.hf = H5_file(self._filepath, mode)
+            self.hf = H5_file(self._filepath, mode, swmr = swmr)
         except IOError:
             raise IOError('File does not exist. Use argument \"mode=\'a\'\" to create a new h5 file.')
-        self._mapH5PathToObject()
-        self.hf.flush()
+        if buffered is None:
+            buffered = qkit.cfg.get('hdf_buffered', False)
+        if buffered:
+            self.set_buffering(True, flush_rows, flush_interval)
+        if lazy:
+            self.__dict__.update({'analysis':_lazy_group(self.hf.agrp)})
+            self.__dict__.update({'data':_lazy_group(self.hf.dgrp)})
+        else:
+            self._mapH5PathToObject()
+        if mode != 'r':
+            self.hf.flush()
 
     def _mapH5PathToObject(self):
         """Function for automated data readout at Data object creation.
@@ -191,7 +252,7 @@ class Data(object):
                           comment=comment, folder=folder, dim = 1, **meta)
         return ds
 
-    def add_value_matrix(self, name, x , y, unit = "", comment = "",folder="data",**meta):
+    def add_value_matrix(self, name, x , y, unit = "", comment = "",folder="data", shape = None, **meta):
         """Adds a 2dim dataset to the h5 file.
         
         This function is a wrapper to create a hdf_dataset object with some 
@@ -206,15 +267,21 @@ class Data(object):
             unit: Optional string.
             comment: Optional string to put in any comment.
             folder: Optional string ('data' or 'analysis').
+            shape: Optional tuple (len(x), len(y)). If the size of the matrix is
+                known in advance, the dataset is preallocated (filled with NaNs)
+                and the data is written row by row without resizing the dataset.
+            overview: Optional boolean, also write downsampled overview levels
+                for fast plotting (default: qkit.cfg['hdf_overview']), see
+                qkit.storage.hdf_overview.
         
         Returns:
             hdf_dataset object.
         """
         ds =  hdf_dataset(self.hf, name, x=x, y=y, unit=unit, ds_type = ds_types['matrix'],
-                          comment=comment, folder=folder, dim = 2, **meta)
+                          comment=comment, folder=folder, dim = 2, shape = shape, **meta)
         return ds
 
-    def add_value_box(self, name, x , y, z, unit = "", comment = "",folder="data",**meta):
+    def add_value_box(self, name, x , y, z, unit = "", comment = "",folder="data", shape = None, **meta):
         """Adds a 3dim dataset to the h5 file.
         
         This function is a wrapper to create a hdf_dataset object with some 
@@ -230,12 +297,18 @@ class Data(object):
             unit: Optional string.
             comment: Optional string to put in any comment.
             folder: Optional string ('data' or 'analysis').
+            shape: Optional tuple (len(x), len(y), len(z)). If the size of the 
+                box is known in advance, the dataset is preallocated (filled 
+                with NaNs) and the data is written without resizing the dataset.
+            overview: Optional boolean, also write downsampled overview levels
+                for fast plotting (default: qkit.cfg['hdf_overview']), see
+                qkit.storage.hdf_overview.
         
         Returns:
             hdf_dataset object.
         """        
         ds =  hdf_dataset(self.hf,name, x=x, y=y, z=z, unit=unit, ds_type = ds_types['box'],
-                          comment=comment, folder=folder, dim = 3, **meta)
+                          comment=comment, folder=folder, dim = 3, shape = shape, **meta)
         return ds
 
     def add_view(self,name,x = None, y = None, error = None, filter  = None, view_params = {}):
@@ -271,6 +344,36 @@ class Data(object):
     def get_dataset(self,ds_url):
         return hdf_dataset(self.hf,ds_url = ds_url)
 
+    def set_buffering(self, buffered = True, flush_rows = None, flush_interval = None):
+        """Switches the buffered write mode of the file on or off.
+        
+        In buffered mode, the data appended to value vectors, matrices and boxes
+        is collected in memory and written in blocks, which avoids a resize 
+        and a flush of the file for every single datapoint. The buffers are 
+        written when they hold 'flush_rows' traces, at the latest after 
+        'flush_interval' seconds, and on flush() and close_file().
+        
+        Args:
+            buffered: Boolean to switch the buffered mode on or off.
+            flush_rows: Optional number of traces buffered per dataset.
+            flush_interval: Optional maximum buffering time in seconds.
+        """
+        if flush_rows is None:
+            flush_rows = qkit.cfg.get('hdf_flush_rows', None)
+        if flush_interval is None:
+            flush_interval = qkit.cfg.get('hdf_flush_interval', 1.)
+        self.hf.set_buffering(buffered, flush_rows=flush_rows, flush_interval=flush_interval)
+
+    def start_swmr(self):
+        """Switches the file into SWMR (single writer multiple reader) mode.
+        
+        Live readers like qviewkit can then keep the file open and refresh
+        their dataset handles instead of reopening the file. No datasets can
+        be added in SWMR mode, so this has to be called after every dataset
+        received its first data. The file has to be opened with swmr=True.
+        """
+        self.hf.start_swmr()
+
     def save_finished(self):
         pass
 